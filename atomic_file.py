@@ -0,0 +1,27 @@
+import contextlib
+import os
+import tempfile
+
+
+"""Write a file so that readers see either the old contents or the new, never a mix
+
+    with atomic_file.writing(path, "wb") as f:
+        f.write(data)
+
+writes to a temporary file of its own in the same directory and moves it over
+path once the block finishes, so threads or processes writing the same path at
+once cannot clobber each other's half-written file. If the block fails, the
+temporary file is removed and path is left alone."""
+
+
+@contextlib.contextmanager
+def writing(path, mode="wb"):
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with open(fd, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,168 @@
+import os
+import re
+import shlex
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import fide_cache
+import http_cache
+import icu_codes
+import name_splits
+import parsechessresults
+
+
+"""Batch mode for parsechessresults.py: many events in one run
+
+The manifest has one event per line:
+
+    source [rounds] [fed=IRL] [team=Gonzaga ...] [output.csv]
+
+where source and rounds are what parsechessresults.py takes on the command line,
+fed= picks the players from a whole-tournament crosstable, and each team= adds a
+4NCL team to output, like --team (quote names with spaces: team="Celtic Tigers").
+Blank lines and lines starting with # are ignored. Without an output name the
+file is called after the line number and the event name.
+
+All pages are first fetched together on a thread pool into the HTTP cache.
+Each event is then parsed on a process pool, reading only from the cache,
+because building the BeautifulSoup trees is CPU-bound.
+
+With --icu-list, ICU codes are filled in from the index built by icu_codes.py,
+and with --fide-list 4NCL opponents are looked up in the FIDE list. Both are
+built once before the workers start and each worker loads the saved copy.
+
+Usage: python parsechessresults.py --batch season.txt --out-dir csv [--workers 4] [--icu-list members.csv]"""
+
+
+class Job:
+    def __init__(self, line_no, source, rounds=None, output=None, fed=None, teams=None):
+        self.line_no = line_no
+        self.source = source
+        self.rounds = rounds
+        self.output = output
+        self.fed = fed
+        self.teams = teams
+
+
+def read_manifest(path):
+    jobs = []
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            tokens = shlex.split(line)
+            source = tokens.pop(0)
+            output = tokens.pop() if tokens and tokens[-1].endswith(".csv") else None
+            feds = [token[4:] for token in tokens if token.startswith("fed=")]
+            teams = [token[5:] for token in tokens if token.startswith("team=")]
+            tokens = [token for token in tokens if not token.startswith(("fed=", "team="))]
+            rounds = tokens[0] if tokens else None
+            jobs.append(Job(line_no, source, rounds, output, feds[0] if feds else None, teams or None))
+    return jobs
+
+def job_urls(job):
+    """[(url, insecure)] that parsing the job will fetch"""
+    if not job.source.startswith("http"):
+        return []
+    if "4nclresults.co.uk" in job.source:
+        if job.rounds is None:
+            return []
+        return [(url, True) for rd, url in parsechessresults.fourncl_round_urls(job.source, job.rounds)]
+    return [(job.source, False)]
+
+def prefetch(jobs, cache, workers=parsechessresults.FETCH_WORKERS):
+    """Fetch every page the jobs need into the cache. Returns {url : error} for the
+    pages that could not be fetched, for the jobs to report."""
+    urls = [url for job in jobs for url in job_urls(job)]
+    errors = {}
+    if not urls:
+        return errors
+
+    def fetch(url_insecure):
+        try:
+            cache.fetch(*url_insecure)
+        except Exception as e:
+            errors[url_insecure[0]] = "%s: %s" % (type(e).__name__, e)
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(urls))) as pool:
+        list(pool.map(fetch, urls))
+    return errors
+
+def output_filename(job, event):
+    if job.output:
+        return job.output
+    return "%03d_%s.csv" % (job.line_no, re.sub(r"[^\w-]+", "_", event or "event").strip("_"))
+
+def run_job(job, out_dir, cache_settings, icu_list=None, names=None, fide_list=None,
+            fetch_errors=None):
+    """Parse one event and write its ICU-CSV. Runs in a worker process, so it
+    returns a plain dict summarising what happened rather than raising.
+    fetch_errors are the prefetch errors for the job's pages; if the job fails,
+    they are reported instead of the offline cache miss they lead to."""
+    http_cache.configure(**cache_settings)
+    name_splits.configure(names)
+    start = time.perf_counter()
+    result = {"line": job.line_no, "source": job.source, "ok": False, "players": 0, "output": None, "error": None}
+    fide = None
+    try:
+        if fide_list:
+            fide = fide_cache.load(fide_list)
+        event, players = parsechessresults.parse(job.source, job.rounds, job.fed, job.teams, fide_list=fide)
+        if icu_list:
+            icu_codes.assign_codes(players, icu_codes.load(icu_list))
+        path = os.path.join(out_dir, output_filename(job, event))
+        with open(path, "w") as f:
+            f.write(parsechessresults.format_output(event, players, job.source) + "\n")
+        result.update(ok=True, players=len(players), output=path)
+    except Exception as e:
+        if fetch_errors:
+            result["error"] = "; ".join("fetching %s failed: %s" % (url, error) for url, error in fetch_errors.items())
+        else:
+            result["error"] = "%s: %s" % (type(e).__name__, e)
+    finally:
+        if fide is not None:
+            fide.close()
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def run(manifest, out_dir=".", workers=None, fetch_workers=parsechessresults.FETCH_WORKERS, icu_list=None,
+        names=None, fide_list=None):
+    """Process every event in the manifest, print a summary to stderr and return
+    the list of run_job results in manifest order"""
+    start = time.perf_counter()
+    jobs = read_manifest(manifest)
+    os.makedirs(out_dir, exist_ok=True)
+    cache = http_cache.default_cache
+
+    cache_settings = dict(cache.settings)
+    fetch_errors = {}
+    if cache.enabled:
+        fetch_errors = prefetch(jobs, cache, fetch_workers)
+        # everything the jobs can fetch is in the cache now
+        cache_settings["offline"] = True
+    # build the indexes once here, so the workers only load them
+    if icu_list:
+        icu_codes.load(icu_list)
+    if fide_list:
+        fide_cache.load(fide_list).close()
+    fetched = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(run_job, jobs, [out_dir] * len(jobs), [cache_settings] * len(jobs),
+                                [icu_list] * len(jobs), [names] * len(jobs), [fide_list] * len(jobs),
+                                [{url: fetch_errors[url] for url, _ in job_urls(job) if url in fetch_errors}
+                                 for job in jobs]))
+
+    for result in results:
+        if result["ok"]:
+            print("ok      %3d players %6.2fs  %s -> %s" % (result["players"], result["seconds"],
+                  result["source"], result["output"]), file=sys.stderr)
+        else:
+            print("FAILED              %6.2fs  %s (line %d): %s" % (result["seconds"],
+                  result["source"], result["line"], result["error"]), file=sys.stderr)
+    succeeded = sum(1 for result in results if result["ok"])
+    print("%d succeeded, %d failed; fetch %.2fs, parse %.2fs, total %.2fs" % (
+        succeeded, len(results) - succeeded, fetched - start, time.perf_counter() - fetched,
+        time.perf_counter() - start), file=sys.stderr)
+    return results
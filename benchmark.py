@@ -0,0 +1,344 @@
+import argparse
+import datetime
+import gc
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import bs4
+from openpyxl import Workbook, load_workbook
+
+import fide_cache
+import fide_stats
+import parse_fide
+import parsechessresults
+
+
+"""Offline benchmarks for the parsers, on recorded fixtures and synthetic inputs
+
+Nothing is fetched. The chess-results, 4NCL and Excel parsers are timed on
+generated pages and workbooks with a growing number of players, the individual
+page parser on the recorded data/belyaladya1.html, and parse_fide.py's
+statistics on generated FIDE lists in XML and TXT, and from the column cache.
+Start-up is timed in fresh interpreters: importing parsechessresults, which
+must stay within STARTUP_BUDGET, and a whole command line run on a saved page.
+
+Each benchmark is run once for time, and once more under tracemalloc for the
+peak memory Python allocated (skip that with --no-memory). The results are
+written as JSON, and --compare prints each one against an earlier run, marking
+those that are more than --threshold slower or bigger.
+
+Usage:
+    python benchmark.py --output bench.json
+    python benchmark.py --sizes 100 1000 --fide-sizes 10000 1000000 --output new.json --compare bench.json
+    python benchmark.py --only fide --quick
+    python benchmark.py --only startup"""
+
+DEFAULT_SIZES = [100, 1000, 10000]
+DEFAULT_FIDE_SIZES = [10000, 100000, 1000000]
+QUICK_SIZES = [10, 100]
+QUICK_FIDE_SIZES = [1000]
+ROUNDS = 9
+FEDS = ["IRL", "ENG", "GER", "NED", "SCO", "FRA", "ESP", "IND", "USA", "RUS"]
+TITLES = ["", "", "", "", "", "", "FM", "IM", "GM", "WFM", "CM"]
+RECORDED_PAGE = "data/belyaladya1.html"
+# seconds to import parsechessresults; about 0.06 measured, against 0.33 when
+# bs4, openpyxl and ssl were all imported up front
+STARTUP_BUDGET = 0.25
+IMPORT_SCRIPT = ("import time; start = time.perf_counter(); import parsechessresults; "
+                 "print(time.perf_counter() - start)")
+TXT_HEADER = ("ID Number      Name                                                         Fed Sex Tit  WTit OTit"
+              "           FOA SRtng SGm SK RRtng RGm Rk BRtng BGm BK B-day Flag ")
+
+
+# synthetic inputs. Everything is made from one seeded Random, so runs are comparable
+
+def word(rng):
+    return "".join(rng.choice("aeioulnrstmcdghbkp") for _ in range(rng.randint(3, 9))).title()
+
+def names(rng, n):
+    """n distinct "Surname Forename" names"""
+    seen = set()
+    while len(seen) < n:
+        seen.add("%s %s" % (word(rng), word(rng)))
+    return sorted(seen, key=lambda name: rng.random())
+
+def fide_players(n, rng):
+    for fideid in range(1, n + 1):
+        rating = rng.choice([None, rng.randint(1000, 2800)])
+        yield parse_fide.FidePlayer(fideid, "%s, %s" % (word(rng), word(rng)), rng.choice(FEDS),
+            rng.choice("MMMF"), rng.choice(TITLES), rating, rng.choice([None, rng.randint(1000, 2700)]),
+            rng.choice([None, rng.randint(1000, 2700)]), rng.randint(1930, 2015), rng.choice(["", "", "i", "wi", "w"]))
+
+def write_fide_xml(path, n, rng):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<playerslist>\n')
+        for p in fide_players(n, rng):
+            f.write("<player><fideid>%d</fideid><name>%s</name><country>%s</country><sex>%s</sex>"
+                    "<title>%s</title><w_title></w_title><o_title></o_title><foa_title></foa_title>"
+                    "<rating>%s</rating><games>0</games><k>20</k><rapid_rating>%s</rapid_rating>"
+                    "<rapid_games></rapid_games><rapid_k></rapid_k><blitz_rating>%s</blitz_rating>"
+                    "<blitz_games></blitz_games><blitz_k></blitz_k><birthday>%d</birthday><flag>%s</flag></player>\n" % (
+                    p.fideid, p.name, p.country, p.sex, p.title, p.rating or "", p.rapid_rating or "",
+                    p.blitz_rating or "", p.birthday, p.flag))
+        f.write("</playerslist>\n")
+
+def write_fide_txt(path, n, rng):
+    columns = parse_fide.txt_columns(TXT_HEADER)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(TXT_HEADER + "\n")
+        for p in fide_players(n, rng):
+            line = ""
+            for field in parse_fide.FidePlayer.__slots__:
+                start, end = columns[field]
+                value = getattr(p, field)
+                line = line.ljust(start) + ("" if value is None else str(value))
+                if end is not None:
+                    line = line[:end].ljust(end)
+            f.write(line.rstrip() + "\n")
+
+def page(event, body):
+    return ("<!DOCTYPE html>\n<html>\n<head>\n<title>Chess-Results Server Chess-results.com - %s</title>\n"
+            "</head>\n<body>\n%s\n</body>\n</html>\n" % (event, body)).encode("utf-8")
+
+def team_page(n, rng, rounds=ROUNDS):
+    """a chess-results team composition page for n players"""
+    rows = ['<tr class="CRg1b"><td class="CRc">Rd.</td><td class="CRc">SNo</td><td class="CR"></td>'
+            '<td class="CR">Name</td><td class="CRr">Rtg</td><td class="CR">FED</td><td class="CRr">Rp</td>'
+            '<td class="CRc">Pts.</td><td class="CRc">Res.</td><td class="CRc">Bo.</td></tr>']
+    opponents = names(rng, 50)
+    for name in names(rng, n):
+        rows.append('<tr><td class="CR" colspan="10">%s %d</td></tr>' % (name, rng.randint(1200, 2400)))
+        for rd in range(1, rounds + 1):
+            rows.append('<tr class="CRg2">' + "".join('<td class="CR">%s</td>' % value for value in (
+                rd, rng.randint(1, 200), rng.choice(TITLES), rng.choice(opponents), rng.randint(1200, 2500),
+                rng.choice(FEDS), 2000, "4,0", rng.choice(["w 1", "s ½", "w 0", "s 1"]), 1)) + "</tr>")
+    return page("Synthetic Team Event", '<div class="defaultDialog"><h2>Synthetic Team Event</h2><table><tr>'
+        '<td class="CR">Team composition with round-results</td></tr></table></div>'
+        '<div class="defaultDialog"><h2>Player info</h2><table class="CRs1">\n%s\n</table></div>' % "\n".join(rows))
+
+def crosstable_page(n, rng, rounds=ROUNDS):
+    """a chess-results starting rank crosstable for n players"""
+    n = max(n, 2)
+    rows = ['<tr class="CRg1b"><td class="CRc">No.</td><td class="CR"></td><td class="CR">Name</td>'
+            '<td class="CRr">Rtg</td><td class="CR">FED</td>%s<td class="CRc">Pts.</td></tr>' % "".join(
+            '<td class="CRc">%d.Rd</td>' % rd for rd in range(1, rounds + 1))]
+    for number, name in enumerate(names(rng, n), 1):
+        cells = []
+        for rd in range(1, rounds + 1):
+            opponent = rng.randint(1, n)
+            cells.append("%d%s%s" % (opponent, rng.choice("wb"), rng.choice(["1", "0", "½"])) if opponent != number else "-1")
+        rows.append('<tr class="CRg2"><td class="CR">%d</td><td class="CR">%s</td><td class="CR"><a class="CRdb" '
+            'href="tnr1.aspx?lan=1&amp;art=9&amp;snr=%d">%s</a></td><td class="CR">%d</td><td class="CR">%s</td>%s'
+            '<td class="CR">?</td></tr>' % (number, rng.choice(TITLES), number, name, rng.randint(1200, 2500),
+            rng.choice(FEDS), "".join('<td class="CR">%s</td>' % cell for cell in cells)))
+    return page("Synthetic Open", '<div class="defaultDialog"><h2>Starting rank crosstable after %d Rounds</h2>'
+        '<table class="CRs1">\n%s\n</table></div>' % (rounds, "\n".join(rows)))
+
+def fourncl_page(n, rng, boards=8):
+    """a 4NCL export page with n players, in matches of boards boards"""
+    rows = []
+    players = names(rng, max(n, 2 * boards))
+    for match in range(len(players) // (2 * boards)):
+        home, away = "Team %d" % (2 * match), "Team %d" % (2 * match + 1)
+        rows.append("<tr><td>%d</td><td>%s</td><td>4</td><td>-</td><td>%s</td><td>4</td></tr>" % (match + 1, home, away))
+        for board in range(1, boards + 1):
+            white = players[2 * boards * match + 2 * board - 2].replace(" ", ", ", 1)
+            black = players[2 * boards * match + 2 * board - 1].replace(" ", ", ", 1)
+            rows.append("<tr>%s</tr>" % "".join("<td>%s</td>" % value for value in (
+                board, "wb"[board % 2], white, rng.choice(["", "f", "i", "wf"]), rng.randint(1500, 2400),
+                rng.choice(["1 - 0", "0 - 1", "&frac12; - &frac12;"]), black, rng.choice(["", "c", "g"]),
+                "%d F" % rng.randint(1500, 2400))))
+    return ("<!DOCTYPE html>\n<html>\n<head>\n<title>4NCL Synthetic Round 1 - Export</title>\n</head>\n<body>\n"
+            "<table>\n%s\n</table>\n</body>\n</html>\n" % "\n".join(rows)).encode("utf-8")
+
+def team_workbook(n, rng, rounds=ROUNDS):
+    """a chess-results Excel team export with n players, as xlsx bytes"""
+    wb = Workbook()
+    wb.remove(wb.active)
+    wb.create_sheet("TeamComposition").append(["Synthetic Team Event"])
+    info = wb.create_sheet("PlayerInfo")
+    info.append(["Player info"])
+    opponents = names(rng, 50)
+    for number, name in enumerate(names(rng, n)):
+        info.append(["%s %d %s" % (name, rng.randint(1200, 2400), rng.choice(FEDS))])
+        if number == 0:
+            info.append(["Rd.", "SNo", "", "Name", "Rtg", "FED", "Rp", "Pts.", "Res."])
+        for rd in range(1, rounds + 1):
+            info.append([rd, rng.randint(1, 200), rng.choice(TITLES) or None, rng.choice(opponents),
+                         rng.randint(1200, 2500), rng.choice(FEDS), None, 4, rng.choice(["w 1", "s ½", "w 0", "s 1"])])
+    f = io.BytesIO()
+    wb.save(f)
+    return f.getvalue()
+
+
+# timing
+
+def measure(func, memory=True):
+    """(seconds, peak bytes allocated or None) for one call of func"""
+    gc.collect()
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peak
+
+def benchmark(name, size, func, memory=True):
+    seconds, peak = measure(func, memory)
+    result = {"name": name, "size": size, "seconds": seconds, "per_second": size / seconds if seconds else None,
+              "peak_bytes": peak}
+    print("%-28s %9d %10.4fs %12s/s %10s" % (name, size, seconds,
+          "%.0f" % result["per_second"] if result["per_second"] else "-",
+          "-" if peak is None else "%.1fMB" % (peak / 1e6)), file=sys.stderr)
+    return result
+
+def event_benchmarks(sizes, memory=True, seed=1):
+    rng = random.Random(seed)
+    results = []
+    with open(RECORDED_PAGE, "rb") as f:
+        recorded = f.read()
+    soup = bs4.BeautifulSoup(parsechessresults.preprocess_chessresults_html(recorded), "html.parser")
+    results.append(benchmark("parse_individual_auto", 1, lambda: parsechessresults.parse_individual_auto(soup), memory))
+    results.append(benchmark("individual_page", 1, lambda: parsechessresults.parse_chessresults_html(recorded), memory))
+
+    for n in sizes:
+        data = team_page(n, rng)
+        soup = bs4.BeautifulSoup(data, "html.parser")
+        results.append(benchmark("parse_team", n, lambda: parsechessresults.parse_team(soup), memory))
+        results.append(benchmark("team_page", n, lambda: parsechessresults.parse_chessresults_html(data), memory))
+        event, players = parsechessresults.parse_chessresults_html(data)
+        results.append(benchmark("format_output", n,
+            lambda: parsechessresults.format_output(event, players, "benchmark"), memory))
+
+        data = crosstable_page(n, rng)
+        results.append(benchmark("crosstable_page", n, lambda: parsechessresults.parse_chessresults_html(data), memory))
+
+        data = fourncl_page(n, rng)
+        soup = bs4.BeautifulSoup(data, "html.parser")
+        results.append(benchmark("parse_4ncl_matches", n, lambda: parsechessresults.parse_4ncl_matches(soup, 1), memory))
+
+        xlsx = team_workbook(n, rng)
+        def parse_xlsx():
+            wb = load_workbook(io.BytesIO(xlsx), read_only=True)
+            parsechessresults.parse_team_from_xlsx(wb)
+            wb.close()
+        results.append(benchmark("parse_team_from_xlsx", n, parse_xlsx, memory))
+    return results
+
+def fide_benchmarks(sizes, memory=True, seed=1):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for n in sizes:
+            xml_path = os.path.join(directory, "list%d.xml" % n)
+            txt_path = os.path.join(directory, "list%d.txt" % n)
+            write_fide_xml(xml_path, n, random.Random(seed))
+            write_fide_txt(txt_path, n, random.Random(seed))
+            results.append(benchmark("fide_xml_aggregate", n,
+                lambda: parse_fide.aggregate(parse_fide.iter_players(xml_path)), memory))
+            results.append(benchmark("fide_txt_aggregate", n,
+                lambda: parse_fide.aggregate(parse_fide.iter_players(txt_path)), memory))
+            results.append(benchmark("fide_txt_one_fed", n,
+                lambda: parse_fide.aggregate(parse_fide.iter_players(txt_path, "IRL")), memory))
+            cache_path = os.path.join(directory, "list%d.fidecache" % n)
+            results.append(benchmark("fide_cache_build", n, lambda: fide_cache.build(txt_path, cache_path), memory))
+
+            def cached_summary():
+                fide_list = fide_cache.load(txt_path, cache_path)
+                columns = fide_stats.RatingColumns(fide_list)
+                fide_stats.summary(columns.rated("standard", columns.mask(active=True, fed=["IRL"])))
+                del columns
+                fide_list.close()
+            results.append(benchmark("fide_cached_stats", n, cached_summary, memory))
+    return results
+
+
+def startup_benchmarks():
+    """Start-up in fresh interpreters. Returns (results, whether the import was
+    within STARTUP_BUDGET)."""
+    # the import is timed inside the child, so interpreter start-up is not counted
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], check=True, capture_output=True, text=True).stdout
+    seconds = float(output)
+    print("%-28s %9d %10.4fs  budget %.2fs%s" % ("import_parsechessresults", 1, seconds, STARTUP_BUDGET,
+          "  OVER BUDGET" if seconds > STARTUP_BUDGET else ""), file=sys.stderr)
+    results = [{"name": "import_parsechessresults", "size": 1, "seconds": seconds, "per_second": 1 / seconds,
+                "peak_bytes": None}]
+    command = [sys.executable, "parsechessresults.py", "data/crosstable_sample.html", "--fed", "IRL"]
+    results.append(benchmark("cli_saved_page", 1,
+        lambda: subprocess.run(command, check=True, capture_output=True), memory=False))
+    return results, seconds <= STARTUP_BUDGET
+
+def compare(results, previous, threshold):
+    """Print each result against the same benchmark in an earlier run. Returns the number of regressions."""
+    before = {(r["name"], r["size"]): r for r in previous["results"]}
+    regressions = 0
+    for result in results:
+        old = before.get((result["name"], result["size"]))
+        if old is None:
+            continue
+        flags = []
+        time_ratio = result["seconds"] / old["seconds"] if old["seconds"] else None
+        if time_ratio and time_ratio > 1 + threshold:
+            flags.append("SLOWER")
+        memory_ratio = None
+        if result["peak_bytes"] and old.get("peak_bytes"):
+            memory_ratio = result["peak_bytes"] / old["peak_bytes"]
+            if memory_ratio > 1 + threshold:
+                flags.append("BIGGER")
+        regressions += bool(flags)
+        print("%-28s %9d  time x%.2f  memory %s  %s" % (result["name"], result["size"], time_ratio or 0,
+              "-" if memory_ratio is None else "x%.2f" % memory_ratio, " ".join(flags)))
+    return regressions
+
+def summary(sizes, fide_sizes):
+    return {"when": datetime.datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+            "machine": platform.machine(), "sizes": sizes, "fide_sizes": fide_sizes}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline parser benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="*", help="players per synthetic event (default %s)" % DEFAULT_SIZES)
+    parser.add_argument("--fide-sizes", type=int, nargs="*",
+        help="players per synthetic FIDE list (default %s)" % DEFAULT_FIDE_SIZES)
+    parser.add_argument("--quick", action="store_true", help="small sizes only, as a smoke test")
+    parser.add_argument("--only", choices=["events", "fide", "startup"])
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", metavar="JSON", help="compare with an earlier --output")
+    parser.add_argument("--threshold", type=float, default=0.2, help="fraction slower or bigger that counts as a regression")
+    args = parser.parse_args()
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    fide_sizes = args.fide_sizes or (QUICK_FIDE_SIZES if args.quick else DEFAULT_FIDE_SIZES)
+    results = []
+    within_budget = True
+    if args.only in (None, "events"):
+        results += event_benchmarks(sizes, not args.no_memory)
+    if args.only in (None, "fide"):
+        results += fide_benchmarks(fide_sizes, not args.no_memory)
+    if args.only in (None, "startup"):
+        startup, within_budget = startup_benchmarks()
+        results += startup
+    run = dict(summary(sizes, fide_sizes), results=results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        sys.exit(1 if regressions or not within_budget else 0)
+    sys.exit(0 if within_budget else 1)
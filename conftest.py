@@ -0,0 +1,4 @@
+def pytest_configure(config):
+    # live tests fetch pages from chess-results.com and 4nclresults.co.uk;
+    # run "pytest -m 'not network'" to skip them when offline
+    config.addinivalue_line("markers", "network: test fetches live pages over the network")
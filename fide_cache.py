@@ -0,0 +1,280 @@
+import array
+import bisect
+import json
+import mmap
+import os
+import re
+import struct
+
+import atomic_file
+import parse_fide
+
+
+"""Columnar binary cache of the FIDE rating list
+
+The first time a list is loaded it is converted into a compact file next to it
+(players_list_xml_foa.xml -> players_list_xml_foa.xml.fidecache) holding
+fixed-width columns sorted by fideid, plus an interned string table for names
+and the rows in name order, so names can be looked up by bisection.
+Later loads memory-map that file as long as the source has the same mtime and
+size, so nothing is parsed and columns are only paged in when they are read.
+
+Usage:
+    fide_list = fide_cache.load("players_list_xml_foa.xml")
+    fide_list.player(fide_list.find(2500035)).name
+
+The file is written in native byte order; it is a cache, not an exchange format."""
+
+MAGIC = b"FIDECOL2"
+# files from before the name_order column still open, e.g. the months kept by
+# fide_history.HistoryStore, whose source lists may be gone; load() rebuilds them
+OLD_MAGICS = (b"FIDECOL1",)
+CACHE_SUFFIX = ".fidecache"
+
+# bits in the flags column
+INACTIVE = 1
+WOMAN = 2
+FEMALE = 4
+
+# name, array typecode. Missing ratings and birthdays are stored as 0
+COLUMNS = [
+    ("fideid", "i"),
+    ("country", "B"),  # 3 bytes per player
+    ("flags", "B"),
+    ("title", "B"),  # index into the header's titles list
+    ("rating", "h"),
+    ("rapid_rating", "h"),
+    ("blitz_rating", "h"),
+    ("birthday", "h"),
+    ("name_index", "I"),  # index into the string table
+    ("name_order", "I"),  # rows sorted by name_key of their name
+    ("string_offsets", "I"),
+    ("string_data", "B"),
+]
+
+
+def cache_path_for(source):
+    return source + CACHE_SUFFIX
+
+def source_stamp(source):
+    st = os.stat(source)
+    return [st.st_mtime_ns, st.st_size]
+
+def name_key(name):
+    """ "SURNAME,  Forename" -> "surname, forename", for matching names written slightly differently"""
+    return ", ".join(" ".join(part.split()) for part in name.split(",", 1)).casefold()
+
+def encode_flags(player):
+    flags = 0
+    if "i" in player.flag:
+        flags |= INACTIVE
+    if "w" in player.flag:
+        flags |= WOMAN
+    if player.sex == "F":
+        flags |= FEMALE
+    return flags
+
+def decode_flags(flags):
+    return ("w" if flags & WOMAN else "") + ("i" if flags & INACTIVE else "")
+
+
+def build(source, cache_path=None, players=None):
+    """Convert a FIDE list to the columnar format and return the cache path.
+    players defaults to parse_fide.iter_players(source)"""
+    if cache_path is None:
+        cache_path = cache_path_for(source)
+    if players is None:
+        players = parse_fide.iter_players(source)
+
+    rows = {name: array.array(typecode) for name, typecode in COLUMNS}
+    countries = bytearray()
+    titles = [""]
+    title_index = {"": 0}
+    strings = {}
+    for player in players:
+        rows["fideid"].append(player.fideid or 0)
+        countries += player.country.encode("ascii")[:3].ljust(3)
+        rows["flags"].append(encode_flags(player))
+        if player.title not in title_index:
+            title_index[player.title] = len(titles)
+            titles.append(player.title)
+        rows["title"].append(title_index[player.title])
+        rows["rating"].append(player.rating or 0)
+        rows["rapid_rating"].append(player.rapid_rating or 0)
+        rows["blitz_rating"].append(player.blitz_rating or 0)
+        rows["birthday"].append(player.birthday or 0)
+        rows["name_index"].append(strings.setdefault(player.name, len(strings)))
+
+    # sort every per-player column by fideid so lookups can bisect
+    order = sorted(range(len(rows["fideid"])), key=rows["fideid"].__getitem__)
+    for name, typecode in COLUMNS:
+        if name not in ("country", "name_order", "string_offsets", "string_data"):
+            column = rows[name]
+            rows[name] = array.array(typecode, [column[i] for i in order])
+    rows["country"] = array.array("B", b"".join(bytes(countries[3 * i:3 * i + 3]) for i in order))
+    keys = [name_key(name) for name in strings]
+    name_index = rows["name_index"]
+    rows["name_order"] = array.array("I", sorted(range(len(order)), key=lambda row: keys[name_index[row]]))
+
+    data = bytearray()
+    offsets = array.array("I", [0])
+    for name in strings:
+        data += name.encode("utf-8")
+        offsets.append(len(data))
+    rows["string_offsets"] = offsets
+    rows["string_data"] = array.array("B", data)
+
+    header = {"source": source_stamp(source) if os.path.exists(source) else None,
+              "count": len(order), "titles": titles, "columns": {}}
+    position = 0
+    for name, typecode in COLUMNS:
+        header["columns"][name] = [typecode, position, len(rows[name])]
+        position += padded(rows[name].itemsize * len(rows[name]))
+    header_bytes = json.dumps(header).encode("utf-8")
+    start = padded(len(MAGIC) + 4 + len(header_bytes))
+
+    with atomic_file.writing(cache_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes)
+        f.write(b"\0" * (start - f.tell()))
+        for name, typecode in COLUMNS:
+            raw = rows[name].tobytes()
+            f.write(raw + b"\0" * (padded(len(raw)) - len(raw)))
+    return cache_path
+
+def padded(size):
+    return (size + 7) // 8 * 8
+
+
+class FideList:
+    """Read-only view of a cached FIDE list. Each column is a typed memoryview over
+    the memory-mapped file, indexed by row. Rows are sorted by fideid."""
+    def __init__(self, cache_path):
+        with open(cache_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC and self._mm[:len(MAGIC)] not in OLD_MAGICS:
+            raise ValueError("%s is not a FIDE cache file" % cache_path)
+        (header_len,) = struct.unpack_from("<I", self._mm, len(MAGIC))
+        header_end = len(MAGIC) + 4 + header_len
+        self.header = json.loads(self._mm[len(MAGIC) + 4:header_end])
+        self.titles = self.header["titles"]
+        self._buffer = memoryview(self._mm)
+        start = padded(header_end)
+        for name, (typecode, position, length) in self.header["columns"].items():
+            offset = start + position
+            size = length * array.array(typecode).itemsize
+            setattr(self, name, self._buffer[offset:offset + size].cast(typecode))
+        if "name_order" not in self.header["columns"]:
+            # sorted when first needed
+            self.name_order = None
+        self._names = None
+
+    def __len__(self):
+        return self.header["count"]
+
+    def __iter__(self):
+        return self.players(range(len(self)))
+
+    def close(self):
+        for name in self.header["columns"]:
+            getattr(self, name).release()
+        self._buffer.release()
+        self._mm.close()
+
+    def string(self, index):
+        return bytes(self.string_data[self.string_offsets[index]:self.string_offsets[index + 1]]).decode("utf-8")
+
+    def name(self, row):
+        return self.string(self.name_index[row])
+
+    def country_code(self, row):
+        return bytes(self.country[3 * row:3 * row + 3]).decode("ascii").strip()
+
+    def player(self, row):
+        """the row as a parse_fide.FidePlayer"""
+        flags = self.flags[row]
+        return parse_fide.FidePlayer(
+            self.fideid[row], self.name(row), self.country_code(row),
+            "F" if flags & FEMALE else "M", self.titles[self.title[row]],
+            self.rating[row] or None, self.rapid_rating[row] or None,
+            self.blitz_rating[row] or None, self.birthday[row] or None, decode_flags(flags))
+
+    def players(self, rows):
+        for row in rows:
+            yield self.player(row)
+
+    def find(self, fideid):
+        """row index of the player with this fideid, or None"""
+        row = bisect.bisect_left(self.fideid, fideid)
+        if row < len(self) and self.fideid[row] == fideid:
+            return row
+        return None
+
+    def rows_for_country(self, country):
+        """row indexes of every player from this federation, found by scanning the
+        country column as one block of bytes"""
+        code = re.escape(country.encode("ascii").ljust(3))
+        return [m.start() // 3 for m in re.finditer(b"(?=" + code + b")", self.country) if m.start() % 3 == 0]
+
+    def rows_for_name(self, name):
+        """row indexes of every player with exactly this name, as written in the list
+        ("Surname, Forename"). The name index is built on first use."""
+        if self._names is None:
+            self._names = {}
+            for row, index in enumerate(self.name_index):
+                self._names.setdefault(index, []).append(row)
+            self._strings = {self.string(i): i for i in range(len(self.string_offsets) - 1)}
+        index = self._strings.get(name)
+        return self._names.get(index, [])
+
+    def rows_for_names(self, names):
+        """{name : row indexes} for many names at once, matched by name_key so case
+        and spacing do not matter. Bisects the name_order column, walking the
+        wanted names in sorted order so each search starts where the last ended."""
+        if self.name_order is None:
+            keys = [name_key(self.string(i)) for i in range(len(self.string_offsets) - 1)]
+            self.name_order = array.array("I", sorted(range(len(self)), key=lambda row: keys[self.name_index[row]]))
+        keys = _NameKeys(self)
+        found = {}
+        lo = 0
+        for key, name in sorted((name_key(name), name) for name in names):
+            lo = bisect.bisect_left(keys, key, lo)
+            hi = lo
+            while hi < len(keys) and keys[hi] == key:
+                hi += 1
+            found[name] = [self.name_order[i] for i in range(lo, hi)]
+        return found
+
+
+class _NameKeys:
+    """name_key of each row in name_order, as a sequence bisect can search"""
+    def __init__(self, fide_list):
+        self.fide_list = fide_list
+
+    def __len__(self):
+        return len(self.fide_list)
+
+    def __getitem__(self, i):
+        return name_key(self.fide_list.name(self.fide_list.name_order[i]))
+
+
+def load(source, cache_path=None):
+    """Return a FideList for the FIDE list at source, building or rebuilding
+    the cache first if it is missing or the source has changed since"""
+    if cache_path is None:
+        cache_path = cache_path_for(source)
+    if not is_fresh(source, cache_path):
+        build(source, cache_path)
+    return FideList(cache_path)
+
+def is_fresh(source, cache_path):
+    if not os.path.exists(cache_path):
+        return False
+    try:
+        with open(cache_path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return False
+            (header_len,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_len))
+    except (OSError, ValueError, struct.error):
+        return False
+    return header.get("source") == source_stamp(source)
@@ -0,0 +1,87 @@
+import argparse
+import json
+import sys
+
+import fide_cache
+
+
+"""Compare two monthly FIDE lists by fideid
+
+Both lists go through fide_cache, so each is streamed from XML once into a
+column file sorted by fideid, and the comparison is a single merge over the two
+sorted columns: linear time, and memory bounded by what the OS pages in.
+
+Usage: python fide_diff.py old_list.xml new_list.xml [--fed IRL ...] > changes.jsonl
+
+Writes one JSON object per line, with "change" set to one of
+    new, removed        - player only in the new / old list
+    transfer            - federation changed ("from", "to")
+    activity            - inactive flag changed ("active" is the new state)
+    rating              - a rating changed ("kind", "old", "new", "delta"; old or new may be null)
+"""
+
+RATING_KINDS = [("standard", "rating"), ("rapid", "rapid_rating"), ("blitz", "blitz_rating")]
+
+
+def player_summary(fide_list, row):
+    return {"fideid": fide_list.fideid[row], "name": fide_list.name(row),
+            "country": fide_list.country_code(row)}
+
+def row_changes(old, i, new, j):
+    """changes for the player at row i of old and row j of new, which have the same fideid"""
+    changes = []
+    old_country = old.country_code(i)
+    new_country = new.country_code(j)
+    if old_country != new_country:
+        changes.append({"change": "transfer", "from": old_country, "to": new_country})
+    was_inactive = old.flags[i] & fide_cache.INACTIVE
+    is_inactive = new.flags[j] & fide_cache.INACTIVE
+    if was_inactive != is_inactive:
+        changes.append({"change": "activity", "active": not is_inactive})
+    for kind, column in RATING_KINDS:
+        old_rating = getattr(old, column)[i]
+        new_rating = getattr(new, column)[j]
+        if old_rating != new_rating:
+            changes.append({"change": "rating", "kind": kind, "old": old_rating or None,
+                            "new": new_rating or None,
+                            "delta": new_rating - old_rating if old_rating and new_rating else None})
+    return changes
+
+def diff(old, new, feds=None):
+    """Yield change dicts between two fide_cache.FideLists.
+    If feds is given, only players in one of those federations in either list are reported."""
+    def wanted(fide_list, row):
+        return feds is None or fide_list.country_code(row) in feds
+
+    i = j = 0
+    old_ids, new_ids = old.fideid, new.fideid
+    n_old, n_new = len(old), len(new)
+    while i < n_old or j < n_new:
+        if j == n_new or (i < n_old and old_ids[i] < new_ids[j]):
+            if wanted(old, i):
+                yield dict(player_summary(old, i), change="removed")
+            i += 1
+        elif i == n_old or new_ids[j] < old_ids[i]:
+            if wanted(new, j):
+                yield dict(player_summary(new, j), change="new")
+            j += 1
+        else:
+            if wanted(old, i) or wanted(new, j):
+                summary = player_summary(new, j)
+                for change in row_changes(old, i, new, j):
+                    yield dict(summary, **change)
+            i += 1
+            j += 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two FIDE rating lists")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--fed", nargs="*", help="only report players in these federations")
+    args = parser.parse_args()
+
+    old = fide_cache.load(args.old)
+    new = fide_cache.load(args.new)
+    for change in diff(old, new, args.fed):
+        sys.stdout.write(json.dumps(change) + "\n")
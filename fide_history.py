@@ -0,0 +1,117 @@
+import argparse
+import os
+import re
+
+import numpy as np
+
+import fide_cache
+import fide_stats
+
+
+"""Rating history built from many monthly FIDE lists
+
+A store is a directory holding one fide_cache column file per month
+(2015-01.fidecache, 2015-02.fidecache, ...), each sorted by fideid. Months are
+only ever added, never rewritten. Queries memory-map the months they need and
+work on whole columns with NumPy, so a count per month or the rating
+trajectories of a few hundred players take milliseconds.
+
+Usage:
+    python fide_history.py STORE add 2024-01 players_list_foa.zip
+    python fide_history.py STORE count --fed IRL --active --since 2015-01
+    python fide_history.py STORE trajectory 2500035 2501171 [--kind rapid]"""
+
+MONTH = re.compile(r"^\d{4}-\d{2}$")
+
+
+class HistoryStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self._columns = {}
+
+    def months(self, since=None, until=None):
+        """the months in the store, oldest first, optionally within [since, until]"""
+        if not os.path.isdir(self.directory):
+            return []
+        months = sorted(name[:-len(fide_cache.CACHE_SUFFIX)] for name in os.listdir(self.directory)
+                        if name.endswith(fide_cache.CACHE_SUFFIX))
+        return [m for m in months if (since is None or m >= since) and (until is None or m <= until)]
+
+    def path(self, month):
+        return os.path.join(self.directory, month + fide_cache.CACHE_SUFFIX)
+
+    def add(self, month, source):
+        """Add the FIDE list for month (YYYY-MM) from any format parse_fide reads"""
+        if not MONTH.match(month):
+            raise ValueError("month should look like 2024-01, not %s" % month)
+        if os.path.exists(self.path(month)):
+            raise ValueError("%s is already in the store" % month)
+        os.makedirs(self.directory, exist_ok=True)
+        fide_cache.build(source, self.path(month))
+
+    def columns(self, month):
+        if month not in self._columns:
+            self._columns[month] = fide_stats.RatingColumns(fide_cache.FideList(self.path(month)))
+        return self._columns[month]
+
+    def count_per_month(self, kind="standard", since=None, until=None, **mask):
+        """[(month, number of players with a rating of this kind)] for players
+        selected by the fide_stats.RatingColumns.mask keywords (active, fed, sex, ...)"""
+        counts = []
+        for month in self.months(since, until):
+            columns = self.columns(month)
+            counts.append((month, int(((columns.ratings[kind] > 0) & columns.mask(**mask)).sum())))
+        return counts
+
+    def trajectories(self, fideids, kind="standard", since=None, until=None):
+        """{fideid : [(month, rating or None)]} for each of the fideids, with one
+        point per month. A fideid asked for twice is only looked up once, and one
+        that appears twice in a month's list takes the rating of its first entry."""
+        fideids = np.unique(np.asarray(list(fideids), dtype=np.int32))
+        series = {int(fideid): [] for fideid in fideids}
+        for month in self.months(since, until):
+            columns = self.columns(month)
+            if not len(columns):
+                for fideid in series:
+                    series[fideid].append((month, None))
+                continue
+            rows = np.searchsorted(columns.fideid, fideids)
+            rows = np.minimum(rows, len(columns) - 1)
+            found = columns.fideid[rows] == fideids
+            ratings = columns.ratings[kind][rows]
+            for fideid, present, rating in zip(fideids.tolist(), found.tolist(), ratings.tolist()):
+                series[fideid].append((month, rating if present and rating else None))
+        return series
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rating history from monthly FIDE lists")
+    parser.add_argument("store", help="directory holding the monthly column files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="add one month's list")
+    add.add_argument("month", help="YYYY-MM")
+    add.add_argument("source", help="FIDE list, XML, TXT or zip")
+    count = commands.add_parser("count", help="players with a rating, per month")
+    count.add_argument("--fed", nargs="*")
+    count.add_argument("--active", action="store_true")
+    count.add_argument("--kind", choices=list(fide_stats.KINDS), default="standard")
+    count.add_argument("--since")
+    trajectory = commands.add_parser("trajectory", help="ratings of some players, per month")
+    trajectory.add_argument("fideids", nargs="+", type=int)
+    trajectory.add_argument("--kind", choices=list(fide_stats.KINDS), default="standard")
+    trajectory.add_argument("--since")
+    args = parser.parse_args()
+
+    store = HistoryStore(args.store)
+    if args.command == "add":
+        store.add(args.month, args.source)
+    elif args.command == "count":
+        for month, n in store.count_per_month(args.kind, args.since, fed=args.fed,
+                                              active=True if args.active else None):
+            print("%s\t%d" % (month, n))
+    else:
+        months = store.months(args.since)
+        series = store.trajectories(args.fideids, args.kind, args.since)
+        print("\t".join(["fideid"] + months))
+        for fideid, ratings in series.items():
+            print("\t".join([str(fideid)] + ["" if r is None else str(r) for _, r in ratings]))
@@ -0,0 +1,128 @@
+import argparse
+
+import numpy as np
+
+import fide_cache
+
+
+"""Rating statistics over whole columns of the FIDE list, using NumPy
+
+Works on the memory-mapped columns of fide_cache, so a mask or a percentile over
+the full list is a handful of array operations rather than a loop over players.
+
+Usage: python fide_stats.py players_list_xml_foa.xml --fed IRL --active [--sex F] [--born 2005 2015] [--bin 50]"""
+
+KINDS = {"standard": "rating", "rapid": "rapid_rating", "blitz": "blitz_rating"}
+
+DEFAULT_PERCENTILES = (10, 25, 50, 75, 90)
+
+
+class RatingColumns:
+    """NumPy arrays over a fide_cache.FideList. No data is copied."""
+    def __init__(self, fide_list):
+        self.fideid = np.frombuffer(fide_list.fideid, dtype=np.int32)
+        self.country = np.frombuffer(fide_list.country, dtype="S3")
+        self.flags = np.frombuffer(fide_list.flags, dtype=np.uint8)
+        self.birthday = np.frombuffer(fide_list.birthday, dtype=np.int16)
+        self.ratings = {kind: np.frombuffer(getattr(fide_list, column), dtype=np.int16)
+                        for kind, column in KINDS.items()}
+
+    def __len__(self):
+        return len(self.fideid)
+
+    def mask(self, active=None, fed=None, sex=None, born_from=None, born_to=None):
+        """Boolean array selecting players. Each argument left as None is not filtered on.
+        fed may be one code or a list of codes; sex is "M" or "F"; the birth year
+        band is inclusive and excludes players with no birth year."""
+        mask = np.ones(len(self), dtype=bool)
+        if active is not None:
+            inactive = (self.flags & fide_cache.INACTIVE) != 0
+            mask &= ~inactive if active else inactive
+        if fed is not None:
+            feds = [fed] if isinstance(fed, str) else fed
+            mask &= np.isin(self.country, [f.encode("ascii").ljust(3) for f in feds])
+        if sex is not None:
+            female = (self.flags & fide_cache.FEMALE) != 0
+            mask &= female if sex == "F" else ~female
+        if born_from is not None or born_to is not None:
+            mask &= self.birthday > 0
+            if born_from is not None:
+                mask &= self.birthday >= born_from
+            if born_to is not None:
+                mask &= self.birthday <= born_to
+        return mask
+
+    def rated(self, kind="standard", mask=None):
+        """the ratings of one kind for players who have one, optionally under a mask"""
+        ratings = self.ratings[kind]
+        has_rating = ratings > 0
+        if mask is not None:
+            has_rating &= mask
+        return ratings[has_rating]
+
+
+def histogram(ratings, width=100, start=None, stop=None):
+    """Return (bin starts, counts) for bins of the given width.
+    start and stop default to the bins covering the lowest and highest rating;
+    ratings outside [start, stop) are not counted."""
+    ratings = np.asarray(ratings, dtype=np.int64)
+    if start is None:
+        start = int(ratings.min()) // width * width if len(ratings) else 0
+    if stop is None:
+        stop = (int(ratings.max()) // width + 1) * width if len(ratings) else start
+    nbins = max(0, (stop - start + width - 1) // width)
+    inside = ratings[(ratings >= start) & (ratings < stop)]
+    counts = np.bincount((inside - start) // width, minlength=nbins)[:nbins]
+    return np.arange(start, start + nbins * width, width), counts
+
+def percentiles(ratings, qs=DEFAULT_PERCENTILES):
+    if not len(ratings):
+        return [None for q in qs]
+    return [float(v) for v in np.percentile(ratings, qs)]
+
+def summary(ratings):
+    """count, mean, median, min and max of an array of ratings"""
+    if not len(ratings):
+        return {"count": 0, "mean": None, "median": None, "min": None, "max": None}
+    return {"count": int(len(ratings)), "mean": float(ratings.mean()), "median": float(np.median(ratings)),
+            "min": int(ratings.min()), "max": int(ratings.max())}
+
+def percentile_table(columns, mask=None, qs=DEFAULT_PERCENTILES):
+    """{kind : summary plus a "percentiles" list} for standard, rapid and blitz"""
+    table = {}
+    for kind in KINDS:
+        ratings = columns.rated(kind, mask)
+        table[kind] = summary(ratings)
+        table[kind]["percentiles"] = percentiles(ratings, qs)
+    return table
+
+
+def print_stats(columns, mask, width=100, qs=DEFAULT_PERCENTILES):
+    table = percentile_table(columns, mask, qs)
+    print("\t".join(["", "count", "mean", "median"] + ["p%d" % q for q in qs]))
+    for kind, row in table.items():
+        values = [row["count"], row["mean"], row["median"]] + row["percentiles"]
+        print("\t".join([kind] + ["" if v is None else "%d" % round(v) for v in values]))
+    for kind in KINDS:
+        print()
+        print(kind)
+        for k, n in zip(*histogram(columns.rated(kind, mask), width)):
+            print("%4d\t%4d" % (k, n))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rating statistics from the FIDE rating list")
+    parser.add_argument("filename")
+    parser.add_argument("--fed", nargs="*", help="federations to include (default all)")
+    parser.add_argument("--active", action="store_true", help="only active players")
+    parser.add_argument("--inactive", action="store_true", help="only inactive players")
+    parser.add_argument("--sex", choices=["M", "F"])
+    parser.add_argument("--born", nargs=2, type=int, metavar=("FROM", "TO"), help="birth year band, inclusive")
+    parser.add_argument("--bin", type=int, default=100, help="histogram bin width (default 100)")
+    args = parser.parse_args()
+
+    active = True if args.active else False if args.inactive else None
+    born_from, born_to = args.born or (None, None)
+    columns = RatingColumns(fide_cache.load(args.filename))
+    mask = columns.mask(active, args.fed, args.sex, born_from, born_to)
+    print_stats(columns, mask, args.bin)
@@ -0,0 +1,159 @@
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.parse
+
+import atomic_file
+
+
+"""On-disk HTTP cache for the pages and workbooks we fetch from chess-results and 4NCL
+
+Each URL is stored as one file under the cache directory, named by a hash of
+the URL: a line of JSON with the ETag and Last-Modified headers and when it was
+last checked, then the body. Every page is revalidated with If-None-Match /
+If-Modified-Since, so an unchanged page costs a 304 with no body. Given a TTL
+(per host, or --ttl), a cached page younger than that is used without any
+request, saying so on stderr. In offline mode only the cache is used.
+
+The cache directory defaults to ~/.cache/icu_scripts/http, or $ICU_SCRIPTS_CACHE.
+
+record and replay name a replay.Archive directory: with record every body
+fetched is also saved there, and with replay every fetch is answered from
+there alone (see replay.py)."""
+
+DEFAULT_CACHE_DIR = os.environ.get("ICU_SCRIPTS_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "icu_scripts", "http"))
+
+# seconds a cached page is used without asking the server again, by host suffix;
+# none by default, since results pages change while an event is being played
+HOST_TTL = {}
+
+
+class OfflineError(urllib.error.URLError):
+    """Raised in offline mode for a URL that is not in the cache"""
+
+
+class HttpCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, offline=False, enabled=True, host_ttl=None, default_ttl=0,
+                 record=None, replay=None):
+        # kept so the same cache can be set up again in another process
+        self.settings = {"cache_dir": cache_dir, "offline": offline, "enabled": enabled,
+                         "host_ttl": host_ttl, "default_ttl": default_ttl, "record": record, "replay": replay}
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.enabled = enabled
+        self.host_ttl = dict(HOST_TTL if host_ttl is None else host_ttl)
+        self.default_ttl = default_ttl
+        if record is not None or replay is not None:
+            from replay import Archive
+        self.recording = None if record is None else Archive(record)
+        self.replaying = None if replay is None else Archive(replay)
+
+    def ttl(self, url):
+        host = urllib.parse.urlsplit(url).hostname or ""
+        for suffix, ttl in self.host_ttl.items():
+            if host == suffix or host.endswith("." + suffix):
+                return ttl
+        return self.default_ttl
+
+    def path(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + ".page")
+
+    def lookup(self, url):
+        """Return (body, meta) for a cached url, or (None, None)"""
+        try:
+            with open(self.path(url), "rb") as f:
+                meta = json.loads(f.readline())
+                return f.read(), meta
+        except (OSError, ValueError):
+            return None, None
+
+    def store(self, url, body, meta):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # meta and body share one file, so other threads or batch processes storing
+        # the same url at the same time cannot pair one's meta with another's body
+        with atomic_file.writing(self.path(url)) as f:
+            f.write(json.dumps(meta).encode("utf-8") + b"\n")
+            f.write(body)
+
+    def fetch(self, url, insecure=False):
+        """Return the body of url, from the cache when it is fresh or still valid"""
+        if self.replaying is not None:
+            body = self.replaying.body(url)
+            if body is None:
+                raise OfflineError("%s is not in the replay archive" % url)
+            return body
+        body = self.fetch_body(url, insecure)
+        if self.recording is not None:
+            self.recording.save(url, body)
+        return body
+
+    def fetch_body(self, url, insecure=False):
+        if not self.enabled:
+            return self.request(url, {}, insecure).read()
+
+        body, meta = self.lookup(url)
+        if body is not None and self.offline:
+            return body
+        if body is not None and time.time() - meta["checked"] < self.ttl(url):
+            print("Using cached copy of %s from %d seconds ago" % (url, time.time() - meta["checked"]),
+                file=sys.stderr)
+            return body
+        if self.offline:
+            raise OfflineError("%s is not in the cache" % url)
+
+        headers = {}
+        if body is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            response = self.request(url, headers, insecure)
+        except urllib.error.HTTPError as e:
+            if e.code != 304 or body is None:
+                raise
+            meta["checked"] = time.time()
+            self.store(url, body, meta)
+            return body
+        except urllib.error.URLError as e:
+            if body is None:
+                raise
+            print("Using cached copy of %s: %s" % (url, e.reason), file=sys.stderr)
+            return body
+
+        body = response.read()
+        self.store(url, body, {"url": url, "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"), "checked": time.time()})
+        return body
+
+    def request(self, url, headers, insecure=False):
+        # loaded on the first request, since ssl alone costs more than the rest of start-up
+        import ssl
+        import urllib.request
+        request = urllib.request.Request(url, headers=headers)
+        if insecure:
+            # verifying the SSL cert was broken for 4NCL
+            return urllib.request.urlopen(request, context=ssl._create_unverified_context())
+        return urllib.request.urlopen(request)
+
+    def urlopen(self, url, insecure=False):
+        """Drop-in for urllib.request.urlopen(url).read() users: a file-like body"""
+        return io.BytesIO(self.fetch(url, insecure))
+
+
+default_cache = HttpCache()
+
+def configure(**settings):
+    """Replace the module's default cache, e.g. configure(offline=True)"""
+    global default_cache
+    default_cache = HttpCache(**settings)
+    return default_cache
+
+def urlopen(url, insecure=False):
+    return default_cache.urlopen(url, insecure)
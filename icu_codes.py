@@ -0,0 +1,237 @@
+import csv
+from collections import Counter
+import os
+import pickle
+import re
+import sys
+import unicodedata
+
+import atomic_file
+
+
+"""Look up ICU codes for player names, from a local export of the ICU membership/rating list
+
+The export is a CSV with a heading row. The columns are found by name: an ICU id
+("ICU ID", "id", ...), either "Last Name" and "First Name" or a single "Name" in
+"Surname, Forename" form, and optionally "Fed" and "Rating".
+
+Names are matched in three steps, stopping at the first that finds anyone:
+    exact       - "Surname,Forename" as written
+    normalised  - ignoring case, accents, spaces, apostrophes and hyphens
+    fuzzy       - the closest names by shared trigrams (Dice coefficient)
+When several players match, federation and then rating break the tie; if that
+does not leave one player the match is reported as ambiguous. A fuzzy match is
+only a suggestion, since a near-miss is as likely a namesake's relative as a
+misspelling: it gives a code only when the player's rating is within
+FUZZY_RATING_MARGIN of the member's (and their federations, if both are known,
+agree). A federation alone does not confirm it, as nearly everyone is IRL.
+
+The index is pickled next to the CSV (members.csv -> members.csv.icuindex) and
+reused until the CSV changes, so building it is only paid once."""
+
+INDEX_SUFFIX = ".icuindex"
+INDEX_VERSION = 1
+
+FUZZY_THRESHOLD = 0.6
+FUZZY_CANDIDATES = 5
+FUZZY_RATING_MARGIN = 100
+
+COLUMN_ALIASES = {
+    "id": ["icu id", "icu code", "icu_id", "id", "code"],
+    "last_name": ["last name", "surname", "last_name"],
+    "first_name": ["first name", "forename", "first_name"],
+    "name": ["name", "player"],
+    "fed": ["fed", "federation"],
+    "rating": ["rating", "icu rating", "latest rating"],
+}
+
+
+class Member:
+    def __init__(self, icu_id, name, fed="", rating=None):
+        self.icu_id = icu_id
+        self.name = name
+        self.fed = fed
+        self.rating = rating
+
+
+class Match:
+    """The result of looking up one name. code is the ICU id when exactly one
+    member was chosen, and None otherwise."""
+    def __init__(self, name, kind, candidates, chosen=None):
+        self.name = name
+        self.kind = kind
+        self.candidates = candidates
+        self.chosen = chosen
+
+    @property
+    def code(self):
+        return None if self.chosen is None else self.chosen.icu_id
+
+    @property
+    def ambiguous(self):
+        return self.chosen is None and len(self.candidates) > 1
+
+
+def canonical(name):
+    """ "Surname, Forename" -> "Surname,Forename" with single spaces"""
+    return ",".join(" ".join(part.split()) for part in name.split(",", 1))
+
+def normalise(name):
+    """lower case letters only, keeping the comma between surname and forename"""
+    decomposed = unicodedata.normalize("NFKD", name)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return ",".join(re.sub(r"[^a-z]", "", part) for part in stripped.casefold().split(",", 1))
+
+def trigrams(key):
+    padded = "  %s " % key.replace(",", " ")
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class IcuIndex:
+    def __init__(self, members):
+        self.members = members
+        self.exact = {}
+        self.normalised = {}
+        self.grams = {}
+        self.gram_counts = []
+        for i, member in enumerate(members):
+            self.exact.setdefault(canonical(member.name), []).append(i)
+            key = normalise(member.name)
+            self.normalised.setdefault(key, []).append(i)
+            member_grams = trigrams(key)
+            self.gram_counts.append(len(member_grams))
+            for gram in member_grams:
+                self.grams.setdefault(gram, []).append(i)
+
+    def fuzzy(self, key):
+        """[(score, member index)] for the closest names, best first"""
+        query = trigrams(key)
+        shared = Counter()
+        for gram in query:
+            shared.update(self.grams.get(gram, ()))
+        scored = [(2 * n / (len(query) + self.gram_counts[i]), i) for i, n in shared.items()]
+        scored = [(score, i) for score, i in scored if score >= FUZZY_THRESHOLD]
+        scored.sort(reverse=True)
+        return scored[:FUZZY_CANDIDATES]
+
+    def lookup(self, name, fed=None, rating=None):
+        rows = self.exact.get(canonical(name))
+        kind = "exact"
+        if not rows:
+            rows = self.normalised.get(normalise(name))
+            kind = "normalised"
+        if not rows:
+            scored = self.fuzzy(normalise(name))
+            if scored:
+                best = scored[0][0]
+                # only names as close as the best are real candidates
+                rows = [i for score, i in scored if score >= best - 0.05]
+            kind = "fuzzy"
+        if not rows:
+            return Match(name, "none", [])
+        candidates = [self.members[i] for i in rows]
+        chosen = choose(candidates, fed, rating)
+        if kind == "fuzzy" and not confirms(chosen, fed, rating):
+            chosen = None
+        return Match(name, kind, candidates, chosen)
+
+    def lookup_all(self, names):
+        return {name: self.lookup(name) for name in names}
+
+
+def choose(candidates, fed=None, rating=None):
+    """The one candidate left after preferring fed and then the nearest rating, or None"""
+    if len(candidates) > 1 and fed:
+        same_fed = [c for c in candidates if c.fed == fed]
+        if same_fed:
+            candidates = same_fed
+    if len(candidates) > 1 and rating:
+        rated = sorted((abs(c.rating - int(rating)), i) for i, c in enumerate(candidates) if c.rating)
+        if len(rated) == 1 or (len(rated) > 1 and rated[0][0] < rated[1][0]):
+            return candidates[rated[0][1]]
+    if len(candidates) == 1:
+        return candidates[0]
+    return None
+
+
+def confirms(member, fed=None, rating=None):
+    """Whether a player's fed and rating back up a fuzzy match to member"""
+    if member is None or not rating or not member.rating:
+        return False
+    if fed and member.fed and fed != member.fed:
+        return False
+    return abs(member.rating - int(rating)) <= FUZZY_RATING_MARGIN
+
+
+def find_columns(headings):
+    headings = [h.strip().lower().replace("_", " ") for h in headings]
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias.replace("_", " ") in headings:
+                columns[field] = headings.index(alias.replace("_", " "))
+                break
+    if "id" not in columns or not ("name" in columns or "last_name" in columns):
+        raise ValueError("could not find the ICU id and name columns in %s" % headings)
+    return columns
+
+def read_members(filename):
+    members = []
+    with open(filename, newline="", encoding="utf-8-sig") as f:
+        rows = csv.reader(f)
+        columns = find_columns(next(rows))
+        for row in rows:
+            if not row:
+                continue
+            def value(field):
+                index = columns.get(field)
+                return row[index].strip() if index is not None and index < len(row) else ""
+            if "last_name" in columns:
+                name = "%s,%s" % (value("last_name"), value("first_name"))
+            else:
+                name = value("name")
+            rating = value("rating")
+            members.append(Member(value("id"), name, value("fed"), int(rating) if rating.isnumeric() else None))
+    return members
+
+
+def load(filename, index_path=None):
+    """Return the IcuIndex for an ICU list CSV, from the pickled index if the CSV has not changed"""
+    if index_path is None:
+        index_path = filename + INDEX_SUFFIX
+    stamp = [os.stat(filename).st_mtime_ns, os.stat(filename).st_size]
+    try:
+        with open(index_path, "rb") as f:
+            version, saved_stamp, index = pickle.load(f)
+        if version == INDEX_VERSION and saved_stamp == stamp:
+            return index
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError):
+        pass
+    index = IcuIndex(read_members(filename))
+    with atomic_file.writing(index_path, "wb") as f:
+        pickle.dump((INDEX_VERSION, stamp, index), f, pickle.HIGHEST_PROTOCOL)
+    return index
+
+
+def assign_codes(players, index):
+    """Set icu_code on each player the index resolves, and report the rest on
+    stderr. The player's federation and rating, when the source gave them, break
+    ties between namesakes. Returns {player name : Match} for every player."""
+    matches = {}
+    for player in players:
+        match = index.lookup(player.name, player.fed, player.rating)
+        matches[player.name] = match
+        if match.code is not None:
+            player.icu_code = match.code
+            if match.kind == "fuzzy":
+                print("ICU code for %s taken from closest name %s, whose rating agrees" % (
+                    player.name, match.chosen.name), file=sys.stderr)
+        elif match.kind == "fuzzy":
+            print("No ICU code for %s; closest names: %s" % (player.name, ", ".join(
+                "%s (%s)" % (c.name, c.icu_id) for c in match.candidates)), file=sys.stderr)
+        elif match.ambiguous:
+            print("Ambiguous ICU code for %s: %s" % (player.name, ", ".join(
+                "%s (%s)" % (c.name, c.icu_id) for c in match.candidates)), file=sys.stderr)
+        else:
+            print("No ICU code found for %s" % player.name, file=sys.stderr)
+    return matches
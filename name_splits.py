@@ -0,0 +1,122 @@
+import argparse
+import os
+import pickle
+
+import atomic_file
+
+
+"""Where a name without a comma splits into surname and forenames
+
+chess-results and 4NCL pages often give "Van der Berg Pieter" rather than
+"Van der Berg, Pieter". The FIDE list has every rated player in
+"Surname, Forename" form, so an index built from it says how many of the
+leading words are the surname. Only the names the particle heuristic below gets
+wrong are kept, as {lower-case words : number of surname words}, so even the
+full list makes a small file that loads quickly. A name the index does not have
+(or that FIDE splits more than one way) falls back to the heuristic.
+
+The index is only used when asked for, with configure() or
+parsechessresults.py --names index.pickle; otherwise every name is split by the
+heuristic, so the output never depends on files lying around.
+
+Usage: python name_splits.py players_list_foa.zip [--output index.pickle]"""
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.expanduser("~"), ".cache", "icu_scripts", "name_splits.pickle")
+
+INDEX_VERSION = 1
+
+# a key FIDE splits in different ways; dropped once the index is built
+AMBIGUOUS = -1
+
+
+def guess_surname_count(tokens):
+    """the number of leading tokens that make up the surname, from common particles"""
+    if len(tokens) > 3 and " ".join(tokens[:2]).lower() in ["van der", "van den", "mac an"]:
+        return 3
+    elif len(tokens) > 2 and tokens[0].lower() in ["mc", "mac", "al", "de", "ui", "ni", "o", "ul", "vam", "van", "der", "den"]:
+        return 2
+    elif len(tokens) > 2 and " ".join(tokens[:2]) in ["Plaza Reino"]:
+        return 2
+    return 1
+
+def key_for(tokens):
+    return " ".join(tokens).casefold()
+
+
+def build_index(names):
+    """{key : surname count} for the "Surname, Forename" names that the heuristic splits wrongly"""
+    splits = {}
+    for name in names:
+        surname, comma, forename = name.partition(",")
+        surname_tokens = surname.split()
+        tokens = surname_tokens + forename.split()
+        if not comma or not surname_tokens or len(tokens) < 2:
+            continue
+        key = key_for(tokens)
+        count = len(surname_tokens)
+        previous = splits.get(key)
+        if previous is None:
+            splits[key] = count
+        elif previous != count:
+            splits[key] = AMBIGUOUS
+    return {key: count for key, count in splits.items()
+            if count != AMBIGUOUS and count != guess_surname_count(key.split())}
+
+def build(source, index_path=DEFAULT_INDEX_PATH):
+    """Build and save the index from a FIDE list in any format parse_fide reads"""
+    import fide_cache
+    fide_list = fide_cache.load(source)
+    try:
+        index = build_index(fide_list.name(row) for row in range(len(fide_list)))
+    finally:
+        fide_list.close()
+    directory = os.path.dirname(index_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with atomic_file.writing(index_path, "wb") as f:
+        pickle.dump((INDEX_VERSION, index), f, pickle.HIGHEST_PROTOCOL)
+    return index
+
+def load(index_path=DEFAULT_INDEX_PATH):
+    """the saved index, or an empty one if there is none"""
+    try:
+        with open(index_path, "rb") as f:
+            version, index = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        return {}
+    return index if version == INDEX_VERSION else {}
+
+
+_index = {}
+
+def configure(index_path=None, index=None):
+    """Use the index saved at index_path, or an index dict directly; with
+    neither, go back to the heuristic alone"""
+    global _index
+    if index is not None:
+        _index = index
+    elif index_path is not None:
+        _index = load(index_path)
+    else:
+        _index = {}
+
+def surname_count(tokens):
+    count = _index.get(key_for(tokens))
+    if count is None or count >= len(tokens):
+        return guess_surname_count(tokens)
+    return count
+
+def split(name):
+    """ "Van der Berg Pieter" -> "Van der Berg,Pieter" """
+    tokens = name.split()
+    surnames = surname_count(tokens)
+    return " ".join(tokens[:surnames]) + "," + " ".join(tokens[surnames:])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the surname/forename index from a FIDE list")
+    parser.add_argument("source", help="FIDE list, XML, TXT or zip")
+    parser.add_argument("--output", default=DEFAULT_INDEX_PATH)
+    args = parser.parse_args()
+    index = build(args.source, args.output)
+    print("%d names the heuristic splits differently, saved to %s" % (len(index), args.output))
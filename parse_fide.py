@@ -1,66 +1,314 @@
-import sys
+import argparse
+import mmap
+import os
+import zipfile
 from collections import Counter
 import xml.etree.ElementTree as ET
 
+import fide_cache
+import profiling
+
 
 """Parse FIDE rating file and get some statistics for annual report
 
-Get FIDE file from https://ratings.fide.com/download_lists.phtml - Combined list STD, BLZ, RPD - XML format
+Get FIDE file from https://ratings.fide.com/download_lists.phtml - Combined list STD, BLZ, RPD - TXT or XML
+format. The zip can be used as downloaded; the TXT one is the quickest to read.
+
+Usage: python parse_fide.py players_list_foa.zip [IRL ENG SCO ... | all] [--table]
+
+The list is read incrementally, one player at a time, so memory use stays flat
+however big the file is. The first run also writes a columnar cache next to the
+list (see fide_cache.py) and later runs read that instead of the XML."""
+
+class FidePlayer:
+    """One row of the FIDE list. Ratings and birthday are ints, or None when empty"""
+    __slots__ = ("fideid", "name", "country", "sex", "title", "rating", "rapid_rating",
+                 "blitz_rating", "birthday", "flag")
+
+    def __init__(self, fideid, name, country, sex="", title="", rating=None, rapid_rating=None,
+                 blitz_rating=None, birthday=None, flag=""):
+        self.fideid = fideid
+        self.name = name
+        self.country = country
+        self.sex = sex
+        self.title = title
+        self.rating = rating
+        self.rapid_rating = rapid_rating
+        self.blitz_rating = blitz_rating
+        self.birthday = birthday
+        self.flag = flag
+
+def to_int(text):
+    if text is None or not text.strip():
+        return None
+    return int(text)
+
+def player_from_element(node):
+    return FidePlayer(
+        to_int(node.findtext("fideid")),
+        node.findtext("name") or "",
+        node.findtext("country") or "",
+        node.findtext("sex") or "",
+        node.findtext("title") or "",
+        to_int(node.findtext("rating")),
+        to_int(node.findtext("rapid_rating")),
+        to_int(node.findtext("blitz_rating")),
+        to_int(node.findtext("birthday")),
+        node.findtext("flag") or "")
+
+# column labels of the fixed-width TXT list, in order, and the FidePlayer field each one fills
+TXT_FIELDS = [
+    ("ID Number", "fideid"),
+    ("Name", "name"),
+    ("Fed", "country"),
+    ("Sex", "sex"),
+    ("Tit", "title"),
+    ("WTit", None),
+    ("OTit", None),
+    ("FOA", None),
+    ("SRtng", "rating"),
+    ("SGm", None),
+    ("SK", None),
+    ("RRtng", "rapid_rating"),
+    ("RGm", None),
+    ("Rk", None),
+    ("BRtng", "blitz_rating"),
+    ("BGm", None),
+    ("BK", None),
+    ("B-day", "birthday"),
+    ("Flag", "flag"),
+]
 
-Usage: python parse_fide.py players_list_xml_foa.xml
+def txt_columns(header):
+    """Return {field : (start, end)} from the header line of the TXT list.
+    Each column runs from the start of its label to the start of the next one."""
+    starts = []
+    position = 0
+    for label, field in TXT_FIELDS:
+        position = header.index(label, position)
+        starts.append(position)
+        position += len(label)
+    ends = starts[1:] + [None]
+    return {field: (start, end) for (label, field), start, end in zip(TXT_FIELDS, starts, ends) if field}
 
-Takes approx 20 sec to run"""
+def iter_txt_lines(lines, country=None, totals=None):
+    """Yield FidePlayers from the lines (as bytes) of the fixed-width TXT list.
+    Lines that are plain ASCII are sliced without being decoded first."""
+    lines = iter(lines)
+    columns = txt_columns(next(lines).decode("utf-8", "replace"))
+    # slices in the order of FidePlayer's fields
+    slices = [slice(*columns[field]) for field in FidePlayer.__slots__]
+    fed_start, fed_end = columns["country"]
+    fed_filter = None if country is None else country.encode("ascii")
+    for line in lines:
+        line = line.rstrip(b"\r\n")
+        if not line.strip():
+            continue
+        if not line.isascii():
+            line = line.decode("utf-8", "replace")
+            fed = line[fed_start:fed_end].strip()
+            if totals is not None:
+                totals[fed] += 1
+            if country is None or fed == country:
+                yield player_from_fields([line[s].strip() for s in slices])
+            continue
+        fed = line[fed_start:fed_end].strip()
+        if totals is not None:
+            totals[fed.decode("ascii")] += 1
+        if fed_filter is None or fed == fed_filter:
+            yield player_from_fields([line[s].strip().decode("ascii") for s in slices])
 
-def display(node):
-    for child in node:
-        print(child.tag, child.text)
+def player_from_fields(fields):
+    """fields are the text of each FidePlayer field, in order"""
+    fideid, name, country, sex, title, rating, rapid_rating, blitz_rating, birthday, flag = fields
+    return FidePlayer(to_int(fideid), name, country, sex, title, to_int(rating), to_int(rapid_rating),
+                      to_int(blitz_rating), to_int(birthday), flag)
+
+def iter_xml_players(source, country=None, totals=None):
+    """Yield a FidePlayer for each <player> in the XML list, which may be a filename
+    or an open file"""
+    context = ET.iterparse(source, events=("start", "end"))
+    _, root = next(context)
+    for event, elem in context:
+        if event != "end" or elem.tag != "player":
+            continue
+        fed = elem.findtext("country")
+        if totals is not None:
+            totals[fed] += 1
+        if country is None or fed == country:
+            yield player_from_element(elem)
+        # drop the element and its reference from the root so the tree never grows
+        elem.clear()
+        root.clear()
+
+def iter_txt_players(filename, country=None, totals=None):
+    with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield from iter_txt_lines(iter(mm.readline, b""), country, totals)
+
+def iter_zip_players(filename, country=None, totals=None):
+    """Read the .xml or .txt list straight out of the zip FIDE publishes"""
+    with zipfile.ZipFile(filename) as zf:
+        members = [name for name in zf.namelist() if name.lower().endswith((".xml", ".txt"))]
+        if not members:
+            raise ValueError("no .xml or .txt FIDE list in %s" % filename)
+        with zf.open(members[0]) as f:
+            if members[0].lower().endswith(".xml"):
+                yield from iter_xml_players(f, country, totals)
+            else:
+                yield from iter_txt_lines(f, country, totals)
+
+def iter_players(source, country=None, totals=None):
+    """Yield a FidePlayer for each player in the FIDE list, optionally only
+    those from one federation. The list may be the XML or the fixed-width TXT
+    download, either unzipped or still in its .zip.
+    If totals is a Counter, it is updated with the number of players seen
+    per federation, including the ones filtered out."""
+    extension = os.path.splitext(source)[1].lower()
+    if extension == ".zip":
+        return iter_zip_players(source, country, totals)
+    elif extension == ".txt":
+        return iter_txt_players(source, country, totals)
+    else:
+        return iter_xml_players(source, country, totals)
+
+def display(player):
+    for field in FidePlayer.__slots__:
+        print(field, getattr(player, field))
 
 def count(iterable):
     return sum(1 for i in iterable)
 
 def has_standard_rating(player):
-    return player.find("rating").text is not None
+    return player.rating is not None
 
 def has_blitz_rating(player):
-    return player.find("blitz_rating").text is not None
+    return player.blitz_rating is not None
 
 def has_rapid_rating(player):
-    return player.find("rapid_rating").text is not None
+    return player.rapid_rating is not None
 
 def has_any_rating(player):
     return has_standard_rating(player) or has_blitz_rating(player) or has_rapid_rating(player)
 
 def is_active(player):
-    flags = player.find("flag").text or ""
-    return "i" not in flags
+    return "i" not in player.flag
+
+
+class FederationStats:
+    """Counters and standard rating histogram for one federation, filled in by
+    calling add() once per player"""
+    def __init__(self):
+        self.players = 0
+        self.active = 0
+        self.standard = 0
+        self.active_standard = 0
+        self.active_blitz = 0
+        self.active_rapid = 0
+        self.active_any = 0
+        self.active_not_standard = 0
+        self.histogram = Counter()
 
-filename = sys.argv[1]
-players = ET.parse(filename).getroot() # takes approx 20 sec
-irish = [c for c in players if c.find("country").text == "IRL"]
+    def add(self, player):
+        standard = has_standard_rating(player)
+        self.players += 1
+        if standard:
+            self.standard += 1
+        if not is_active(player):
+            return
+        blitz = has_blitz_rating(player)
+        rapid = has_rapid_rating(player)
+        self.active += 1
+        if standard:
+            self.active_standard += 1
+            self.histogram[100 * (player.rating // 100)] += 1
+        if blitz:
+            self.active_blitz += 1
+        if rapid:
+            self.active_rapid += 1
+        if standard or blitz or rapid:
+            self.active_any += 1
+            if not standard:
+                self.active_not_standard += 1
 
+# (label, FederationStats attribute) in the order they appear in the report
+REPORT_LINES = [
+    ("Total %s players:", "players"),
+    ("Total active %s players:", "active"),
+    ("Total %s players with standard rating", "standard"),
+    ("Total active %s players with standard rating", "active_standard"),
+    ("Total active %s players with blitz rating", "active_blitz"),
+    ("Total active %s players with rapid rating", "active_rapid"),
+    ("Total active %s players with any rating", "active_any"),
+    ("Total active %s players with blitz or rapid but not standard", "active_not_standard"),
+]
 
-print("Total FIDE players (expect approx 1,000,000)", len(players))
-print("Total IRL players:", count(irish))
-print("Total active IRL players:", count(p for p in irish if is_active(p)))
-print("Total IRL players with standard rating", count(p for p in irish if has_standard_rating(p)))
-print("Total active IRL players with standard rating", count(p for p in irish if is_active(p)
-    and has_standard_rating(p)))
-print("Total active IRL players with blitz rating", count(p for p in irish if is_active(p)
-    and has_blitz_rating(p)))
-print("Total active IRL players with rapid rating", count(p for p in irish if is_active(p)
-    and has_rapid_rating(p)))
-print("Total active IRL players with any rating", count(p for p in irish if is_active(p)
-    and has_any_rating(p)))
-print("Total active IRL players with blitz or rapid but not standard", count(p for p in irish if is_active(p)
-    and has_any_rating(p) and not has_standard_rating(p)))
+def aggregate(players):
+    """Read each player once and return a dict of {federation : FederationStats}"""
+    stats = {}
+    for player in players:
+        fed_stats = stats.get(player.country)
+        if fed_stats is None:
+            fed_stats = stats[player.country] = FederationStats()
+        fed_stats.add(player)
+    return stats
 
-hist = Counter(100 * (int(p.find("rating").text) // 100) for p in irish if is_active(p)
-        and has_standard_rating(p))
-for k in range(700, 2700, 100):
-    print("%4d\t%4d" % (k, hist.get(k, 0)))
+def print_report(fed, fed_stats):
+    for label, attr in REPORT_LINES:
+        print(label % fed, getattr(fed_stats, attr))
+    for k in range(700, 2700, 100):
+        print("%4d\t%4d" % (k, fed_stats.histogram.get(k, 0)))
 
+def print_table(stats, feds):
+    """Print the counters side by side for several federations, tab separated"""
+    print("\t".join([""] + feds))
+    for label, attr in REPORT_LINES:
+        name = (label % "").replace("  ", " ").rstrip(":")
+        print("\t".join([name] + [str(getattr(stats.get(fed, FederationStats()), attr)) for fed in feds]))
 
 
+def report(filename, feds=("IRL",), table=False, use_cache=True):
+    if not use_cache:
+        with profiling.stage("aggregate") as stage:
+            stats = aggregate(iter_players(filename))
+            total = sum(s.players for s in stats.values())
+            stage.add(bytes=os.path.getsize(filename), rows=total)
+    else:
+        with profiling.stage("cache"):
+            fide_list = fide_cache.load(filename)
+        try:
+            total = len(fide_list)
+            with profiling.stage("aggregate") as stage:
+                if "all" in feds:
+                    stats = aggregate(fide_list)
+                else:
+                    stats = aggregate(fide_list.players(row for fed in feds for row in fide_list.rows_for_country(fed)))
+                stage.add(rows=sum(s.players for s in stats.values()))
+        finally:
+            fide_list.close()
+    if "all" in feds:
+        feds = sorted(stats)
+    feds = list(feds)
 
+    with profiling.stage("output"):
+        print("Total FIDE players (expect approx 1,000,000)", total)
+        if table:
+            print_table(stats, feds)
+            return
+        for fed in feds:
+            print_report(fed, stats.get(fed, FederationStats()))
 
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Statistics from the FIDE rating list")
+    parser.add_argument("filename")
+    parser.add_argument("feds", nargs="*", default=["IRL"],
+        help="federations to report on, or 'all' (default IRL)")
+    parser.add_argument("--table", action="store_true",
+        help="print one comparison table instead of a report per federation")
+    parser.add_argument("--no-cache", action="store_true",
+        help="read the XML directly instead of through the columnar cache")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.start_from_arguments(args)
+    report(args.filename, args.feds, args.table, not args.no_cache)
+    profiling.finish_from_arguments(args)
@@ -1,10 +1,16 @@
-import urllib.request
-import bs4
+import argparse
 import sys
 from enum import Enum
 import io
-import ssl
-from openpyxl import load_workbook
+import html
+import re
+
+# bs4, openpyxl, the thread pool, the FIDE and ICU lists, and the network side
+# of http_cache are imported where they are used, so each kind of source only
+# loads what it needs: a 4NCL or saved HTML page never loads openpyxl
+import http_cache
+import name_splits
+import profiling
 
 """
 script for parsing chess-results.com pages into ICU-CSV format.
@@ -14,14 +20,63 @@ Usage:
 python3 parsechessresults.py "http://chess-results.com/tnr367947.aspx?lan=1&art=9&fedb=IRL&fed=IRL&turdet=YES&flag=30&snr=42" # an individual
 python3 parsechessresults.py "http://chess-results.com/tnr373918.aspx?lan=1&art=20&fed=IRL&flag=30" # a team
 python3 parsechessresults.py "http://chess-results.com/tnr385901.aspx?lan=1&zeilen=0&art=25&fedb=IRL&turdet=YES&flag=30&prt=4&excel=2010" # a team, from Excel file
+python3 parsechessresults.py "http://chess-results.com/tnr367947.aspx?lan=1&art=4" --fed IRL # every Irish player, from one crosstable
+python3 parsechessresults.py saved_page.html # a saved page or Excel export; the kind of page is sniffed from its first bytes
 python3 parsechessresults.py "http://www.4nclresults.co.uk/2018-19/4ncl/1/2b/export/" 12 # parse 4NCL site rounds 1 and 2 for div 2b
 python3 parsechessresults.py "http://www.4nclresults.co.uk/2018-19/4ncl/7/2b/export/" 72b,82c #4ncl that spans multiple divisions, here 7/2b and 8/2c
+python3 parsechessresults.py "http://www.4nclresults.co.uk/2018-19/4ncl/1/2b/export/" 12 --team Gonzaga --team "Brown Jack" # several clubs from one crawl
+
+Pages are cached on disk (see http_cache.py), so re-running an event is quick.
+Use --offline to only use the cache, or --no-cache to always download.
+--record DIR keeps every page fetched, and --replay DIR runs from those pages alone (see replay.py).
+
+python3 parsechessresults.py --batch season.txt --out-dir csv # many events at once, see batch.py
+python3 parsechessresults.py "http://chess-results.com/tnr367947.aspx?lan=1&art=4" --fed IRL --db results.db # also save it, see results_db.py
+python3 parsechessresults.py "http://chess-results.com/tnr367947.aspx?lan=1&art=9&snr=42" --watch 60 --watch-csv live.csv # follow a live event, see watch.py
+
+ICU codes are looked up by name with --icu-list members.csv, an export of the ICU
+rating list (see icu_codes.py). Players not found, matching several members, or
+only close to a member's name, are reported on stderr and output as ????.
 
 Limitations:
-    -need to add ICU code for the player (output as ???? instead)
-    -may split surnames from first names wrongly. Maybe we could get them from the FIDE site instead
+    -may split surnames from first names wrongly; --names with an index built from
+     the FIDE list fixes this for the players in it
+     (build the index with: python3 name_splits.py players_list_foa.zip)
 """
 
+# number of pages fetched at once, e.g. the rounds of a 4NCL season
+FETCH_WORKERS = 8
+
+# the 4NCL team to output when none is given
+TEAM_NAME = "Gonzaga"
+
+# headings that start the part of a chess-results page with the results in it
+RESULTS_MARKERS = [b"<h2>Player info</h2>", b"Player info", b"Player details for"]
+TITLE_RE = re.compile(rb"<title>(.*?)</title>", re.DOTALL | re.IGNORECASE)
+DIV_RE = re.compile(rb"<(/?)div\b", re.IGNORECASE)
+HEADING_RE = re.compile(rb"<h2>([^<]*)</h2>", re.IGNORECASE)
+CROSSTABLE_RE = re.compile(rb"<h2>[^<]*crosstable", re.IGNORECASE)
+CROSSTABLE_ROUND_RE = re.compile(r"^(\d+)\.\s*Rd\.?$")
+# bytes at the start of a page the sniffers look at; the headings they look for
+# come before the results tables
+SNIFF_BYTES = 128 * 1024
+XLSX_MAGIC = b"PK\x03\x04"
+TEAM_MARKERS = (b"Team composition", b"Player overview for")
+# self-closed divs on chess-results pages, like <div class="FarbewT"/></div>
+BROKEN_DIV_RE = re.compile(rb'<div class="(Farbe[ws]T)"/></div>')
+
+# (name, sniffer, parser) for each kind of page parse_chessresults_html reads, tried
+# in order: the sniffer gets the first SNIFF_BYTES of the page and says whether
+# the parser, taking (data, fed) and returning (event, players), should have it.
+# Register a new format, e.g. a Swiss-Manager export, with @page_parser.
+PAGE_PARSERS = []
+# (name, matches, parser) for sources that are not a single page, like 4NCL
+# rounds; see @source_parser. Anything else is read and sniffed as a page.
+SOURCE_PARSERS = []
+
+# a crosstable result cell like "45w1", "12b½", "7s0", "-1" (bye) or "23w+" (forfeit)
+CROSSTABLE_CELL_RE = re.compile(r"^(?:(\d+)([wbs])|[-+])(1|0|½|=|\+|-)$")
+
 class Colour(Enum):
     UNKNOWN = 0
     WHITE = 1
@@ -43,17 +98,24 @@ class PlayerResult:
         self.opp_fed = opp_fed
         
 class Player:
-    def __init__(self, name, icu_code="????"):
+    def __init__(self, name, icu_code="????", fed=None, rating=None):
         self.name = name
         self.icu_code = icu_code
+        # the player's own federation and rating, when the source gives them;
+        # they break ties between namesakes in the ICU list
+        self.fed = fed
+        self.rating = rating
         self.score = 0
         self.results = {}
 
+def urlopen(url):
+    """Open a URL through the on-disk cache in http_cache.py"""
+    return http_cache.urlopen(url)
+
 def insecure_urlopen(url):
     """Open a URL without verifying SSL cert, because that was
     broken for 4NCL"""
-    context = ssl._create_unverified_context()
-    return urllib.request.urlopen(url, context=context)
+    return http_cache.urlopen(url, insecure=True)
 
 def is_opponent_class(css_class):
     if css_class is None:
@@ -71,15 +133,8 @@ def is_header_class(css_class):
 
 
 def commaize(name):
-    tokens = name.split()
-    surnames = 1
-    if len(tokens) > 3 and " ".join(tokens[:2]).lower() in ["van der", "van den", "mac an"]:
-        surnames = 3
-    elif len(tokens) > 2 and tokens[0].lower() in ["mc", "mac", "al", "de", "ui", "ni", "o", "ul", "vam", "van", "der", "den"]:
-        surnames = 2
-    elif len(tokens) > 2 and " ".join(tokens[:2]) in ["Plaza Reino"]:
-        surnames = 2
-    return " ".join(tokens[:surnames]) + "," + " ".join(tokens[surnames:])
+    """ "Surname Forename" -> "Surname,Forename", split where the FIDE list does (see name_splits.py)"""
+    return name_splits.split(name)
 
 def replace_all_but_one_comma(name):
     """strip the name of any commas after the first"""
@@ -96,7 +151,7 @@ def is_fide_title(text):
 def parse_4ncl_title(text):
     text = text.replace("j", "").strip()
     text = text.replace("*", "").strip()
-    titles_dict = {"" : "", "w" : "", "c" : "CM", "f" : "FM", "i" : "IM", "g" : "GM", "wc" : "WCM", "wf" : "WFM", "wi" : "wim", "wg" : "WGM"}
+    titles_dict = {"" : "", "w" : "", "c" : "CM", "f" : "FM", "i" : "IM", "g" : "GM", "wc" : "WCM", "wf" : "WFM", "wi" : "WIM", "wg" : "WGM"}
     return titles_dict[text]
 
 
@@ -162,58 +217,147 @@ def reverse_colour(colour):
     else:
         raise ValueError("could not reverse colour for %s" % colour)
 
+def normalise_name(name):
+    """The key two spellings of the same player's name share: case and the
+    spacing around the comma and between words are ignored"""
+    return " ".join(name.replace(",", ", ").split()).casefold()
+
+class PlayerRegistry:
+    """Players gathered from any number of rounds, events and sources
+    (chess-results pages and Excel, 4NCL), indexed by normalised name so each
+    merge is a dict lookup. Merging a player already seen adds their results
+    and score to the first one."""
+    def __init__(self, players=None):
+        self.players = [] if players is None else players
+        self.index = {}
+        self.sources = {}
+        for player in self.players:
+            self.index.setdefault(normalise_name(player.name), player)
+
+    def __len__(self):
+        return len(self.players)
+
+    def __iter__(self):
+        return iter(self.players)
+
+    def get(self, name):
+        return self.index.get(normalise_name(name))
+
+    def merge(self, players, source=None):
+        for player in players:
+            key = normalise_name(player.name)
+            existing = self.index.get(key)
+            if existing is None:
+                self.index[key] = player
+                self.players.append(player)
+            else:
+                existing.results.update(player.results)
+                existing.score += player.score
+                existing.fed = existing.fed or player.fed
+                existing.rating = existing.rating or player.rating
+            if source is not None:
+                self.sources.setdefault(key, []).append(source)
+        return self.players
+
 def merge_players(playerlist1, playerlist2):
     """merges the players destructively into playerlist1"""
-    for player2 in playerlist2:
-        match = [player1 for player1 in playerlist1 if player1.name == player2.name]
-        if match:
-            player1 = match[0]
-            player1.results.update(player2.results)
-            player1.score += player2.score
-        else:
-            playerlist1.append(player2)
-    return playerlist1
-
+    return PlayerRegistry(playerlist1).merge(playerlist2)
+
+
+def rating_4ncl(text):
+    """the rating from a 4NCL cell like "2105 F", or 0 if there is none"""
+    tokens = text.split()
+    if tokens and tokens[0].isnumeric():
+        return int(tokens[0])
+    return 0
+
+def board_player(rd, name, colour, result, opp_name, opp_title, opp_rating, rating=None):
+    """A Player for one side of a 4NCL board, with the result from their point of view"""
+    player = Player(name.replace(", ", ","), rating=rating)
+    player.score += score_value_4ncl(result)
+    score = score_character_4ncl(result)
+    opp_fed = "ENG" # replaced from the FIDE list by enrich_opponents, when we have one
+    player_result = PlayerResult(player, rd, score, colour, opp_name, opp_rating, parse_4ncl_title(opp_title), opp_fed)
+    player.results[rd] = player_result
+    return player
 
-def parse_4ncl(soup, rd):
-    TEAM_NAME = "Gonzaga" # pass in on command line?
-    players = []
-    td = soup.find_all("td",text=TEAM_NAME)[1]
-    # check if we are looking at the first named team or the second one
-    team_line = td.parent.find_all("td")
-    if td == team_line[1]:
-        first_team = True
-    elif td == team_line[4]:
-        first_team = False
-    else:
-        raise ValueError("could not identify if we are looking at the home or away team")
-    tr = td.parent.next_sibling.next_sibling
-    while len(tr.find_all("td")) == 9:
+def parse_4ncl_matches(soup, rd):
+    """Read every match on a 4NCL export page in one pass.
+    Returns {(team, rd) : [Player]} with a Player per board for both teams.
+    A match is a row naming the home team in its 2nd cell and the away team
+    in its 5th, followed by a 9-cell row per board."""
+    matches = {}
+    home = away = None
+    for tr in soup.find_all("tr"):
         tds = tr.find_all("td")
-        if first_team:
-            name = tds[2].text.replace(", ", ",")
-            opp_name = tds[6].text
-            opp_title = parse_4ncl_title(tds[7].text)
-            opp_rating = int(tds[8].text.split()[0])
-            colour = score_colour(tds[1].text)
+        if len(tds) == 9 and home is not None:
+            colour_text = tds[1].text.strip()
+            colour = score_colour(colour_text) if colour_text else None
+            if colour is None:
+                # a default or unplayed board has no game to rate for either side
+                continue
             result = tds[5].text.strip()
+            matches[(home, rd)].append(board_player(rd, tds[2].text, colour, result,
+                tds[6].text, tds[7].text, rating_4ncl(tds[8].text), rating_4ncl(tds[4].text) or None))
+            # reverse the colour and result to get them from the away player's point of view
+            matches[(away, rd)].append(board_player(rd, tds[6].text, reverse_colour(colour), result[::-1],
+                tds[2].text, tds[3].text, rating_4ncl(tds[4].text), rating_4ncl(tds[8].text) or None))
+        elif len(tds) >= 5 and len(tds) != 9:
+            home, away = tds[1].text.strip(), tds[4].text.strip()
+            # only a match heading if boards follow; a summary row is replaced by the next row
+            matches.setdefault((home, rd), [])
+            matches.setdefault((away, rd), [])
         else:
-            name = tds[6].text.replace(", ", ",")
-            opp_name = tds[2].text
-            opp_title = parse_4ncl_title(tds[3].text)
-            opp_rating = int(tds[4].text.split()[0])
-            colour = reverse_colour(score_colour(tds[1].text))
-            # reverse the result to get it from our point of view
-            result = tds[5].text.strip()[::-1]
-        player = Player(name)
-        player.score += score_value_4ncl(result)
-        score = score_character_4ncl(result)
-        players.append(player)
-        opp_fed = "ENG" # would be nice to be able to look these up, but it's maybe not necessary
-        player_result = PlayerResult(player, rd, score, colour, opp_name, opp_rating, opp_title, opp_fed)
-        player.results[rd] = player_result
-        tr = tr.next_sibling.next_sibling
-    return players
+            home = away = None
+    return {key: players for key, players in matches.items() if players}
+
+def parse_4ncl(soup, rd, team=TEAM_NAME):
+    """The players of one team on a 4NCL export page"""
+    return parse_4ncl_matches(soup, rd).get((team, rd), [])
+
+def fide_row(fide_list, rows, rating=0):
+    """The one row of rows that is the player, or None. Players sharing a name
+    are told apart by the FIDE rating nearest the one we have."""
+    if len(rows) == 1:
+        return rows[0]
+    if len(rows) > 1 and rating:
+        distances = sorted((abs(fide_list.rating[row] - rating), row) for row in rows)
+        if distances[0][0] < distances[1][0]:
+            return distances[0][1]
+    return None
+
+def enrich_opponents(players, fide_list):
+    """Replace each opponent's federation, rating and title with those in the FIDE
+    list (a fide_cache.FideList), looking every distinct opponent up in one batch.
+    Opponents not in the list, or not told apart from namesakes, are left alone.
+    An opponent with no standard FIDE rating is output unrated, rather than with
+    the 4NCL/ECF rating, and reported on stderr."""
+    results = [result for player in players for result in player.results.values()]
+    found = fide_list.rows_for_names({result.opp_name for result in results})
+    unrated = {}
+    for result in results:
+        row = fide_row(fide_list, found[result.opp_name], result.opp_rating)
+        if row is None:
+            continue
+        result.opp_fed = fide_list.country_code(row)
+        title = fide_list.titles[fide_list.title[row]]
+        result.opp_title = title if is_fide_title(title) else ""
+        if not fide_list.rating[row] and result.opp_rating:
+            unrated.setdefault(result.opp_name, result.opp_rating)
+        result.opp_rating = fide_list.rating[row]
+    for name, rating in unrated.items():
+        print("%s has no standard FIDE rating: output unrated instead of %s" % (name, rating), file=sys.stderr)
+
+def fourncl_players(matches, teams=None):
+    """Merge the players of the given teams (default: every team) across all
+    rounds of a {(team, rd) : [Player]} index, round by round"""
+    if teams is None:
+        teams = sorted({team for team, rd in matches})
+    registry = PlayerRegistry()
+    for rd in sorted({rd for team, rd in matches}):
+        for team in teams:
+            registry.merge(matches.get((team, rd), []))
+    return registry.players
 
 
 def parse_team(soup):
@@ -239,7 +383,7 @@ def parse_team(soup):
                         nameTokens.append(token)
                 name = " ".join(nameTokens)
                 name = commaize(name)
-                player = Player(name)
+                player = Player(name, **heading_fed_rating(tds[0].text))
                 players.append(player)
             elif len(tds) == 10:
                 # Rd, SNo, title, name, rating, fed, Rp, Pts, result, board
@@ -282,6 +426,7 @@ def parse_individual_auto(soup):
     """Parse results for an individual player, automatically getting the right columns
     from the headers.
     Should replace parse_team with this approach"""
+    import bs4
 
     div = [div for div in soup.find_all("div",class_="defaultDialog") if div.find("h2").text == "Player info"][0]
 
@@ -349,33 +494,177 @@ def parse_result_td(result_td):
     return score, colour
 
 
+class CrosstableEntry:
+    """One row of a crosstable: a player and their result cell for each round"""
+    def __init__(self, number, name, title="", rating="", fed="", cells=None):
+        self.number = number
+        self.name = name
+        self.title = title
+        self.rating = rating
+        self.fed = fed
+        self.cells = cells or {}
+
+
+def crosstable_columns(headings):
+    """Return {field : 0-based column} and {round : column} for a crosstable heading
+    row, or None if it is not one. Result cells refer to other players by the
+    number in the first of the Rk., No. or SNo columns found."""
+    headings = [str(h).strip() if h is not None else "" for h in headings]
+    rounds = {}
+    for i, heading in enumerate(headings):
+        match = CROSSTABLE_ROUND_RE.match(heading)
+        if match:
+            rounds[int(match.group(1))] = i
+    if not rounds or "Name" not in headings:
+        return None
+    name = headings.index("Name")
+    number = next((headings.index(h) for h in ("Rk.", "No.", "SNo") if h in headings), None)
+    if number is None:
+        return None
+    rating = next((headings.index(h) for h in ("RtgI", "Rtg") if h in headings), None)
+    fed = headings.index("FED") if "FED" in headings else None
+    return {"number": number, "name": name, "title": name - 1, "rating": rating, "fed": fed}, rounds
+
+def crosstable_from_rows(rows):
+    """Build {number : CrosstableEntry} from rows of cell values, the first
+    crosstable heading row and every row after it that starts with a number"""
+    entries = {}
+    columns = None
+    for row in rows:
+        row = ["" if value is None else str(value).strip() for value in row]
+        if columns is None:
+            columns = crosstable_columns(row)
+            continue
+        cols, rounds = columns
+        number = cell(row, cols["number"])
+        if not number or not number.isnumeric():
+            continue
+        cells = {rd: cell(row, index) or "" for rd, index in rounds.items()}
+        entries[int(number)] = CrosstableEntry(int(number), cell(row, cols["name"]) or "",
+            cell(row, cols["title"]) or "", cell(row, cols["rating"]) or "", cell(row, cols["fed"]) or "", cells)
+    return entries
+
+def parse_crosstable(soup):
+    """{number : CrosstableEntry} for every player in a chess-results crosstable page"""
+    rows = ([td.text for td in tr.find_all("td", recursive=False)] for tr in soup.find_all("tr"))
+    return crosstable_from_rows(rows)
+
+def parse_crosstable_from_xlsx(workbook):
+    """{number : CrosstableEntry} from the first sheet of a workbook that has a crosstable"""
+    for ws in workbook.worksheets:
+        entries = crosstable_from_rows(ws.iter_rows(values_only=True))
+        if entries:
+            return entries
+    return {}
+
+def crosstable_players(entries, fed=None):
+    """Players, with their results, for every crosstable entry from federation fed
+    (or all of them). Opponents are looked up by number in the same crosstable,
+    so one download covers every player in the event."""
+    players = []
+    for entry in entries.values():
+        if fed is not None and entry.fed != fed:
+            continue
+        player = Player(commaize(entry.name), fed=entry.fed or None,
+                        rating=int(entry.rating) if entry.rating.isnumeric() else None)
+        for rd, text in sorted(entry.cells.items()):
+            match = CROSSTABLE_CELL_RE.match(text.replace(" ", ""))
+            if not match:
+                continue
+            opp_number, colour_char, result = match.groups()
+            if result == "½":
+                result = "="
+            if opp_number is None or result in "+-" or int(opp_number) not in entries:
+                # bye, forfeit or unplayed game: it counts for the total but is not rated
+                player.score += {"1": 1, "+": 1, "=": 0.5}.get(result, 0)
+                continue
+            opponent = entries[int(opp_number)]
+            score = score_character(result)
+            player.score += score_value(result)
+            rating = opponent.rating
+            if not rating.isnumeric() or int(rating) == 0:
+                rating = ""
+            player.results[rd] = PlayerResult(player, rd, score, score_colour(colour_char),
+                commaize(opponent.name), rating, opponent.title, opponent.fed)
+        players.append(player)
+    return players
+
+
+# 0-based columns of the PlayerInfo sheet, used until a heading row says otherwise
+PLAYER_INFO_COLUMNS = {"title": 2, "name": 3, "rating": 4, "fed": 5, "result": 8}
+
+def sheet_rows(ws, min_row):
+    """The cell values of each row from min_row, in one forward pass over the
+    sheet, stopping at the first row with an empty first column"""
+    for row in ws.iter_rows(min_row=min_row, values_only=True):
+        if not row or not row[0]:
+            return
+        yield row
+
+def cell(row, index):
+    """the value at index in a row of values, or None if the row is short or there is no such column"""
+    if index is None or index >= len(row):
+        return None
+    return row[index]
+
+def result_columns(headings):
+    """{field : 0-based column, or None} from a heading row like
+    "Rd.", "SNo", "", "Name", "Rtg", "FED", ..., "Res." """
+    headings = list(headings)
+    def index(*names):
+        for name in names:
+            if name in headings:
+                return headings.index(name)
+        return None
+    name = index("Name")
+    return {"name": name, "title": None if name is None else name - 1, "rating": index("Rtg", "RtgI"),
+            "fed": index("FED"), "result": index("Res.")}
+
+def player_name_from_cell(cell_value, stop_at_title):
+    """The name at the start of a player heading cell, up to the first number.
+    A title either ends the name or is skipped over."""
+    name_tokens = []
+    for token in cell_value.split():
+        if token.isnumeric():
+            break
+        if is_fide_title(token):
+            if stop_at_title:
+                break
+            continue
+        name_tokens.append(token)
+    return " ".join(name_tokens).strip()
+
+def heading_fed_rating(cell_value):
+    """{"fed": ..., "rating": ...} from a player heading like "Quinn Mark IM 2351 IRL":
+    the rating is the first number and the federation a three-letter code after
+    it, each None when missing"""
+    tokens = cell_value.split()
+    for i, token in enumerate(tokens):
+        if token.isnumeric():
+            feds = [t for t in tokens[i + 1:] if len(t) == 3 and t.isalpha() and t.isupper()]
+            return {"fed": feds[0] if feds else None, "rating": int(token) or None}
+    return {"fed": None, "rating": None}
+
 def parse_team_from_xlsx(workbook):
     players = []
     if "PlayerInfo" in workbook.sheetnames:
-        ws = workbook["PlayerInfo"]
-        row = 2
-        while ws["A%s" % row].value:
-            cell_value = ws["A%s" % row].value
+        cols = dict(PLAYER_INFO_COLUMNS)
+        for row in sheet_rows(workbook["PlayerInfo"], 2):
+            cell_value = row[0]
             if isinstance(cell_value, str):
-                if "Rd." not in cell_value:
-                    tokens = cell_value.split()
-                    name_tokens = []
-                    for token in tokens:
-                        if token.isnumeric():
-                            break
-                        if is_fide_title(token):
-                            break
-                        name_tokens.append(token)
-                    name = " ".join(name_tokens).strip()
-                    player = Player(name)
+                if "Rd." in cell_value:
+                    cols.update((k, v) for k, v in result_columns(row).items() if v is not None)
+                else:
+                    player = Player(player_name_from_cell(cell_value, stop_at_title=True),
+                                    **heading_fed_rating(cell_value))
                     players.append(player)
             elif isinstance(cell_value, int):
                 rd = cell_value
-                opp_title = ws["C%s" % row].value or ""
-                opp_name = ws["D%s" % row].value.strip()
-                opp_rating = ws["E%s" % row].value
-                opp_fed = ws["F%s" % row].value
-                result = ws["I%s" % row].value.strip()
+                opp_title = cell(row, cols["title"]) or ""
+                opp_name = cell(row, cols["name"]).strip()
+                opp_rating = cell(row, cols["rating"])
+                opp_fed = cell(row, cols["fed"])
+                result = cell(row, cols["result"]).strip()
                 score = score_character(result)
                 player.score += score_value(result)
                 colour = score_colour(result)
@@ -383,64 +672,48 @@ def parse_team_from_xlsx(workbook):
                 if result[-1] != "K": # walkover or other unplayed game
                     player_result = PlayerResult(player, rd, score, colour, opp_name, opp_rating, opp_title, opp_fed)
                     player.results[rd] = player_result
-            row += 1
         return players
     elif "PlayerDetails" in workbook.sheetnames:
-        ws = workbook["PlayerDetails"]
-        row = 2
-        while ws["A%s" % row].value:
-            cell_value = ws["A%s" % row].value
+        cols = dict(PLAYER_INFO_COLUMNS)
+        for row in sheet_rows(workbook["PlayerDetails"], 2):
+            cell_value = row[0]
             if isinstance(cell_value, str):
                 if "Rd." in cell_value:
-                    headings = [cell.value for cell in ws["%d:%d" % (row, row)]]
-                    opp_name_col = get_col(headings, "Name")
-                    if opp_name_col is not None:
-                        opp_title_col = chr(ord(opp_name_col) - 1)
-                    opp_rating_col = get_col(headings, "Rtg")
-                    opp_fed_col = get_col(headings, "FED")
-                    result_col = get_col(headings, "Res.")
+                    cols = result_columns(row)
                 else:
-                    tokens = cell_value.split()
-                    name_tokens = []
-                    for token in tokens:
-                        if token.isnumeric():
-                            break
-                        if is_fide_title(token):
-                            continue
-                        name_tokens.append(token)
-                    name = " ".join(name_tokens).strip()
-                    player = Player(name)
+                    player = Player(player_name_from_cell(cell_value, stop_at_title=False),
+                                    **heading_fed_rating(cell_value))
                     players.append(player)
             elif isinstance(cell_value, int):
                 rd = cell_value
-                opp_title = ws["%s%s" % (opp_title_col, row)].value or ""
-                opp_name = ws["%s%s" % (opp_name_col, row)].value.strip()
-                opp_rating = ws["%s%s" % (opp_rating_col, row)].value
-                if opp_fed_col is None:
+                opp_title = cell(row, cols["title"]) or ""
+                opp_name = cell(row, cols["name"]).strip()
+                opp_rating = cell(row, cols["rating"])
+                if cols["fed"] is None:
                     opp_fed = "***"
                 else:
-                    opp_fed = ws["%s%s" % (opp_fed_col, row)].value
+                    opp_fed = cell(row, cols["fed"])
 
-                result = ws["%s%s" % (result_col, row)].value.strip()
+                result = cell(row, cols["result"]).strip()
                 score = score_character(result)
                 player.score += score_value(result)
                 colour = score_colour(result)
 
                 player_result = PlayerResult(player, rd, score, colour, opp_name, opp_rating, opp_title, opp_fed)
                 player.results[rd] = player_result
-            row += 1
         return players
 
-def get_col(values, search_term):
-    """Returns the excel col where the search_term is first found in the list, or None"""
-    try:
-        col = values.index(search_term)
-    except ValueError:
-        return None
-    return letter(col)
-
-def letter(index):
-    return "ABCDEFGHIJKLMNOPQRSTUVWXYZ"[index]
+def workbook_event(workbook, row=2):
+    """the event name, from column A of the TeamComposition sheet, Sheet1 or the
+    first sheet: row 2 under the "Team composition" heading of a team export, and
+    the title in row 1 of a crosstable export"""
+    for name in ("TeamComposition", "Sheet1", workbook.sheetnames[0]):
+        if name in workbook.sheetnames:
+            ws = workbook[name]
+            break
+    for (value,) in ws.iter_rows(min_row=row, max_row=row, max_col=1, values_only=True):
+        return value
+    return None
 
 def parse_commas_from_player_pairings(workbook):
     """This method figures out where commas go
@@ -451,31 +724,23 @@ def parse_commas_from_player_pairings(workbook):
         return None
     ws = workbook["PlayerPairings"]
     commas = {}
-    row = 4
-    # sometimes has ratings in this format, in which case a different column is used
-    if isinstance(ws["D4"].value, int):
-        name2_col = "G"
-    else:
-        name2_col = "F"
-
-    while ws["A%s" % row].value:
-        name1 = ws["C%s" % row].value
-        name2 = ws["%s%s" % (name2_col, row)].value
-        if name1 and "," in name1:
-            # strip trailing (w) or (b)
-            if name1.endswith(("(w)", "(b)")):
-                name1 = name1[:-4]
-            name1_no_comma = name1.replace(",", "")
-            name1_one_comma = replace_all_but_one_comma(name1)
-            commas[name1_no_comma] = name1_one_comma
-        if name2 and "," in name2:
-            if name2.endswith(("(w)", "(b)")):
-                name2 = name2[:-4]
-            name2_no_comma = name2.replace(",", "")
-            name2_one_comma = replace_all_but_one_comma(name2)
-            commas[name2_no_comma] = name2_one_comma
-        
-        row += 1
+    name1_col = 2
+    name2_col = None
+    for row in sheet_rows(ws, 4):
+        if name2_col is None:
+            # sometimes has ratings in this format (D4 is a number), in which case a different column is used
+            if isinstance(cell(row, 3), int):
+                name2_col = 6
+            else:
+                name2_col = 5
+        for name in (cell(row, name1_col), cell(row, name2_col)):
+            if name and "," in name:
+                # strip trailing (w) or (b)
+                if name.endswith(("(w)", "(b)")):
+                    name = name[:-4]
+                name_no_comma = name.replace(",", "")
+                name_one_comma = replace_all_but_one_comma(name)
+                commas[name_no_comma] = name_one_comma
 
     return commas
 
@@ -487,94 +752,297 @@ def apply_commas(players, commas):
                 result.opp_name = commaize(result.opp_name)
     else:
         for player in players:
-            player.name = commas[player.name]
+            player.name = commas.get(player.name) or commaize(player.name)
             for rd, result in player.results.items():
-                result.opp_name = commas[result.opp_name]
-
-
-def parse(source, rounds=None):
-    url = source
-
-    if not url.startswith("http"):
-        # local file. Only for CR individual result right now
-        with open(url, "rb") as f:
-            data = f.read()
-            data = preprocess_chessresults_html(data)
-            soup = bs4.BeautifulSoup(data, 'html.parser')
-
-        event = soup.title.text.split(" - ")[1].strip()
+                result.opp_name = commas.get(result.opp_name) or commaize(result.opp_name)
+
+
+def fourncl_round_urls(url, rounds):
+    """Return [(round number, export url)] for a 4NCL rounds spec, either like "12"
+    for rounds 1 and 2 of the division in url, or like "72b,82c" for round 7 of
+    division 2b and round 8 of division 2c"""
+    urlparts = url.split("/")
+    index = urlparts.index("4ncl") + 1
+    if len(rounds) > 3:
+        # like "72b,82c" to get rounds 7/2b and 8/2c
+        new_rds = rounds.split(",")
+        new_rds = [[rd[:-2], rd[-2:]] for rd in new_rds]
+    else:
+        new_rds = [[rd] for rd in rounds]
+
+    round_urls = []
+    for rd in new_rds:
+        new_urlparts = list(urlparts)
+        new_urlparts[index:index+len(rd)] = rd
+        round_urls.append((int(rd[0]), "/".join(new_urlparts)))
+    return round_urls
+
+def fetch_concurrently(urls, opener=urlopen, workers=FETCH_WORKERS):
+    """Fetch urls on a pool of threads. Yields (data, error) for each url in the
+    order given, as soon as that one is ready; error is None on success, and a
+    failed url does not stop the others."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def read(url):
+        return opener(url).read()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(urls)))) as pool:
+        futures = [pool.submit(read, url) for url in urls]
+        for future in futures:
+            try:
+                yield future.result(), None
+            except Exception as e:
+                # anything from a bad status to a truncated body only loses that url
+                yield None, e
+
+
+def parse_chessresults_html(data, fed=None):
+    """Return (event, players) from the bytes of a chess-results page or Excel
+    export, with the parser chosen by sniff(). fed picks the players from a
+    whole-tournament crosstable (default everyone)."""
+    name, parser = sniff(data)
+    return parser(data, fed)
+
+def sniff(data):
+    """(name, parser) for page data: the first of PAGE_PARSERS whose sniffer
+    accepts the head of the page, or the individual player parser. The first
+    SNIFF_BYTES decide almost every page; a longer page none of them accepted
+    is sniffed again whole, since a big page can have its markers further down."""
+    head = data[:SNIFF_BYTES]
+    for name, sniffer, parser in PAGE_PARSERS:
+        if sniffer(head):
+            return name, parser
+    if len(data) > SNIFF_BYTES:
+        for name, sniffer, parser in PAGE_PARSERS:
+            if sniffer(data):
+                return name, parser
+    return "individual", parse_individual_page
+
+def page_parser(name, sniffer):
+    """Decorator adding a parser of (data, fed) -> (event, players) to PAGE_PARSERS"""
+    def register(parser):
+        PAGE_PARSERS.append((name, sniffer, parser))
+        return parser
+    return register
+
+def is_team_page(head):
+    return any(marker in head for marker in TEAM_MARKERS)
+
+def is_crosstable_page(head):
+    return CROSSTABLE_RE.search(head) is not None
+
+@page_parser("xlsx", lambda head: head.startswith(XLSX_MAGIC))
+def parse_xlsx_data(data, fed=None):
+    """a chess-results Excel export: a team, or a whole-tournament crosstable"""
+    from openpyxl import load_workbook
+    # read-only mode streams each sheet row by row instead of loading every cell
+    with profiling.stage("xlsx") as s:
+        wb = load_workbook(io.BytesIO(data), read_only=True)
+        s.add(bytes=len(data))
+    with profiling.stage("extract") as s:
+        players = parse_team_from_xlsx(wb)
+        crosstable = players is None
+        if crosstable:
+            players = crosstable_players(parse_crosstable_from_xlsx(wb), fed)
+        s.add(rows=count_results(players))
+    if not crosstable:
+        with profiling.stage("commas"):
+            apply_commas(players, parse_commas_from_player_pairings(wb))
+    event = workbook_event(wb, 1 if crosstable else 2)
+    wb.close()
+    return event, players
 
-        if "Team composition" in str(data) or "Player overview for" in str(data):
-            players = parse_team(soup)
-        else:
-            players = [parse_individual_auto(soup)]
+@page_parser("team", is_team_page)
+def parse_team_page(data, fed=None):
+    return parse_results_page(data, parse_team)
 
-    if "chess-results.com" in url and "excel=" in url:
-        response = urllib.request.urlopen(url)
-        xlsx = response.read()
-        wb = load_workbook(io.BytesIO(xlsx))
-        #wb = load_workbook("womens.xlsx")
+@page_parser("crosstable", is_crosstable_page)
+def parse_crosstable_page(data, fed=None):
+    """every player from fed, or everyone, in a whole-tournament crosstable"""
+    import bs4
+    with profiling.stage("preprocess"):
+        data = preprocess_chessresults_html(data)
+    # only the table rows are needed, so the rest of the page is never built
+    with profiling.stage("soup") as s:
+        soup = bs4.BeautifulSoup(data, 'html.parser', parse_only=bs4.SoupStrainer("tr"))
+        s.add(bytes=len(data))
+    with profiling.stage("extract") as s:
+        players = crosstable_players(parse_crosstable(soup), fed)
+        s.add(rows=count_results(players))
+    event = page_event(data) or page_heading(data)
+    if event is None:
+        raise ValueError("Could not find the event name in the crosstable page")
+    return event, players
 
-        players = parse_team_from_xlsx(wb)
-        commas = parse_commas_from_player_pairings(wb)
-        apply_commas(players, commas)
-        
-        if "TeamComposition" in wb.sheetnames:
-            event = wb["TeamComposition"]["A2"].value
-        else:
-            event = wb["Sheet1"]["A2"].value
+def parse_individual_page(data, fed=None):
+    return parse_results_page(data, lambda soup: [parse_individual_auto(soup)])
 
-    elif "chess-results.com" in url:
-        response = urllib.request.urlopen(url)
-        data = response.read()
+def parse_results_page(data, parse_page):
+    """Return (event, players) from a team or individual page. Only the dialog
+    holding the results is parsed when it can be found; otherwise, or if parsing
+    that part fails, the whole page is parsed as before."""
+    import bs4
+    with profiling.stage("preprocess"):
         data = preprocess_chessresults_html(data)
-        soup = bs4.BeautifulSoup(data, 'html.parser')
-        event = soup.title.text.split(" - ")[1].strip()
+    event = page_event(data)
+    fragment = results_fragment(data)
+    if event is not None and fragment is not None:
+        try:
+            with profiling.stage("soup") as s:
+                soup = bs4.BeautifulSoup(fragment, 'html.parser')
+                s.add(bytes=len(fragment))
+            with profiling.stage("extract") as s:
+                players = parse_page(soup)
+                s.add(rows=count_results(players))
+            if players:
+                return event, players
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+            pass
 
-        if "Team composition" in str(data) or "Player overview for" in str(data):
-            #print("Parsing team")
-            players = parse_team(soup)
-        else:
-            #print("Parsing for individual")
-            players = [parse_individual_auto(soup)]
-
-    elif "4nclresults.co.uk" in url:
-        if rounds is None:
-            raise ValueError("Need to specify round numbers for 4NCL results")
-        players = []
-        urlparts = url.split("/")
-        index = urlparts.index("4ncl") + 1
-        if len(rounds) > 3:
-            # like "72b,82c" to get rounds 7/2b and 8/2c
-            new_rds = rounds.split(",")
-            new_rds = [[rd[:-2], rd[-2:]] for rd in new_rds]
-        else:
-            new_rds = [[rd] for rd in rounds]
+    with profiling.stage("soup") as s:
+        soup = bs4.BeautifulSoup(data, 'html.parser')
+        s.add(bytes=len(data))
+    event = soup.title.text.split(" - ")[1].strip()
+    with profiling.stage("extract") as s:
+        players = parse_page(soup)
+        s.add(rows=count_results(players))
+    return event, players
 
-        for rd in new_rds:
-            new_urlparts = urlparts
-            new_urlparts[index:index+len(rd)] = rd
-            url = "/".join(new_urlparts)
-            try:
-                response = insecure_urlopen(url)
-            except urllib.error.URLError:
-                print("Error opening URL %s" % url, file=sys.stderr)
-                return None, None
+def count_results(players):
+    """the number of player-rounds, for profiling"""
+    return sum(len(player.results) for player in players if player is not None)
 
-            data = response.read()
-            data = preprocess_chessresults_html(data)
-            soup = bs4.BeautifulSoup(data, 'html.parser')
-            round_players = parse_4ncl(soup, int(rd[0]))
-            players = merge_players(players, round_players)
-            event = "4NCL Rounds %s-%s" % (rounds[0], rounds[-1])
+def page_event(data):
+    """the event name from the <title> of a chess-results page, or None"""
+    match = TITLE_RE.search(data)
+    if not match:
+        return None
+    title = html.unescape(match.group(1).decode("utf-8", "replace"))
+    parts = title.split(" - ")
+    if len(parts) < 2:
+        return None
+    return parts[1].strip()
 
+def page_heading(data):
+    """the first <h2> of a page, which on chess-results is the event name, or None"""
+    match = HEADING_RE.search(data)
+    if not match:
+        return None
+    return html.unescape(match.group(1).decode("utf-8", "replace")).strip() or None
+
+def results_fragment(data):
+    """The bytes of the defaultDialog div holding the player results, or None.
+    The div is found from its heading and closed by counting nested divs."""
+    for marker in RESULTS_MARKERS:
+        position = data.find(marker)
+        if position != -1:
+            break
+    else:
+        return None
+    dialog = data.rfind(b'class="defaultDialog"', 0, position)
+    start = data.rfind(b"<div", 0, dialog)
+    if dialog == -1 or start == -1:
+        return None
+    depth = 0
+    for tag in DIV_RE.finditer(data, start):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            return data[start:data.find(b">", tag.end()) + 1]
+    return None
+
+
+def parse(source, rounds=None, fed=None, teams=None, fide_list=None):
+    """Return (event, players) for a chess-results URL or saved page, a
+    chess-results Excel export, or 4NCL rounds. fed picks the players from a
+    whole-tournament crosstable, and teams the 4NCL teams (default TEAM_NAME,
+    or "all"). With a fide_cache.FideList, 4NCL opponents get their federation,
+    rating and title from it."""
+    for name, matches, parser in SOURCE_PARSERS:
+        if matches(source):
+            break
+    else:
+        parser = parse_page_source
+    event, players = parser(source, rounds, fed, teams, fide_list)
     if not players:
         raise ValueError("Could not parse any players")
 
     return event, players
 
+def source_parser(name, matches):
+    """Decorator adding a parser of (source, rounds, fed, teams, fide_list) ->
+    (event, players) to SOURCE_PARSERS, for sources where matches(source) is true"""
+    def register(parser):
+        SOURCE_PARSERS.append((name, matches, parser))
+        return parser
+    return register
+
+def read_source(source):
+    """the bytes of a URL or local file"""
+    with profiling.stage("fetch") as s:
+        if source.startswith("http"):
+            data = urlopen(source).read()
+        else:
+            with open(source, "rb") as f:
+                data = f.read()
+        s.add(bytes=len(data))
+    return data
+
+def parse_page_source(source, rounds=None, fed=None, teams=None, fide_list=None):
+    """a single chess-results page or Excel export, from a URL or a saved file"""
+    return parse_chessresults_html(read_source(source), fed)
+
+@source_parser("4ncl", lambda source: "4nclresults.co.uk" in source)
+def parse_4ncl_source(source, rounds=None, fed=None, teams=None, fide_list=None):
+    """the 4NCL rounds given by rounds (see fourncl_round_urls)"""
+    import bs4
+    if rounds is None:
+        raise ValueError("Need to specify round numbers for 4NCL results")
+    matches = {}
+    round_urls = fourncl_round_urls(source, rounds)
+    # pages come back in round order, so each one is parsed while the later ones download
+    pages = fetch_concurrently([round_url for rd, round_url in round_urls], insecure_urlopen)
+    # the time spent waiting for each page counts as fetching it
+    errors = []
+    for (rd, round_url), (data, error) in zip(round_urls, profiling.timed(pages, "fetch")):
+        if error is not None:
+            print("Error opening URL %s: %s" % (round_url, error), file=sys.stderr)
+            errors.append(error)
+            continue
+        with profiling.stage("preprocess"):
+            data = preprocess_chessresults_html(data)
+        with profiling.stage("soup") as s:
+            soup = bs4.BeautifulSoup(data, 'html.parser')
+            s.add(bytes=len(data))
+        with profiling.stage("extract") as s:
+            round_matches = parse_4ncl_matches(soup, rd)
+            s.add(rows=sum(len(players) for players in round_matches.values()))
+        matches.update(round_matches)
+    if len(errors) == len(round_urls):
+        # nothing could be fetched: fail with the real error, not an empty event
+        raise errors[-1]
+    if teams is None:
+        teams = [TEAM_NAME]
+    with profiling.stage("merge") as s:
+        players = fourncl_players(matches, None if "all" in teams else teams)
+        s.add(rows=count_results(players))
+    if fide_list is not None:
+        with profiling.stage("enrich"):
+            enrich_opponents(players, fide_list)
+    return fourncl_event(rounds), players
+
+def fourncl_event(rounds):
+    """the event name for 4NCL rounds like 12 or 72b,82c"""
+    return "4NCL Rounds %s-%s" % (rounds[0], rounds[-1])
+
 
 def output(event, players, url):
+    with profiling.stage("output") as s:
+        text = format_output(event, players, url)
+        print(text)
+        s.add(bytes=len(text), rows=count_results(players))
+
+def format_output(event, players, url):
+    """the ICU-CSV text for an event"""
     output_lines = []
     max_round = max(rd for player in players for rd in player.results)
     min_round = min(rd for player in players for rd in player.results)
@@ -611,21 +1079,78 @@ def output(event, players, url):
                     adjusted_rd, result.score, colour_character(result.colour),
                     opp_name, opp_rating, result.opp_title, result.opp_fed))
         output_lines.append("Total,%3.1f" % player.score)
-    print("\n".join(output_lines))
+    return "\n".join(output_lines)
 
 def preprocess_chessresults_html(html):
-    """Preprocessing needed for broken HTML tags on chess-results site"""
-    html = html.replace(b'<div class="FarbewT"/></div>', b'<div class="FarbewT"></div>')
-    html = html.replace(b'<div class="FarbesT"/></div>', b'<div class="FarbesT"></div>')
-    return html
+    """Preprocessing needed for broken HTML tags on chess-results site.
+    One pass over the page, and no copy at all when nothing needs fixing."""
+    return BROKEN_DIV_RE.sub(rb'<div class="\1"></div>', html)
 
 
 if __name__ == "__main__":
-
-    source = sys.argv[1]
-    rds = None
-    if len(sys.argv) > 2:
-        rds = sys.argv[2]
-    event, players = parse(source, rds)
-    output(event, players, source)
+    parser = argparse.ArgumentParser(description="Parse chess-results.com or 4NCL pages into ICU-CSV format")
+    parser.add_argument("source", nargs="?", help="URL or saved chess-results html file")
+    parser.add_argument("rounds", nargs="?", help="4NCL rounds, like 12 or 72b,82c")
+    parser.add_argument("--fed", help="with a crosstable, only output players from this federation, e.g. IRL")
+    parser.add_argument("--team", action="append", dest="teams",
+        help="4NCL team to output (default %s); repeat for more, or 'all'" % TEAM_NAME)
+    parser.add_argument("--offline", action="store_true", help="only use pages already in the cache")
+    parser.add_argument("--no-cache", action="store_true", help="always download, and do not cache")
+    parser.add_argument("--cache-dir", default=http_cache.DEFAULT_CACHE_DIR)
+    parser.add_argument("--ttl", type=int, help="seconds to use a cached page before revalidating, for every host")
+    parser.add_argument("--record", metavar="DIR", help="also save every page fetched in this archive (see replay.py)")
+    parser.add_argument("--replay", metavar="DIR", help="answer every fetch from this archive, with no network")
+    parser.add_argument("--batch", metavar="MANIFEST", help="process every event listed in MANIFEST (see batch.py)")
+    parser.add_argument("--out-dir", default=".", help="where --batch writes its ICU-CSV files")
+    parser.add_argument("--workers", type=int, help="parser processes for --batch (default one per CPU)")
+    parser.add_argument("--icu-list", metavar="CSV", help="ICU rating list export to look up ICU codes in")
+    parser.add_argument("--fide-list", help="FIDE rating list to take 4NCL opponents' federation, rating and title from")
+    parser.add_argument("--watch", type=int, metavar="SECONDS",
+        help="keep polling the event every SECONDS and report new results (see watch.py)")
+    parser.add_argument("--watch-csv", metavar="FILE", help="with --watch, keep the ICU-CSV in FILE up to date")
+    parser.add_argument("--db", help="also save the event in this SQLite database (see results_db.py)")
+    profiling.add_arguments(parser)
+    parser.add_argument("--names", metavar="INDEX",
+        help="surname/forename index built by name_splits.py (default: split names by common particles)")
+    args = parser.parse_args()
+    if not args.source and not args.batch:
+        parser.error("need a source, or --batch MANIFEST")
+
+    http_cache.configure(cache_dir=args.cache_dir, offline=args.offline, enabled=not args.no_cache,
+        host_ttl=None if args.ttl is None else {}, default_ttl=args.ttl or 0,
+        record=args.record, replay=args.replay)
+    name_splits.configure(args.names)
+    if args.batch:
+        import batch
+        results = batch.run(args.batch, args.out_dir, args.workers, icu_list=args.icu_list, names=args.names,
+                            fide_list=args.fide_list)
+        sys.exit(0 if all(result["ok"] for result in results) else 1)
+    profiling.start_from_arguments(args)
+    fide_list = None
+    if args.fide_list:
+        import fide_cache
+        fide_list = fide_cache.load(args.fide_list)
+    icu_index = None
+    if args.icu_list:
+        import icu_codes
+        icu_index = icu_codes.load(args.icu_list)
+    db = None
+    if args.db:
+        import results_db
+        db = results_db.ResultsDb(args.db)
+    if args.watch:
+        import watch
+        watch.Watcher(args.source, args.rounds, args.fed, args.teams, fide_list=fide_list, icu_index=icu_index,
+                      db=db).run(args.watch, args.watch_csv)
+    else:
+        event, players = parse(args.source, args.rounds, args.fed, args.teams, fide_list)
+        if icu_index is not None:
+            with profiling.stage("icu_codes"):
+                icu_codes.assign_codes(players, icu_index)
+        if db is not None:
+            db.add_event(event, players, args.source)
+        output(event, players, args.source)
+    if db is not None:
+        db.close()
+    profiling.finish_from_arguments(args)
 
@@ -0,0 +1,186 @@
+import json
+import sys
+import threading
+import time
+
+
+"""Per-stage timing for parsechessresults.py and parse_fide.py
+
+Code marks its stages with
+
+    with profiling.stage("soup") as s:
+        soup = bs4.BeautifulSoup(data, "html.parser")
+        s.add(bytes=len(data))
+
+and for each stage name we total the calls, wall time, bytes and rows it
+reports, and (with memory=True) the peak memory Python allocated while it ran,
+measured with tracemalloc. Stages may nest; a stage's time includes its inner
+stages. A single stage can also be run under cProfile and the stats dumped.
+
+When profiling is off, stage() returns one shared object whose methods do
+nothing, so a marked stage costs a function call and a with block. Stages are
+only recorded from the main thread.
+
+Stage names used: fetch, preprocess, soup, xlsx, extract, commas, merge, enrich,
+icu_codes and output in parsechessresults.py, and cache, aggregate and output
+in parse_fide.py."""
+
+enabled = False
+memory = False
+stages = {}
+_stack = []
+_profile_stage = None
+_profiler = None
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.rows = 0
+        self.peak = 0
+
+    def as_dict(self):
+        return {"name": self.name, "calls": self.calls, "seconds": self.seconds, "bytes": self.bytes,
+                "rows": self.rows, "peak_bytes": self.peak if memory else None}
+
+
+class _Stage:
+    def __init__(self, name):
+        self.stats = stages.get(name)
+        if self.stats is None:
+            self.stats = stages[name] = StageStats(name)
+        self.peak = 0
+
+    def add(self, bytes=0, rows=0):
+        self.stats.bytes += bytes
+        self.stats.rows += rows
+
+    def __enter__(self):
+        if memory:
+            import tracemalloc
+            if _stack:
+                # the peak so far belongs to the enclosing stage
+                _stack[-1].peak = max(_stack[-1].peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        _stack.append(self)
+        if self.stats.name == _profile_stage:
+            _profiler.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.seconds += time.perf_counter() - self.start
+        if self.stats.name == _profile_stage:
+            _profiler.disable()
+        self.stats.calls += 1
+        _stack.pop()
+        if memory:
+            import tracemalloc
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            self.stats.peak = max(self.stats.peak, self.peak)
+            if _stack:
+                _stack[-1].peak = max(_stack[-1].peak, self.peak)
+        return False
+
+
+class _NoStage:
+    def add(self, bytes=0, rows=0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name):
+    # other threads (fetching pages, say) would interleave with the stage stack
+    if not enabled or threading.current_thread() is not threading.main_thread():
+        return _NO_STAGE
+    return _Stage(name)
+
+def timed(iterable, name):
+    """iterable, with the wait for each item counted as a call of stage name"""
+    if not enabled:
+        return iterable
+    return _timed(iterable, name)
+
+def _timed(iterable, name):
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def start(with_memory=False, profile_stage=None):
+    """Turn profiling on and forget earlier stages. With profile_stage,
+    that stage runs under cProfile; see dump_profile."""
+    global enabled, memory, stages, _profile_stage, _profiler
+    # cProfile and tracemalloc are only loaded when asked for, to keep start-up quick
+    import cProfile
+    import tracemalloc
+    enabled = True
+    memory = with_memory
+    stages = {}
+    _stack.clear()
+    _profile_stage = profile_stage
+    _profiler = cProfile.Profile() if profile_stage else None
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def stop():
+    global enabled
+    enabled = False
+    import tracemalloc
+    if memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def dump_profile(path):
+    """write the cProfile stats of the profiled stage, for pstats or snakeviz"""
+    _profiler.dump_stats(path)
+
+def results():
+    return [stats.as_dict() for stats in stages.values()]
+
+def print_summary(file=sys.stderr):
+    print("%-12s %6s %10s %12s %9s %10s" % ("stage", "calls", "seconds", "bytes", "rows", "peak"), file=file)
+    for stats in stages.values():
+        print("%-12s %6d %10.4f %12d %9d %10s" % (stats.name, stats.calls, stats.seconds, stats.bytes, stats.rows,
+              "%.1fMB" % (stats.peak / 1e6) if memory else "-"), file=file)
+
+def write_json(path):
+    with open(path, "w") as f:
+        json.dump({"stages": results()}, f, indent=1)
+
+def add_arguments(parser):
+    """the --profile options, shared by the command line scripts"""
+    parser.add_argument("--profile", action="store_true", help="time each stage and print a summary on stderr")
+    parser.add_argument("--profile-json", metavar="FILE", help="time each stage and write the results as JSON")
+    parser.add_argument("--profile-memory", action="store_true", help="with --profile, also trace peak memory")
+    parser.add_argument("--cprofile", nargs=2, metavar=("STAGE", "FILE"),
+        help="run one stage under cProfile and dump its stats to FILE")
+
+def start_from_arguments(args):
+    if args.profile or args.profile_json or args.cprofile:
+        start(args.profile_memory, args.cprofile[0] if args.cprofile else None)
+
+def finish_from_arguments(args):
+    if not enabled:
+        return
+    stop()
+    if args.profile:
+        print_summary()
+    if args.profile_json:
+        write_json(args.profile_json)
+    if args.cprofile:
+        dump_profile(args.cprofile[1])
@@ -0,0 +1,151 @@
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import sys
+import threading
+import urllib.parse
+
+import atomic_file
+
+
+"""Record the pages parse() fetches, and play them back without the network
+
+An archive is a directory with two files per URL, named by a hash of the URL
+without its scheme: the body exactly as it was fetched, and a small JSON file
+with the URL. Recording and replaying are settings of http_cache:
+
+    python parsechessresults.py URL --record archive/      # fetch as usual, and keep every response
+    python parsechessresults.py URL --replay archive/      # answer every fetch from the archive
+
+With --replay nothing goes to the network or the HTTP cache, and settings reach
+--batch workers, so whole batches and benchmarks run at full speed on the same
+bytes each time. A URL missing from the archive fails like an unreachable page.
+
+The archive can also be served over HTTP, for load tests or for tools other
+than these scripts:
+
+    python replay.py archive/ serve --port 8080
+    python replay.py archive/ list
+
+The stand-in server answers for any host: it is an HTTP proxy for http:// URLs
+(http_proxy=http://127.0.0.1:8080), and a plain server where the Host header
+names the original site. Responses carry an ETag, so conditional requests
+(as in watch mode) get a 304."""
+
+CONTENT_TYPES = [
+    ("excel=", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+]
+
+
+def url_key(url):
+    """the same key for http:// and https:// versions of a URL"""
+    parts = urllib.parse.urlsplit(url)
+    unschemed = urllib.parse.urlunsplit(("", parts.netloc.lower(), parts.path or "/", parts.query, ""))
+    return hashlib.sha256(unschemed.encode("utf-8")).hexdigest()
+
+def content_type(url):
+    for marker, mime_type in CONTENT_TYPES:
+        if marker in url:
+            return mime_type
+    return "text/html; charset=utf-8"
+
+
+class Archive:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def paths(self, url):
+        key = url_key(url)
+        return os.path.join(self.directory, key + ".body"), os.path.join(self.directory, key + ".json")
+
+    def save(self, url, body):
+        os.makedirs(self.directory, exist_ok=True)
+        body_path, meta_path = self.paths(url)
+        for path, data, mode in ((body_path, body, "wb"), (meta_path, json.dumps({"url": url}), "w")):
+            # fetching threads may record the same URL at once
+            with atomic_file.writing(path, mode) as f:
+                f.write(data)
+
+    def body(self, url):
+        """the recorded body of url, or None"""
+        body_path, _ = self.paths(url)
+        try:
+            with open(body_path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def urls(self):
+        if not os.path.isdir(self.directory):
+            return []
+        urls = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".json"):
+                with open(os.path.join(self.directory, name)) as f:
+                    urls.append(json.load(f)["url"])
+        return sorted(urls)
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    archive = None
+
+    def do_GET(self):
+        if self.path.startswith(("http://", "https://")):
+            url = self.path
+        else:
+            url = "http://%s%s" % (self.headers.get("Host", ""), self.path)
+        body = self.archive.body(url)
+        if body is None:
+            self.send_error(404, "not in the archive")
+            return
+        etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type(url))
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_server(directory, port=0, host="127.0.0.1"):
+    handler = type("Handler", (StandInHandler,), {"archive": Archive(directory)})
+    return http.server.ThreadingHTTPServer((host, port), handler)
+
+def start_server(directory, port=0, host="127.0.0.1"):
+    """Serve an archive on a background thread. Returns the server; its
+    server_port is the port, and shutdown() stops it."""
+    server = make_server(directory, port, host)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve or list an archive recorded with --record")
+    parser.add_argument("archive")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="answer HTTP requests from the archive")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument("--host", default="127.0.0.1")
+    commands.add_parser("list", help="the URLs in the archive")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for url in Archive(args.archive).urls():
+            print(url)
+    else:
+        server = make_server(args.archive, args.port, args.host)
+        print("serving %s on http://%s:%d" % (args.archive, args.host, server.server_port), file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,202 @@
+import argparse
+import sqlite3
+import time
+
+import parsechessresults
+from parsechessresults import Colour, Player, PlayerResult
+
+
+"""SQLite store of parsed events, so a player's games can be looked up across
+events and an event's ICU-CSV written again without fetching anything
+
+Three tables: events (one per source URL or file), players (one per player per
+event) and results (one per player per round). Re-adding an event inserts the
+rounds that are new, updates the rounds that were corrected since, updates the
+players' ICU codes and scores, and deletes the rounds and players the new parse
+no longer has, e.g. a withdrawn player or a round that was wrongly entered.
+
+Usage:
+    python parsechessresults.py URL --db results.db          # parse and save
+    python results_db.py results.db events
+    python results_db.py results.db games "Quinn,Mark" [--event "4NCL%"]
+    python results_db.py results.db games --icu-code 1350
+    python results_db.py results.db export URL > event.csv"""
+
+SCHEMA = """
+create table if not exists events (
+    id integer primary key,
+    source text not null unique,
+    name text,
+    added real
+);
+create table if not exists players (
+    id integer primary key,
+    event_id integer not null references events(id),
+    name text not null,
+    icu_code text,
+    score real,
+    unique (event_id, name)
+);
+create table if not exists results (
+    player_id integer not null references players(id),
+    round integer not null,
+    score text,
+    colour integer,
+    opp_name text,
+    opp_rating integer,
+    opp_title text,
+    opp_fed text,
+    primary key (player_id, round)
+);
+create index if not exists players_name on players(name);
+create index if not exists players_icu_code on players(icu_code);
+create index if not exists results_round on results(round);
+create index if not exists results_opp_name on results(opp_name);
+"""
+
+GAMES_QUERY = """
+select events.name, events.source, players.name, players.icu_code, results.round, results.score,
+       results.colour, results.opp_name, results.opp_rating, results.opp_title, results.opp_fed
+from results
+join players on players.id = results.player_id
+join events on events.id = players.event_id
+"""
+
+# a round already stored is only rewritten, and counted, when something in it changed
+RESULT_UPSERT = """
+insert into results values (?, ?, ?, ?, ?, ?, ?, ?)
+on conflict(player_id, round) do update set
+    score = excluded.score, colour = excluded.colour, opp_name = excluded.opp_name,
+    opp_rating = excluded.opp_rating, opp_title = excluded.opp_title, opp_fed = excluded.opp_fed
+where (results.score, results.colour, results.opp_name, results.opp_rating, results.opp_title, results.opp_fed)
+    is not (excluded.score, excluded.colour, excluded.opp_name, excluded.opp_rating, excluded.opp_title,
+            excluded.opp_fed)
+"""
+
+
+def colour_value(colour):
+    """the colour column for a Colour, or NULL for a bye or an unknown colour"""
+    return None if colour is None else colour.value
+
+def colour_from_value(value):
+    return None if value is None else Colour(value)
+
+
+class ResultsDb:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def add_event(self, event, players, source):
+        """Save an event's players and results in one transaction, replacing what
+        was stored for it. Returns the number of results that were new, different
+        from those stored, or deleted."""
+        with self.connection:
+            cursor = self.connection.cursor()
+            cursor.execute("insert into events (source, name, added) values (?, ?, ?) "
+                           "on conflict(source) do update set name = excluded.name", (source, event, time.time()))
+            (event_id,) = cursor.execute("select id from events where source = ?", (source,)).fetchone()
+            cursor.executemany("insert into players (event_id, name, icu_code, score) values (?, ?, ?, ?) "
+                               "on conflict(event_id, name) do update set icu_code = excluded.icu_code, "
+                               "score = excluded.score",
+                               [(event_id, player.name, player.icu_code, player.score) for player in players])
+            player_ids = dict(cursor.execute("select name, id from players where event_id = ?", (event_id,)))
+            before = self.connection.total_changes
+            cursor.executemany(RESULT_UPSERT,
+                               [(player_ids[player.name], rd, result.score, colour_value(result.colour),
+                                 result.opp_name, result.opp_rating, result.opp_title, result.opp_fed)
+                                for player in players for rd, result in player.results.items()])
+            parsed = {(player_ids[player.name], rd) for player in players for rd in player.results}
+            stored = cursor.execute("select results.player_id, results.round from results "
+                                    "join players on players.id = results.player_id where players.event_id = ?",
+                                    (event_id,)).fetchall()
+            cursor.executemany("delete from results where player_id = ? and round = ?",
+                               [key for key in stored if key not in parsed])
+            changes = self.connection.total_changes - before
+            names = {player.name for player in players}
+            cursor.executemany("delete from players where id = ?",
+                               [(player_id,) for name, player_id in player_ids.items() if name not in names])
+            return changes
+
+    def events(self):
+        """[(source, name, number of players)] in the order they were first added"""
+        return self.connection.execute(
+            "select events.source, events.name, count(players.id) from events "
+            "left join players on players.event_id = events.id group by events.id order by events.id").fetchall()
+
+    def load_event(self, source):
+        """(event, [Player]) as they were saved, or (None, []) if source was never added"""
+        row = self.connection.execute("select id, name from events where source = ?", (source,)).fetchone()
+        if row is None:
+            return None, []
+        event_id, event = row
+        players = {}
+        for player_id, name, icu_code, score in self.connection.execute(
+                "select id, name, icu_code, score from players where event_id = ? order by id", (event_id,)):
+            player = Player(name, icu_code)
+            player.score = score
+            players[player_id] = player
+        for player_id, rd, score, colour, opp_name, opp_rating, opp_title, opp_fed in self.connection.execute(
+                "select results.* from results join players on players.id = results.player_id "
+                "where players.event_id = ? order by results.player_id, results.round", (event_id,)):
+            player = players[player_id]
+            player.results[rd] = PlayerResult(player, rd, score, colour_from_value(colour), opp_name, opp_rating,
+                                              opp_title, opp_fed)
+        return event, list(players.values())
+
+    def games(self, name=None, icu_code=None, event=None):
+        """Every stored result of a player, found by name ("Surname,Forename") or ICU
+        code, optionally only in events whose name is like the SQL pattern event"""
+        conditions, parameters = [], []
+        if name is not None:
+            conditions.append("players.name = ?")
+            parameters.append(name)
+        if icu_code is not None:
+            conditions.append("players.icu_code = ?")
+            parameters.append(icu_code)
+        if event is not None:
+            conditions.append("events.name like ?")
+            parameters.append(event)
+        query = GAMES_QUERY
+        if conditions:
+            query += "where " + " and ".join(conditions)
+        return self.connection.execute(query + " order by events.id, results.round", parameters).fetchall()
+
+    def export(self, source):
+        """the ICU-CSV for a stored event"""
+        event, players = self.load_event(source)
+        if event is None:
+            raise KeyError("%s is not in the database" % source)
+        return parsechessresults.format_output(event, players, source)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the results saved by parsechessresults.py --db")
+    parser.add_argument("db")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("events", help="list the saved events")
+    games = commands.add_parser("games", help="a player's games across events")
+    games.add_argument("name", nargs="?", help='"Surname,Forename"')
+    games.add_argument("--icu-code")
+    games.add_argument("--event", help="only events with a name like this, e.g. '4NCL%%'")
+    export = commands.add_parser("export", help="write an event's ICU-CSV again")
+    export.add_argument("source", help="the URL or file the event was parsed from")
+    args = parser.parse_args()
+
+    db = ResultsDb(args.db)
+    if args.command == "events":
+        for source, name, players in db.events():
+            print("%s\t%d players\t%s" % (name, players, source))
+    elif args.command == "games":
+        if args.name is None and args.icu_code is None:
+            parser.error("need a name or --icu-code")
+        for event, source, name, icu_code, rd, score, colour, opp_name, opp_rating, opp_title, opp_fed in db.games(
+                args.name, args.icu_code, args.event):
+            print("%s\t%d\t%s\t%s\t%s\t%s\t%s\t%s" % (event, rd, score,
+                  parsechessresults.colour_character(colour_from_value(colour)), opp_name, opp_rating or "", opp_title, opp_fed))
+    else:
+        print(db.export(args.source))
+    db.close()
@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+import atomic_file
+
+
+def test_writing_replaces_the_file(tmp_path):
+    path = str(tmp_path / "list.fidecache")
+    with open(path, "wb") as f:
+        f.write(b"old")
+    with atomic_file.writing(path) as f:
+        f.write(b"new")
+    assert open(path, "rb").read() == b"new"
+    assert os.listdir(str(tmp_path)) == ["list.fidecache"]
+
+def test_failed_write_leaves_the_old_file(tmp_path):
+    path = str(tmp_path / "index.pickle")
+    with open(path, "w") as f:
+        f.write("old")
+    with pytest.raises(ValueError):
+        with atomic_file.writing(path, "w") as f:
+            f.write("half")
+            raise ValueError("interrupted")
+    assert open(path).read() == "old"
+    assert os.listdir(str(tmp_path)) == ["index.pickle"]
@@ -0,0 +1,82 @@
+import shutil
+import time
+import urllib.error
+
+import batch
+import fide_cache
+import http_cache
+
+FOURNCL = "http://www.4nclresults.co.uk/2018-19/4ncl/1/2b/export/"
+
+
+def test_read_manifest(tmp_path):
+    manifest = tmp_path / "season.txt"
+    manifest.write_text("# season end\n\ndata/belyaladya1.html\n%s 12 gonzaga.csv\n%s 72b,82c\n" % (FOURNCL, FOURNCL))
+    jobs = batch.read_manifest(str(manifest))
+    assert [(job.line_no, job.rounds, job.output) for job in jobs] == [
+        (3, None, None), (4, "12", "gonzaga.csv"), (5, "72b,82c", None)]
+    assert batch.job_urls(jobs[0]) == []
+    assert [insecure for url, insecure in batch.job_urls(jobs[2])] == [True, True]
+
+def test_manifest_teams(tmp_path, monkeypatch):
+    cache = http_cache.HttpCache(str(tmp_path / "cache"), offline=True)
+    cache.store(FOURNCL, open("data/4ncl_round.html", "rb").read(), {"url": FOURNCL, "checked": time.time()})
+    monkeypatch.setattr(http_cache, "default_cache", cache)
+    manifest = tmp_path / "season.txt"
+    manifest.write_text('%s 1 team=Gonzaga team="Celtic Tigers" both.csv\n%s 1 team=all\n' % (FOURNCL, FOURNCL))
+    jobs = batch.read_manifest(str(manifest))
+    assert jobs[0].teams == ["Gonzaga", "Celtic Tigers"]
+    assert (jobs[0].rounds, jobs[0].output) == ("1", "both.csv")
+    assert jobs[1].teams == ["all"]
+
+    both = batch.run_job(jobs[0], str(tmp_path), dict(cache.settings))
+    everyone = batch.run_job(jobs[1], str(tmp_path), dict(cache.settings))
+    gonzaga = batch.run_job(batch.Job(3, FOURNCL, "1"), str(tmp_path), dict(cache.settings))
+    assert gonzaga["players"] < both["players"] < everyone["players"]
+
+def test_run(tmp_path, monkeypatch):
+    cache = http_cache.HttpCache(str(tmp_path / "cache"), offline=True)
+    page = open("data/4ncl_round.html", "rb").read()
+    for url in (FOURNCL, FOURNCL.replace("/1/", "/2/")):
+        cache.store(url, page, {"url": url, "checked": time.time()})
+    monkeypatch.setattr(http_cache, "default_cache", cache)
+    manifest = tmp_path / "season.txt"
+    manifest.write_text("data/belyaladya1.html\n%s 12 gonzaga.csv\ndata/missing.html\n"
+                        "data/crosstable_sample.html fed=IRL\n" % FOURNCL)
+
+    results = batch.run(str(manifest), str(tmp_path / "csv"), workers=2)
+
+    assert [result["ok"] for result in results] == [True, True, False, True]
+    assert results[3]["players"] == 3
+    assert "FileNotFoundError" in results[2]["error"]
+    assert results[1]["output"].endswith("gonzaga.csv")
+    csv = open(results[1]["output"]).read()
+    assert csv.startswith("Event,4NCL Rounds 1-2\n")
+    assert "Player,????,Jessel,Stephen" in csv
+    assert results[0]["output"].endswith(".csv") and "001_" in results[0]["output"]
+
+def test_prefetch_errors_are_reported(tmp_path, monkeypatch):
+    cache = http_cache.HttpCache(str(tmp_path / "cache"))
+    def refuse(url, headers, insecure=False):
+        raise urllib.error.URLError("connection refused")
+    cache.request = refuse
+    monkeypatch.setattr(http_cache, "default_cache", cache)
+    manifest = tmp_path / "season.txt"
+    manifest.write_text("http://chess-results.com/tnr1.aspx?art=9\n")
+
+    results = batch.run(str(manifest), str(tmp_path / "csv"), workers=1)
+
+    assert not results[0]["ok"]
+    assert "connection refused" in results[0]["error"]
+    assert "OfflineError" not in results[0]["error"]
+
+def test_run_job_closes_the_fide_list(tmp_path, monkeypatch):
+    fide_list = str(tmp_path / "fide.xml")
+    shutil.copy("data/fide_sample.xml", fide_list)
+    opened = []
+    load = fide_cache.load
+    monkeypatch.setattr(fide_cache, "load", lambda *args: opened.append(load(*args)) or opened[-1])
+    job = batch.Job(1, "data/belyaladya1.html")
+    result = batch.run_job(job, str(tmp_path), dict(http_cache.default_cache.settings), fide_list=fide_list)
+    assert result["ok"]
+    assert opened and opened[0]._mm.closed
@@ -0,0 +1,45 @@
+import io
+import random
+
+import bs4
+from openpyxl import load_workbook
+
+import benchmark
+import parse_fide
+import parsechessresults
+
+
+def test_synthetic_inputs_parse():
+    rng = random.Random(1)
+    event, players = parsechessresults.parse_chessresults_html(benchmark.team_page(20, rng))
+    assert (event, len(players), len(players[0].results)) == ("Synthetic Team Event", 20, benchmark.ROUNDS)
+    event, players = parsechessresults.parse_chessresults_html(benchmark.crosstable_page(20, rng))
+    assert len(players) == 20
+    soup = bs4.BeautifulSoup(benchmark.fourncl_page(32, rng), "html.parser")
+    assert sum(len(players) for players in parsechessresults.parse_4ncl_matches(soup, 1).values()) == 32
+    wb = load_workbook(io.BytesIO(benchmark.team_workbook(5, rng)), read_only=True)
+    assert len(parsechessresults.parse_team_from_xlsx(wb)) == 5
+
+def test_fide_txt_matches_xml(tmp_path):
+    benchmark.write_fide_xml(str(tmp_path / "list.xml"), 200, random.Random(2))
+    benchmark.write_fide_txt(str(tmp_path / "list.txt"), 200, random.Random(2))
+    fields = parse_fide.FidePlayer.__slots__
+    xml = [[getattr(p, field) for field in fields] for p in parse_fide.iter_players(str(tmp_path / "list.xml"))]
+    txt = [[getattr(p, field) for field in fields] for p in parse_fide.iter_players(str(tmp_path / "list.txt"))]
+    assert xml == txt and len(xml) == 200
+
+def test_compare_flags_regressions(capsys):
+    previous = {"results": [{"name": "parse_team", "size": 10, "seconds": 1.0, "peak_bytes": 1000}]}
+    assert benchmark.compare([{"name": "parse_team", "size": 10, "seconds": 1.1, "peak_bytes": 1000}], previous, 0.2) == 0
+    assert benchmark.compare([{"name": "parse_team", "size": 10, "seconds": 1.0, "peak_bytes": 2000}], previous, 0.2) == 1
+    assert "BIGGER" in capsys.readouterr().out
+
+def test_startup_benchmarks():
+    results, within_budget = benchmark.startup_benchmarks()
+    assert [result["name"] for result in results] == ["import_parsechessresults", "cli_saved_page"]
+    assert all(result["seconds"] > 0 for result in results)
+    seconds = results[0]["seconds"]
+    assert within_budget == (seconds <= benchmark.STARTUP_BUDGET)
+    # STARTUP_BUDGET itself is for benchmark.py on a quiet machine; a shared test
+    # runner only gets a generous bound, which still catches a heavy module imported eagerly
+    assert seconds < 8 * benchmark.STARTUP_BUDGET
@@ -0,0 +1,77 @@
+import json
+import os
+import struct
+
+import fide_cache
+import parse_fide
+
+SAMPLE = "data/fide_sample.xml"
+
+
+def test_round_trip(tmp_path):
+    cache_path = str(tmp_path / "sample.fidecache")
+    fide_list = fide_cache.load(SAMPLE, cache_path)
+    assert len(fide_list) == 8
+    assert list(fide_list.fideid) == sorted(fide_list.fideid)
+    originals = {p.fideid: p for p in parse_fide.iter_players(SAMPLE)}
+    for player in fide_list:
+        original = originals[player.fideid]
+        for field in ("name", "country", "title", "rating", "rapid_rating", "blitz_rating", "birthday", "flag"):
+            assert getattr(player, field) == getattr(original, field)
+    fide_list.close()
+
+def test_lookups(tmp_path):
+    fide_list = fide_cache.load(SAMPLE, str(tmp_path / "sample.fidecache"))
+    assert fide_list.name(fide_list.find(2502240)) == "O'Connor, Aoife"
+    assert fide_list.find(1) is None
+    assert [fide_list.name(row) for row in fide_list.rows_for_country("GER")] == ["Müller, Reinhold", "Heitz, Timo"]
+    assert [fide_list.fideid[row] for row in fide_list.rows_for_name("Jessel, Stephen")] == [400041]
+    fide_list.close()
+
+def test_rows_for_names(tmp_path):
+    fide_list = fide_cache.load(SAMPLE, str(tmp_path / "sample.fidecache"))
+    found = fide_list.rows_for_names(["HEITZ,Timo", "Quinn,  Mark", "Nobody, Here", "müller, reinhold"])
+    assert {name: [fide_list.fideid[row] for row in rows] for name, rows in found.items()} == {
+        "HEITZ,Timo": [fide_list.fideid[fide_list.rows_for_name("Heitz, Timo")[0]]],
+        "Quinn,  Mark": [fide_list.fideid[fide_list.rows_for_name("Quinn, Mark")[0]]],
+        "Nobody, Here": [],
+        "müller, reinhold": [fide_list.fideid[fide_list.rows_for_name("Müller, Reinhold")[0]]],
+    }
+    fide_list.close()
+
+def write_v1_file(cache_path):
+    """rewrite a cache file as the FIDECOL1 format had it, without name_order"""
+    with open(cache_path, "rb") as f:
+        data = bytearray(f.read())
+    (header_len,) = struct.unpack_from("<I", data, len(fide_cache.MAGIC))
+    start = len(fide_cache.MAGIC) + 4
+    header = json.loads(data[start:start + header_len])
+    del header["columns"]["name_order"]
+    # the same length, so the columns stay where they are
+    data[start:start + header_len] = json.dumps(header).encode().ljust(header_len)
+    data[:len(fide_cache.MAGIC)] = b"FIDECOL1"
+    with open(cache_path, "wb") as f:
+        f.write(data)
+
+def test_reads_version_1_files(tmp_path):
+    cache_path = str(tmp_path / "2019-01.fidecache")
+    fide_cache.build(SAMPLE, cache_path)
+    write_v1_file(cache_path)
+    fide_list = fide_cache.FideList(cache_path)
+    assert fide_list.name_order is None
+    assert fide_list.name(fide_list.find(2502240)) == "O'Connor, Aoife"
+    found = fide_list.rows_for_names(["heitz, timo", "Nobody, Here"])
+    assert [fide_list.name(row) for row in found["heitz, timo"]] == ["Heitz, Timo"]
+    assert found["Nobody, Here"] == []
+    fide_list.close()
+    # load() rebuilds an old file while the source is there
+    assert not fide_cache.is_fresh(SAMPLE, cache_path)
+
+def test_cache_is_reused_until_source_changes(tmp_path):
+    source = tmp_path / "list.xml"
+    source.write_bytes(open(SAMPLE, "rb").read())
+    cache_path = fide_cache.cache_path_for(str(source))
+    fide_cache.load(str(source)).close()
+    assert fide_cache.is_fresh(str(source), cache_path)
+    os.utime(source, ns=(0, 0))
+    assert not fide_cache.is_fresh(str(source), cache_path)
@@ -0,0 +1,42 @@
+import fide_cache
+import fide_diff
+
+SAMPLE = "data/fide_sample.xml"
+
+NEW_PLAYER = ("<player><fideid>2509999</fideid><name>Walsh, Ciara</name><country>IRL</country><sex>F</sex>"
+              "<title></title><rating></rating><rapid_rating>1400</rapid_rating><blitz_rating></blitz_rating>"
+              "<birthday>2012</birthday><flag>w</flag></player>\n</playerslist>")
+
+
+def next_month(tmp_path):
+    xml = open(SAMPLE).read()
+    start = xml.index("<player><fideid>2506564")
+    xml = xml[:start] + xml[xml.index("\n", start) + 1:]  # Murphy drops off the list
+    xml = xml.replace("<rating>2351</rating>", "<rating>2360</rating>")
+    xml = xml.replace("<country>GER</country><sex>M</sex><title></title><w_title></w_title><o_title></o_title>"
+                      "<foa_title></foa_title><rating>1842",
+                      "<country>IRL</country><sex>M</sex><title></title><w_title></w_title><o_title></o_title>"
+                      "<foa_title></foa_title><rating>1842")
+    xml = xml.replace("<birthday>2001</birthday><flag></flag>", "<birthday>2001</birthday><flag>i</flag>")
+    xml = xml.replace("</playerslist>", NEW_PLAYER)
+    path = tmp_path / "next.xml"
+    path.write_text(xml)
+    return fide_cache.load(str(path))
+
+def test_diff(tmp_path):
+    old = fide_cache.load(SAMPLE, str(tmp_path / "old.fidecache"))
+    changes = list(fide_diff.diff(old, next_month(tmp_path)))
+    by_kind = {}
+    for change in changes:
+        by_kind.setdefault(change["change"], []).append(change)
+    assert [c["fideid"] for c in by_kind["new"]] == [2509999]
+    assert [c["fideid"] for c in by_kind["removed"]] == [2506564]
+    assert by_kind["transfer"] == [{"fideid": 4100026, "name": "Heitz, Timo", "country": "IRL",
+                                    "change": "transfer", "from": "GER", "to": "IRL"}]
+    assert [(c["fideid"], c["active"]) for c in by_kind["activity"]] == [(2501171, False)]
+    assert [(c["fideid"], c["kind"], c["delta"]) for c in by_kind["rating"]] == [(2500035, "standard", 9)]
+
+def test_diff_filtered_by_federation(tmp_path):
+    old = fide_cache.load(SAMPLE, str(tmp_path / "old.fidecache"))
+    changes = list(fide_diff.diff(old, next_month(tmp_path), feds=["GER"]))
+    assert [c["change"] for c in changes] == ["transfer"]
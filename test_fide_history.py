@@ -0,0 +1,51 @@
+import pytest
+
+import fide_history
+import test_fide_cache
+
+SAMPLE = "data/fide_sample.xml"
+
+
+def make_store(tmp_path):
+    store = fide_history.HistoryStore(str(tmp_path / "history"))
+    store.add("2024-01", SAMPLE)
+    later = tmp_path / "later.xml"
+    later.write_text(open(SAMPLE).read().replace("<rating>2351</rating>", "<rating>2340</rating>")
+                     .replace("<birthday>2001</birthday><flag></flag>", "<birthday>2001</birthday><flag>i</flag>"))
+    store.add("2024-02", str(later))
+    return store
+
+def test_months_are_append_only(tmp_path):
+    store = make_store(tmp_path)
+    assert store.months() == ["2024-01", "2024-02"]
+    assert store.months(since="2024-02") == ["2024-02"]
+    with pytest.raises(ValueError):
+        store.add("2024-01", SAMPLE)
+    with pytest.raises(ValueError):
+        store.add("January", SAMPLE)
+
+def test_count_per_month(tmp_path):
+    store = make_store(tmp_path)
+    assert store.count_per_month(fed="IRL", active=True) == [("2024-01", 2), ("2024-02", 1)]
+    assert store.count_per_month("rapid", since="2024-02", fed="IRL") == [("2024-02", 2)]
+
+def test_trajectories(tmp_path):
+    store = make_store(tmp_path)
+    series = store.trajectories([2500035, 2504367, 123])
+    assert series[2500035] == [("2024-01", 2351), ("2024-02", 2340)]
+    assert series[2504367] == [("2024-01", None), ("2024-02", None)]
+    assert series[123] == [("2024-01", None), ("2024-02", None)]
+
+def test_months_stored_before_name_order(tmp_path):
+    store = make_store(tmp_path)
+    test_fide_cache.write_v1_file(store.path("2024-01"))
+    assert store.trajectories([2500035])[2500035] == [("2024-01", 2351), ("2024-02", 2340)]
+
+def test_one_point_per_month_for_duplicate_fideids(tmp_path):
+    store = fide_history.HistoryStore(str(tmp_path / "history"))
+    quinn = [line for line in open(SAMPLE) if "<fideid>2500035<" in line][0]
+    doubled = tmp_path / "doubled.xml"
+    doubled.write_text(open(SAMPLE).read().replace(quinn, quinn + quinn.replace("2351", "2100")))
+    store.add("2024-01", str(doubled))
+    series = store.trajectories([2500035, 2500035])
+    assert series == {2500035: [("2024-01", 2351)]}
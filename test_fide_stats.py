@@ -0,0 +1,34 @@
+import fide_cache
+import fide_stats
+
+SAMPLE = "data/fide_sample.xml"
+
+
+def sample_columns(tmp_path):
+    return fide_stats.RatingColumns(fide_cache.load(SAMPLE, str(tmp_path / "sample.fidecache")))
+
+def test_masks(tmp_path):
+    columns = sample_columns(tmp_path)
+    assert columns.mask(fed="IRL").sum() == 5
+    assert columns.mask(active=True, fed="IRL").sum() == 3
+    assert columns.mask(active=False).sum() == 3
+    assert columns.mask(sex="F").sum() == 1
+    assert columns.mask(fed=["ENG", "GER"], born_from=1960, born_to=1999).sum() == 2
+    active_irl = columns.mask(active=True, fed="IRL")
+    assert sorted(columns.rated("standard", active_irl)) == [1864, 2351]
+    assert len(columns.rated("rapid", active_irl)) == 2
+
+def test_histogram_bins():
+    starts, counts = fide_stats.histogram([1864, 2351, 1988, 1850], width=100)
+    assert list(starts) == list(range(1800, 2400, 100))
+    assert list(counts) == [2, 1, 0, 0, 0, 1]
+    starts, counts = fide_stats.histogram([1864, 2351], width=50, start=1800, stop=1900)
+    assert list(starts) == [1800, 1850]
+    assert list(counts) == [0, 1]
+
+def test_summary_and_percentiles(tmp_path):
+    table = fide_stats.percentile_table(sample_columns(tmp_path), qs=(50,))
+    assert table["standard"]["count"] == 6
+    assert table["standard"]["median"] == table["standard"]["percentiles"][0]
+    assert table["blitz"]["min"] == 1790
+    assert fide_stats.summary(fide_stats.np.array([]))["mean"] is None
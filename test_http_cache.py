@@ -0,0 +1,79 @@
+import http.server
+import threading
+import urllib.error
+
+import pytest
+
+import http_cache
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    etag = '"v1"'
+    body = b"<html>round 1</html>"
+    requests = []
+
+    def do_GET(self):
+        Handler.requests.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == Handler.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", Handler.etag)
+        self.send_header("Content-Length", str(len(Handler.body)))
+        self.end_headers()
+        self.wfile.write(Handler.body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    Handler.requests = []
+    httpd = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%d/tnr1.aspx" % httpd.server_port
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_revalidates_with_etag(server, tmp_path):
+    cache = http_cache.HttpCache(str(tmp_path), host_ttl={})
+    assert cache.fetch(server) == b"<html>round 1</html>"
+    assert cache.fetch(server) == b"<html>round 1</html>"
+    assert Handler.requests == [None, '"v1"']
+
+def test_fresh_pages_make_no_request(server, tmp_path, capsys):
+    cache = http_cache.HttpCache(str(tmp_path), host_ttl={"127.0.0.1": 60})
+    cache.fetch(server)
+    cache.fetch(server)
+    assert len(Handler.requests) == 1
+    assert "Using cached copy of %s" % server in capsys.readouterr().err
+
+def test_results_sites_revalidate_by_default(tmp_path):
+    cache = http_cache.HttpCache(str(tmp_path))
+    assert cache.ttl("http://chess-results.com/tnr1.aspx") == 0
+    assert cache.ttl("http://www.4nclresults.co.uk/2018-19/4ncl/1/2b/export/") == 0
+
+def test_offline(server, tmp_path):
+    http_cache.HttpCache(str(tmp_path)).fetch(server)
+    offline = http_cache.HttpCache(str(tmp_path), offline=True)
+    assert offline.fetch(server) == b"<html>round 1</html>"
+    assert len(Handler.requests) == 1
+    with pytest.raises(urllib.error.URLError):
+        offline.fetch(server + "?snr=2")
+
+def test_concurrent_stores_of_one_url(tmp_path):
+    cache = http_cache.HttpCache(str(tmp_path))
+    bodies = [bytes([65 + i]) * 200000 for i in range(8)]
+    threads = [threading.Thread(target=cache.store, args=("http://example.com/r1", body, {"etag": body[:1].decode(), "checked": 0}))
+               for body in bodies]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    body, meta = cache.lookup("http://example.com/r1")
+    assert body in bodies
+    assert meta["etag"] == body[:1].decode()
+    assert not [name for name in tmp_path.iterdir() if name.suffix == ".tmp"]
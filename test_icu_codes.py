@@ -0,0 +1,97 @@
+import os
+import random
+import shutil
+import time
+
+import icu_codes
+import parsechessresults
+
+SAMPLE = "data/icu_members.csv"
+
+
+def sample_index(tmp_path):
+    path = str(tmp_path / "members.csv")
+    shutil.copy(SAMPLE, path)
+    return icu_codes.load(path)
+
+def test_exact_and_normalised(tmp_path):
+    index = sample_index(tmp_path)
+    match = index.lookup("Quinn, Mark")
+    assert (match.kind, match.code) == ("exact", "1350")
+    match = index.lookup("OConnor,  aoife")
+    assert (match.kind, match.code) == ("normalised", "4941")
+    assert index.lookup("Ni Bhriain, Sile").code == "5101"
+    assert index.lookup("Vanderberg, Pieter").code == "8120"
+
+def test_fuzzy(tmp_path):
+    index = sample_index(tmp_path)
+    match = index.lookup("Fitzgerald, Eoghan")
+    assert (match.kind, match.code) == ("fuzzy", None)
+    assert [c.icu_id for c in match.candidates] == ["8200"]
+    assert index.lookup("Fitzgerald, Eoghan", rating=1850).code == "8200"
+    assert index.lookup("Fitzgerald, Eoghan", fed="IRL").code is None
+    assert index.lookup("Fitzgerald, Eoghan", fed="ENG", rating=1850).code is None
+    match = index.lookup("Zzyzx, Qwerty")
+    assert (match.kind, match.code, match.ambiguous) == ("none", None, False)
+
+def test_ties(tmp_path):
+    index = sample_index(tmp_path)
+    match = index.lookup("Murphy, John")
+    assert match.ambiguous and match.code is None
+    assert index.lookup("Murphy, John", fed="NIR").code == "6023"
+    assert index.lookup("Kelly, Sean", fed="IRL").ambiguous
+    assert index.lookup("Kelly, Sean", fed="IRL", rating=1590).code == "7311"
+
+def test_index_is_persisted_until_csv_changes(tmp_path):
+    path = str(tmp_path / "members.csv")
+    shutil.copy(SAMPLE, path)
+    icu_codes.load(path)
+    assert os.path.exists(path + icu_codes.INDEX_SUFFIX)
+    with open(path, "a") as f:
+        f.write("9999,Newman,Nora,Ennis,IRL,1200\n")
+    os.utime(path, (time.time() + 10, time.time() + 10))
+    assert icu_codes.load(path).lookup("Newman, Nora").code == "9999"
+
+def test_assign_codes(tmp_path, capsys):
+    index = sample_index(tmp_path)
+    players = [parsechessresults.Player(name) for name in ("Quinn, Mark", "Murphy, John", "Nobody, At All")]
+    icu_codes.assign_codes(players, index)
+    assert [p.icu_code for p in players] == ["1350", "????", "????"]
+    err = capsys.readouterr().err
+    assert "Ambiguous ICU code for Murphy, John" in err
+    assert "No ICU code found for Nobody, At All" in err
+
+def test_surname_only_near_miss_is_not_assigned(tmp_path, capsys):
+    index = sample_index(tmp_path)
+    players = [parsechessresults.Player(name, fed="IRL") for name in ("Quinn, Mary", "Quinn, Marcus")]
+    icu_codes.assign_codes(players, index)
+    assert [p.icu_code for p in players] == ["????", "????"]
+    err = capsys.readouterr().err
+    assert "No ICU code for Quinn, Mary; closest names: Quinn,Mark (1350)" in err
+
+def test_assign_codes_breaks_ties_with_fed_and_rating(tmp_path):
+    index = sample_index(tmp_path)
+    players = [parsechessresults.Player("Murphy, John", fed="NIR"),
+               parsechessresults.Player("Kelly, Sean", fed="IRL", rating=1598)]
+    icu_codes.assign_codes(players, index)
+    assert [p.icu_code for p in players] == ["6023", "7311"]
+
+class CountingList(list):
+    """a list that counts the items read from it"""
+    reads = 0
+
+    def __getitem__(self, i):
+        self.reads += 1
+        return list.__getitem__(self, i)
+
+def test_fuzzy_lookup_does_not_scan_every_member():
+    rng = random.Random(1)
+    def word():
+        return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(5, 9))).title()
+    names = ["%s,%s" % (word(), word()) for _ in range(20000)]
+    index = icu_codes.IcuIndex([icu_codes.Member(str(i), name) for i, name in enumerate(names)])
+    index.gram_counts = CountingList(index.gram_counts)
+    match = index.lookup(names[7] + "x")
+    assert (match.kind, match.candidates[0].icu_id) == ("fuzzy", "7")
+    # only the members sharing a trigram with the name are scored
+    assert 0 < index.gram_counts.reads < len(names) // 10
@@ -0,0 +1,62 @@
+import pickle
+import shutil
+
+import name_splits
+import parsechessresults
+
+FIDE_NAMES = [
+    "Garcia Lopez, Ana Maria",
+    "Van der Berg, Pieter",
+    "Mac an Bhaird, Cathal",
+    "Kelly, Sean Og",
+    "Smith Jones, Tom",
+    "Smith, Jones Tom",
+    "Quinn, Mark",
+]
+
+
+def test_only_differences_from_the_heuristic_are_kept():
+    index = name_splits.build_index(FIDE_NAMES)
+    # Van der Berg and Mac an Bhaird are already split right by the heuristic,
+    # and "Smith Jones Tom" is split two ways by FIDE
+    assert index == {"garcia lopez ana maria": 2}
+
+def test_split_uses_index_then_heuristic():
+    name_splits.configure(index=name_splits.build_index(FIDE_NAMES))
+    try:
+        assert name_splits.split("Garcia Lopez Ana Maria") == "Garcia Lopez,Ana Maria"
+        assert name_splits.split("GARCIA LOPEZ  Ana Maria") == "GARCIA LOPEZ,Ana Maria"
+        assert name_splits.split("Van der Berg Pieter") == "Van der Berg,Pieter"
+        assert name_splits.split("Smith Jones Tom") == "Smith,Jones Tom"
+        assert parsechessresults.commaize("Kelly Sean Og") == "Kelly,Sean Og"
+    finally:
+        name_splits.configure(index={})
+
+def test_build_and_load(tmp_path):
+    source = str(tmp_path / "list.xml")
+    shutil.copy("data/fide_sample.xml", source)
+    index_path = str(tmp_path / "names.pickle")
+    assert name_splits.build(source, index_path) == {}
+    assert name_splits.load(index_path) == {}
+    assert name_splits.load(str(tmp_path / "missing.pickle")) == {}
+
+def test_apply_commas_falls_back_for_missing_names():
+    name_splits.configure(index={})
+    player = parsechessresults.Player("Quinn Mark")
+    player.results[1] = parsechessresults.PlayerResult("Quinn Mark", 1, 1, parsechessresults.Colour.WHITE,
+                                                       "Van der Berg Pieter", 2000, "", "NED")
+    parsechessresults.apply_commas([player], {"Quinn Mark": "Quinn,Mark"})
+    assert player.name == "Quinn,Mark"
+    assert player.results[1].opp_name == "Van der Berg,Pieter"
+
+def test_index_is_opt_in(tmp_path):
+    index_path = str(tmp_path / "names.pickle")
+    with open(index_path, "wb") as f:
+        pickle.dump((name_splits.INDEX_VERSION, name_splits.build_index(FIDE_NAMES)), f)
+    try:
+        name_splits.configure(index_path)
+        assert name_splits.split("Garcia Lopez Ana Maria") == "Garcia Lopez,Ana Maria"
+        name_splits.configure()
+        assert name_splits.split("Garcia Lopez Ana Maria") == "Garcia,Lopez Ana Maria"
+    finally:
+        name_splits.configure()
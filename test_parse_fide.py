@@ -0,0 +1,65 @@
+import zipfile
+from collections import Counter
+
+import parse_fide
+
+SAMPLE = "data/fide_sample.xml"
+
+
+def test_iter_players_filters_by_federation():
+    totals = Counter()
+    irish = list(parse_fide.iter_players(SAMPLE, "IRL", totals))
+    assert len(irish) == 5
+    assert all(p.country == "IRL" for p in irish)
+    assert totals == {"IRL": 5, "ENG": 1, "GER": 2}
+
+def test_player_fields():
+    player = next(parse_fide.iter_players(SAMPLE))
+    assert player.fideid == 2500035
+    assert player.name == "Quinn, Mark"
+    assert player.title == "IM"
+    assert player.rating == 2351
+    assert player.birthday == 1976
+    assert parse_fide.is_active(player)
+
+def test_rating_predicates():
+    players = {p.name: p for p in parse_fide.iter_players(SAMPLE, "IRL")}
+    kenny = players["Kenny, William"]
+    assert not parse_fide.has_standard_rating(kenny)
+    assert parse_fide.has_rapid_rating(kenny)
+    assert parse_fide.has_any_rating(kenny)
+    murphy = players["Murphy, Sean"]
+    assert not parse_fide.is_active(murphy)
+    assert not parse_fide.has_any_rating(murphy)
+
+def test_aggregate_all_federations_in_one_pass():
+    stats = parse_fide.aggregate(parse_fide.iter_players(SAMPLE))
+    assert sorted(stats) == ["ENG", "GER", "IRL"]
+    irl = stats["IRL"]
+    assert irl.players == 5
+    assert irl.active == 3
+    assert irl.standard == 3
+    assert irl.active_standard == 2
+    assert irl.active_any == 3
+    assert irl.active_not_standard == 1
+    assert irl.histogram == {2300: 1, 1800: 1}
+    assert stats["GER"].active_standard == 1
+
+def fields(players):
+    return [[getattr(p, field) for field in parse_fide.FidePlayer.__slots__] for p in players]
+
+def test_txt_list_matches_xml():
+    expected = fields(parse_fide.iter_players(SAMPLE))
+    assert fields(parse_fide.iter_players("data/fide_sample.txt")) == expected
+    totals = Counter()
+    german = list(parse_fide.iter_players("data/fide_sample.txt", "GER", totals))
+    assert [p.name for p in german] == ["Müller, Reinhold", "Heitz, Timo"]
+    assert totals == {"IRL": 5, "ENG": 1, "GER": 2}
+
+def test_zipped_lists(tmp_path):
+    expected = fields(parse_fide.iter_players(SAMPLE))
+    for source, member in [(SAMPLE, "players_list_xml_foa.xml"), ("data/fide_sample.txt", "players_list_foa.txt")]:
+        path = tmp_path / (member + ".zip")
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.write(source, member)
+        assert fields(parse_fide.iter_players(str(path))) == expected
@@ -1,5 +1,16 @@
 import parsechessresults as parse
 import bs4
+import http.client
+import io
+import json
+import subprocess
+import sys
+import urllib.error
+
+import openpyxl
+import pytest
+
+import fide_cache
 
 # These tests may break when chess-results updates their format.
 # For the most part, they should be considered integration tests.
@@ -16,6 +27,7 @@ def test_chessresults_individual_auto_1():
         assert len(player.results) == 9
         assert player.score == 4.5
 
+@pytest.mark.network
 def test_chessresults_individual_auto2():
     """Parse an individual from chess-results.com"""
     url = "http://chess-results.com/tnr367947.aspx?lan=1&art=9&fedb=IRL&fed=IRL&turdet=YES&flag=30&snr=42"
@@ -26,6 +38,7 @@ def test_chessresults_individual_auto2():
     assert player.name == "Venkatesan,Kavin"
     assert player.score == 3.5
 
+@pytest.mark.network
 def test_chessresults_team1():
     """Parse many results from chess-results.com2"""
     url = "http://chess-results.com/tnr373918.aspx?lan=1&art=20&fed=IRL&flag=30"
@@ -39,6 +52,7 @@ def test_chessresults_team1():
     names = [player.name for player in players]
     assert "Kenny,William" in names
 
+@pytest.mark.network
 def test_chessresults_team_excel():
     """Parse many results from chess-results Excel format"""
     url = "http://chess-results.com/tnr385901.aspx?lan=1&zeilen=0&art=25&fedb=IRL&turdet=YES&flag=30&prt=4&excel=2010"
@@ -48,6 +62,7 @@ def test_chessresults_team_excel():
     names = [player.name for player in players]
     assert "Plaza Reino,Mercedes" in names
 
+@pytest.mark.network
 def test_4ncl_1():
     """Parse 4ncl site"""
     url = "http://www.4nclresults.co.uk/2018-19/4ncl/1/2b/export/"
@@ -67,3 +82,318 @@ def test_commas():
         assert replaced == exp
 
 
+
+def fake_4ncl_opener(pages):
+    """an insecure_urlopen stand-in serving {url : filename}; other urls fail"""
+    def opener(url):
+        if url not in pages:
+            raise urllib.error.URLError("no route to %s" % url)
+        return io.BytesIO(open(pages[url], "rb").read())
+    return opener
+
+def test_4ncl_round_urls():
+    url = "http://www.4nclresults.co.uk/2018-19/4ncl/1/2b/export/"
+    assert parse.fourncl_round_urls(url, "12") == [
+        (1, "http://www.4nclresults.co.uk/2018-19/4ncl/1/2b/export/"),
+        (2, "http://www.4nclresults.co.uk/2018-19/4ncl/2/2b/export/")]
+    assert parse.fourncl_round_urls(url, "72b,82c") == [
+        (7, "http://www.4nclresults.co.uk/2018-19/4ncl/7/2b/export/"),
+        (8, "http://www.4nclresults.co.uk/2018-19/4ncl/8/2c/export/")]
+
+def test_4ncl_concurrent_rounds(monkeypatch):
+    """Rounds are fetched together and merged in round order"""
+    base = "http://www.4nclresults.co.uk/2018-19/4ncl/%d/2b/export/"
+    monkeypatch.setattr(parse, "insecure_urlopen", fake_4ncl_opener(
+        {base % rd: "data/4ncl_round.html" for rd in (1, 2, 3)}))
+    event, players = parse.parse(base % 1, "123")
+    assert event == "4NCL Rounds 1-3"
+    assert [player.name for player in players] == ["Jessel,Stephen", "Quinn,Mark", "Dwyer,Daniel", "O'Connor,Aoife"]
+    assert sorted(players[0].results) == [1, 2, 3]
+    assert players[0].score == 3
+
+def test_4ncl_failed_round_keeps_the_rest(monkeypatch, capsys):
+    base = "http://www.4nclresults.co.uk/2018-19/4ncl/%d/2b/export/"
+    monkeypatch.setattr(parse, "insecure_urlopen", fake_4ncl_opener({base % 1: "data/4ncl_round.html"}))
+    event, players = parse.parse(base % 1, "12")
+    assert len(players) == 4
+    assert sorted(players[0].results) == [1]
+    assert "Error opening URL %s" % (base % 2) in capsys.readouterr().err
+
+def test_4ncl_broken_response_keeps_the_rest(monkeypatch, capsys):
+    base = "http://www.4nclresults.co.uk/2018-19/4ncl/%d/2b/export/"
+    serve = fake_4ncl_opener({base % 1: "data/4ncl_round.html"})
+    def opener(url):
+        if url == base % 2:
+            raise http.client.IncompleteRead(b"<html>")
+        return serve(url)
+    monkeypatch.setattr(parse, "insecure_urlopen", opener)
+    event, players = parse.parse(base % 1, "12")
+    assert sorted(players[0].results) == [1]
+    assert "Error opening URL %s" % (base % 2) in capsys.readouterr().err
+
+def test_4ncl_every_round_failed(monkeypatch):
+    base = "http://www.4nclresults.co.uk/2018-19/4ncl/%d/2b/export/"
+    monkeypatch.setattr(parse, "insecure_urlopen", fake_4ncl_opener({}))
+    with pytest.raises(urllib.error.URLError):
+        parse.parse(base % 1, "12")
+
+def test_chessresults_team_local():
+    """Parse a saved team composition page"""
+    event, players = parse.parse("data/team_sample.html")
+    assert event == "34th European Club Cup 2018"
+    assert [player.name for player in players] == ["Quinn,Mark", "Dwyer,Daniel"]
+    assert players[0].score == 1.5
+    assert players[0].results[3].opp_name == "Van der Berg,Jan"
+    assert (players[0].fed, players[0].rating) == (None, 2351)
+    assert players[1].results[2].opp_rating == ""
+
+def test_results_fragment_matches_full_parse():
+    """Parsing only the results dialog gives the same players as the whole page"""
+    for filename in ["data/belyaladya1.html", "data/team_sample.html"]:
+        with open(filename, "rb") as f:
+            data = parse.preprocess_chessresults_html(f.read())
+        fragment = parse.results_fragment(data)
+        assert fragment.startswith(b"<div") and fragment.endswith(b"</div>")
+        assert len(fragment) < len(data)
+        event, players = parse.parse_chessresults_html(data)
+        soup = bs4.BeautifulSoup(data, 'html.parser')
+        assert event == soup.title.text.split(" - ")[1].strip()
+        full = parse.parse_team(soup) if "team" in filename else [parse.parse_individual_auto(soup)]
+        assert parse.format_output(event, players, filename) == parse.format_output(event, full, filename)
+
+def test_results_fragment_falls_back_to_full_page():
+    data = b"<html><head><title>Chess-results - Some Open</title></head><body><p>Player info</p></body></html>"
+    assert parse.results_fragment(data) is None
+
+def xlsx_bytes(sheets):
+    """an xlsx file with {sheet name : [row values]}, starting at A1"""
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    for name, rows in sheets.items():
+        ws = wb.create_sheet(name)
+        for row in rows:
+            ws.append(row)
+    f = io.BytesIO()
+    wb.save(f)
+    return f.getvalue()
+
+TEAM_XLSX = {
+    "TeamComposition": [["Team composition"], ["World Youth Chess Championships 2018"]],
+    "PlayerInfo": [
+        ["Player info"],
+        ["Plaza Reino Mercedes 1800 IRL"],
+        ["Rd.", "SNo", "", "Name", "Rtg", "FED", "Rp", "Pts.", "Res."],
+        [1, 45, "WFM", "Smith Jane ", 1950, "ENG", None, 3.5, "w 1"],
+        [2, 12, None, "Van der Berg Anna", 2010, "NED", None, 4, "s ½"],
+        [3, None, None, "bye", None, None, None, None, "- 1K"],
+        ["O Brien Kate WCM 1700"],
+        [1, 46, None, "Jones Mary", 1600, "WLS", None, 2, "s 0"],
+    ],
+    "PlayerPairings": [
+        ["Player pairings"], [], ["Bo.", "", "Name", "Pts.", "Result", "Name"],
+        [1, None, "Plaza Reino, Mercedes", "0", "1 - 0", "Smith, Jane"],
+        [2, None, "Van der Berg, Anna", "1", "½ - ½", "Plaza Reino, Mercedes (b)"],
+        [3, None, "O Brien, Kate", "0", "0 - 1", "Jones, Mary"],
+    ],
+}
+
+def test_team_from_xlsx_read_only():
+    wb = openpyxl.load_workbook(io.BytesIO(xlsx_bytes(TEAM_XLSX)), read_only=True)
+    players = parse.parse_team_from_xlsx(wb)
+    parse.apply_commas(players, parse.parse_commas_from_player_pairings(wb))
+    assert parse.workbook_event(wb) == "World Youth Chess Championships 2018"
+    assert [player.name for player in players] == ["Plaza Reino, Mercedes", "O Brien, Kate"]
+    assert players[0].score == 2.5
+    assert sorted(players[0].results) == [1, 2] # the walkover is scored but not rated
+    result = players[0].results[2]
+    assert (result.opp_name, result.opp_rating, result.opp_fed, result.colour) == (
+        "Van der Berg, Anna", 2010, "NED", parse.Colour.BLACK)
+    assert players[0].results[1].opp_title == "WFM"
+    assert (players[0].fed, players[0].rating) == ("IRL", 1800)
+
+def test_player_details_wider_than_26_columns():
+    """Columns come from the heading row, so wide sheets work"""
+    extra = ["x%d" % i for i in range(30)]
+    sheets = {"PlayerDetails": [
+        ["Player details"],
+        ["Quinn Mark IM 2351"],
+        ["Rd."] + extra + ["", "Name", "Rtg", "Res."],
+        [1] + extra + ["FM", "Hughes Alan", 2105, "w 1"],
+    ]}
+    wb = openpyxl.load_workbook(io.BytesIO(xlsx_bytes(sheets)), read_only=True)
+    players = parse.parse_team_from_xlsx(wb)
+    assert players[0].name == "Quinn Mark"
+    result = players[0].results[1]
+    assert (result.opp_title, result.opp_name, result.opp_rating, result.opp_fed) == ("FM", "Hughes Alan", 2105, "***")
+
+def test_crosstable_filtered_by_federation():
+    """Every Irish player's results from one crosstable page"""
+    event, players = parse.parse("data/crosstable_sample.html", fed="IRL")
+    assert event == "Bunratty Masters 2024"
+    assert [player.name for player in players] == ["Quinn,Mark", "O'Connor,Aoife", "Dwyer,Daniel"]
+    quinn = players[0]
+    assert quinn.score == 2.5
+    result = quinn.results[2]
+    assert (result.opp_name, result.opp_rating, result.opp_title, result.opp_fed, result.score, result.colour) == (
+        "Hughes,Alan", "2405", "GM", "ENG", "=", parse.Colour.WHITE)
+    assert quinn.results[3].opp_rating == ""
+    # a bye and a forfeit count for the total but are not rated games
+    assert players[1].score == 1 and sorted(players[1].results) == [1, 2]
+    assert players[2].score == 1 and sorted(players[2].results) == [1]
+    assert (quinn.fed, quinn.rating) == ("IRL", 2351)
+    event, everyone = parse.parse("data/crosstable_sample.html")
+    assert len(everyone) == 6
+
+def test_crosstable_from_xlsx():
+    sheets = {"Sheet1": [
+        ["Bunratty Masters 2024"], ["Final ranking crosstable"],
+        ["Rk.", "", "Name", "RtgI", "FED", "1.Rd", "2.Rd", "Pts."],
+        [1, "IM", "Quinn Mark", 2351, "IRL", "2w1", "3b1", 2],
+        [2, None, "Hughes Alan", 2105, "ENG", "1b0", "-1", 1],
+        [3, None, "Dwyer Daniel", 1864, "IRL", "-0", "1w0", 0],
+    ]}
+    event, players = parse.parse_xlsx_data(xlsx_bytes(sheets), "IRL")
+    assert event == "Bunratty Masters 2024"
+    assert [player.name for player in players] == ["Quinn,Mark", "Dwyer,Daniel"]
+    assert players[0].results[1].opp_name == "Hughes,Alan"
+    assert players[0].results[2].colour == parse.Colour.BLACK
+    assert players[1].results[2].opp_rating == "2351"
+
+def test_crosstable_event_without_a_title():
+    with open("data/crosstable_sample.html", "rb") as f:
+        data = f.read()
+    untitled = parse.TITLE_RE.sub(b"", data)
+    assert parse.parse_crosstable_page(untitled)[0] == "Bunratty Masters 2024"
+    with pytest.raises(ValueError):
+        parse.parse_crosstable_page(parse.HEADING_RE.sub(b"", untitled))
+
+def test_4ncl_every_team_in_one_pass():
+    with open("data/4ncl_round.html", "rb") as f:
+        soup = bs4.BeautifulSoup(f.read(), 'html.parser')
+    matches = parse.parse_4ncl_matches(soup, 1)
+    assert sorted(matches) == [("Brown Jack", 1), ("Celtic Tigers", 1), ("Gonzaga", 1), ("Wood Green 3", 1)]
+    tigers = matches[("Celtic Tigers", 1)]
+    assert [player.name for player in tigers] == ["Hughes,Alan", "Mills,Eleanor", "Patel,Ravi", "Green,Tom"]
+    assert [player.score for player in tigers] == [0, 0.5, 1, 0]
+    assert [player.rating for player in tigers] == [2105, 2210, 1990, 1850]
+    result = tigers[0].results[1]
+    assert (result.opp_name, result.opp_rating, result.colour) == ("Jessel, Stephen", 2047, parse.Colour.BLACK)
+    assert [player.name for player in parse.parse_4ncl(soup, 1)] == [player.name for player in matches[("Gonzaga", 1)]]
+    # the default on board 5 and the empty board 6 are not games
+    assert [player.name for player in matches[("Brown Jack", 1)]] == ["Lowe,Peter", "Baker,Sue", "Cole,Ian", "Dunne,John P."]
+
+def test_4ncl_several_teams(monkeypatch):
+    base = "http://www.4nclresults.co.uk/2018-19/4ncl/%d/2b/export/"
+    monkeypatch.setattr(parse, "insecure_urlopen", fake_4ncl_opener(
+        {base % rd: "data/4ncl_round.html" for rd in (1, 2)}))
+    event, players = parse.parse(base % 1, "12", teams=["Gonzaga", "Wood Green 3"])
+    assert len(players) == 8
+    assert players[4].name == "Kenny,William"
+    assert players[4].score == 2
+    event, players = parse.parse(base % 1, "12", teams=["all"])
+    assert len(players) == 16
+
+def test_merge_players():
+    first = parse.Player("Jessel,Stephen")
+    first.results[1] = parse.PlayerResult(first, 1, "1")
+    first.score = 1
+    again = parse.Player("jessel, Stephen")
+    again.results[2] = parse.PlayerResult(again, 2, "=")
+    again.score = 0.5
+    other = parse.Player("Quinn,Mark")
+    players = [first]
+    merged = parse.merge_players(players, [again, other])
+    assert merged is players
+    assert merged == [first, other]
+    assert sorted(first.results) == [1, 2]
+    assert first.score == 1.5
+
+def test_player_registry_across_events():
+    registry = parse.PlayerRegistry()
+    for event, score in [("Bunratty", 2.5), ("Kilkenny", 3)]:
+        player = parse.Player("Quinn,Mark")
+        player.score = score
+        registry.merge([player], source=event)
+    assert len(registry) == 1
+    assert registry.get("QUINN, MARK").score == 5.5
+    assert registry.sources["quinn, mark"] == ["Bunratty", "Kilkenny"]
+
+def test_4ncl_title():
+    assert parse.parse_4ncl_title("wi") == "WIM"
+    assert parse.parse_4ncl_title("g*") == "GM"
+
+def test_4ncl_opponents_from_fide_list(monkeypatch, tmp_path):
+    base = "http://www.4nclresults.co.uk/2018-19/4ncl/%d/2b/export/"
+    monkeypatch.setattr(parse, "insecure_urlopen", fake_4ncl_opener({base % 1: "data/4ncl_round.html"}))
+    fide_list = fide_cache.load("data/fide_sample.xml", str(tmp_path / "sample.fidecache"))
+    event, players = parse.parse(base % 1, "1", teams=["Celtic Tigers"], fide_list=fide_list)
+    results = {result.opp_name: result for player in players for result in player.results.values()}
+    assert [(r.opp_fed, r.opp_rating, r.opp_title) for r in (results["Quinn, Mark"], results["O'Connor, Aoife"])] == [
+        ("IRL", 2351, "IM"), ("IRL", 1988, "WFM")]
+    fide_list.close()
+
+def test_4ncl_opponent_without_fide_rating(monkeypatch, tmp_path, capsys):
+    base = "http://www.4nclresults.co.uk/2018-19/4ncl/%d/2b/export/"
+    monkeypatch.setattr(parse, "insecure_urlopen", fake_4ncl_opener({base % 1: "data/4ncl_round.html"}))
+    fide_list = fide_cache.load("data/fide_sample.xml", str(tmp_path / "sample.fidecache"))
+    event, players = parse.parse(base % 1, "1", teams=["all"], fide_list=fide_list)
+    fide_list.close()
+    kenny = [result for player in players for result in player.results.values() if result.opp_name == "Kenny, William"]
+    assert [(r.opp_fed, r.opp_rating) for r in kenny] == [("IRL", 0)]
+    assert "Kenny, William has no standard FIDE rating: output unrated instead of 2190" in capsys.readouterr().err
+
+def test_sniffing_picks_the_parser():
+    pages = {"data/team_sample.html": "team", "data/crosstable_sample.html": "crosstable",
+             "data/belyaladya1.html": "individual"}
+    for filename, kind in pages.items():
+        with open(filename, "rb") as f:
+            assert parse.sniff(f.read())[0] == kind
+    assert parse.sniff(xlsx_bytes(TEAM_XLSX))[0] == "xlsx"
+
+def test_sniffing_a_long_page_with_late_markers():
+    with open("data/team_sample.html", "rb") as f:
+        data = f.read()
+    padded = data.replace(b"<body>", b"<body>" + b"<!-- advert -->" * (parse.SNIFF_BYTES // 10), 1)
+    assert padded.find(b"Team composition") > parse.SNIFF_BYTES
+    assert parse.sniff(padded)[0] == "team"
+
+def test_local_excel_export(tmp_path):
+    path = tmp_path / "team.xlsx"
+    path.write_bytes(xlsx_bytes(TEAM_XLSX))
+    event, players = parse.parse(str(path))
+    assert event == "World Youth Chess Championships 2018"
+    assert [player.name for player in players] == ["Plaza Reino, Mercedes", "O Brien, Kate"]
+
+def test_registered_page_parser(monkeypatch):
+    def parse_swiss_manager(data, fed=None):
+        player = parse.Player("Quinn,Mark")
+        player.results[1] = parse.PlayerResult(player, 1, "1", parse.Colour.WHITE, "Hughes,Alan", 2105, "", "ENG")
+        return "Swiss-Manager event", [player]
+    monkeypatch.setattr(parse, "PAGE_PARSERS", list(parse.PAGE_PARSERS))
+    parse.page_parser("swiss-manager", lambda head: head.startswith(b"SWISS"))(parse_swiss_manager)
+    assert parse.parse_chessresults_html(b"SWISS-MANAGER export")[0] == "Swiss-Manager event"
+
+def test_preprocess_in_one_pass():
+    page = b'<div class="FarbewT"/></div><div class="FarbesT"/></div>'
+    assert parse.preprocess_chessresults_html(page) == b'<div class="FarbewT"></div><div class="FarbesT"></div>'
+    clean = b"<html>nothing to fix</html>"
+    assert parse.preprocess_chessresults_html(clean) == clean
+
+STARTUP_SCRIPT = """
+import json, sys
+import parsechessresults
+imported = set(sys.modules)
+parsechessresults.parse("data/crosstable_sample.html", fed="IRL")
+print(json.dumps({"imported": sorted(imported), "parsed": sorted(sys.modules)}))
+"""
+
+def test_startup_imports():
+    """Importing the script loads none of the heavy modules, and a saved HTML page only adds bs4"""
+    result = json.loads(subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], check=True,
+                                       capture_output=True, text=True).stdout)
+    for module in ["bs4", "openpyxl", "ssl", "urllib.request", "http.server", "concurrent.futures",
+                   "fide_cache", "icu_codes", "cProfile", "tracemalloc"]:
+        assert module not in result["imported"]
+    for module in ["openpyxl", "ssl", "urllib.request", "http.server"]:
+        assert module not in result["parsed"]
+    assert "bs4" in result["parsed"]
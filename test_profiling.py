@@ -0,0 +1,59 @@
+import json
+import os
+import threading
+
+import parsechessresults
+import profiling
+
+
+def test_stages_are_recorded(tmp_path):
+    profiling.start(with_memory=True)
+    try:
+        parsechessresults.output(*parsechessresults.parse("data/team_sample.html"), "data/team_sample.html")
+    finally:
+        profiling.stop()
+    stages = {stage["name"]: stage for stage in profiling.results()}
+    assert list(stages) == ["fetch", "preprocess", "soup", "extract", "output"]
+    assert stages["fetch"]["bytes"] == os.path.getsize("data/team_sample.html")
+    assert stages["extract"]["rows"] == 6
+    assert all(stage["calls"] == 1 and stage["peak_bytes"] > 0 for stage in stages.values())
+    profiling.write_json(str(tmp_path / "profile.json"))
+    assert json.loads((tmp_path / "profile.json").read_text())["stages"][0]["name"] == "fetch"
+
+def test_nested_peak_and_timed_iterables():
+    profiling.start(with_memory=True)
+    try:
+        with profiling.stage("outer"):
+            with profiling.stage("inner"):
+                big = bytearray(4000000)
+            del big
+        assert list(profiling.timed(iter(range(3)), "wait")) == [0, 1, 2]
+    finally:
+        profiling.stop()
+    assert profiling.stages["outer"].peak >= profiling.stages["inner"].peak >= 4000000
+    assert profiling.stages["wait"].calls == 4
+
+def test_off_costs_almost_nothing():
+    assert not profiling.enabled
+    assert profiling.stage("soup") is profiling.stage("extract")
+    items = iter(range(3))
+    assert profiling.timed(items, "fetch") is items
+    recorded = {name: (stats.calls, stats.rows) for name, stats in profiling.stages.items()}
+    with profiling.stage("soup") as s:
+        s.add(rows=1)
+    assert {name: (stats.calls, stats.rows) for name, stats in profiling.stages.items()} == recorded
+
+def test_only_the_main_thread_is_recorded():
+    profiling.start()
+    try:
+        def work():
+            with profiling.stage("fetch") as s:
+                s.add(bytes=10)
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+        with profiling.stage("soup"):
+            pass
+    finally:
+        profiling.stop()
+    assert list(profiling.stages) == ["soup"]
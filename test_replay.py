@@ -0,0 +1,52 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+import http_cache
+import parsechessresults
+import replay
+
+FOURNCL = "http://www.4nclresults.co.uk/2018-19/4ncl/%d/2b/export/"
+
+
+def fourncl_archive(directory):
+    archive = replay.Archive(str(directory))
+    with open("data/4ncl_round.html", "rb") as f:
+        body = f.read()
+    for rd in (1, 2):
+        archive.save(FOURNCL % rd, body)
+    return archive
+
+def test_replay_parses_without_network(tmp_path, monkeypatch):
+    fourncl_archive(tmp_path / "archive")
+    monkeypatch.setattr(http_cache, "default_cache", http_cache.HttpCache(
+        str(tmp_path / "cache"), replay=str(tmp_path / "archive")))
+    event, players = parsechessresults.parse(FOURNCL % 1, "12")
+    assert sorted(players[0].results) == [1, 2]
+    # https and http versions of a URL are the same page
+    assert http_cache.default_cache.fetch((FOURNCL % 1).replace("http:", "https:"))
+    with pytest.raises(http_cache.OfflineError):
+        http_cache.default_cache.fetch(FOURNCL % 3)
+
+def test_record_then_serve(tmp_path):
+    served = replay.start_server(str(fourncl_archive(tmp_path / "source").directory))
+    proxy = "http://127.0.0.1:%d" % served.server_port
+    cache = http_cache.HttpCache(str(tmp_path / "cache"), enabled=False, record=str(tmp_path / "recorded"))
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({"http": proxy}))
+    cache.request = lambda url, headers, insecure=False: opener.open(urllib.request.Request(url, headers=headers))
+    body = cache.fetch(FOURNCL % 1)
+    assert replay.Archive(str(tmp_path / "recorded")).urls() == [FOURNCL % 1]
+    assert replay.Archive(str(tmp_path / "recorded")).body(FOURNCL % 1) == body
+
+    response = opener.open(FOURNCL % 2)
+    etag = response.headers["ETag"]
+    assert response.read() == body
+    with pytest.raises(urllib.error.HTTPError) as e:
+        opener.open(urllib.request.Request(FOURNCL % 2, headers={"If-None-Match": etag}))
+    assert e.value.code == 304
+    with pytest.raises(urllib.error.HTTPError) as e:
+        opener.open(FOURNCL % 3)
+    assert e.value.code == 404
+    served.shutdown()
+    served.server_close()
@@ -0,0 +1,67 @@
+import parsechessresults
+import results_db
+
+SAMPLE = "data/crosstable_sample.html"
+
+
+def sample_db(tmp_path):
+    db = results_db.ResultsDb(str(tmp_path / "results.db"))
+    event, players = parsechessresults.parse(SAMPLE, fed="IRL")
+    return db, event, players
+
+def test_export_matches_parse(tmp_path):
+    db, event, players = sample_db(tmp_path)
+    assert db.add_event(event, players, SAMPLE) == sum(len(player.results) for player in players)
+    assert db.export(SAMPLE) == parsechessresults.format_output(event, players, SAMPLE)
+    db.close()
+
+def test_adding_again_skips_duplicates(tmp_path):
+    db, event, players = sample_db(tmp_path)
+    db.add_event(event, players, SAMPLE)
+    players[0].icu_code = "1350"
+    assert db.add_event(event, players, SAMPLE) == 0
+    assert db.events() == [(SAMPLE, event, len(players))]
+    assert db.load_event(SAMPLE)[1][0].icu_code == "1350"
+    db.close()
+
+def test_games(tmp_path):
+    db, event, players = sample_db(tmp_path)
+    db.add_event(event, players, SAMPLE)
+    name = players[0].name
+    games = db.games(name)
+    assert [game[4] for game in games] == sorted(players[0].results)
+    assert all(game[2] == name for game in games)
+    assert db.games(name, event="Bunratty%") == games
+    assert db.games(name, event="4NCL%") == []
+    assert db.load_event("nowhere") == (None, [])
+    db.close()
+
+def test_corrected_rounds_are_updated(tmp_path):
+    db, event, players = sample_db(tmp_path)
+    db.add_event(event, players, SAMPLE)
+    result = players[0].results[2]
+    result.score = "1"
+    assert db.add_event(event, players, SAMPLE) == 1
+    assert db.load_event(SAMPLE)[1][0].results[2].score == "1"
+    db.close()
+
+def test_rounds_and_players_gone_from_the_parse_are_deleted(tmp_path):
+    db, event, players = sample_db(tmp_path)
+    db.add_event(event, players, SAMPLE)
+    rd = max(players[0].results)
+    del players[0].results[rd]
+    withdrawn = players.pop()
+    assert db.add_event(event, players, SAMPLE) == 1 + len(withdrawn.results)
+    assert db.events() == [(SAMPLE, event, len(players))]
+    assert db.games(withdrawn.name) == []
+    assert db.export(SAMPLE) == parsechessresults.format_output(event, players, SAMPLE)
+    db.close()
+
+def test_result_without_a_colour(tmp_path):
+    db = results_db.ResultsDb(str(tmp_path / "results.db"))
+    player = parsechessresults.Player("Quinn,Mark")
+    player.results[1] = parsechessresults.PlayerResult(player, 1, "1", None, "Hughes,Alan", 2105, "", "ENG")
+    assert db.add_event("Bunratty", [player], "bunratty.html") == 1
+    assert db.load_event("bunratty.html")[1][0].results[1].colour is None
+    assert db.games("Quinn,Mark")[0][6] is None
+    db.close()
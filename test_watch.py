@@ -0,0 +1,97 @@
+import io
+import shutil
+import subprocess
+import sys
+import urllib.error
+
+import pytest
+
+import icu_codes
+import parsechessresults
+import results_db
+import watch
+
+
+class FakeCache:
+    """serves {url : filename}; other urls are not published yet"""
+    def __init__(self, pages):
+        self.pages = pages
+        self.fetched = []
+
+    def fetch(self, url, insecure=False):
+        self.fetched.append(url)
+        if url not in self.pages:
+            raise urllib.error.HTTPError(url, 404, "Not Found", {}, None)
+        with open(self.pages[url], "rb") as f:
+            return f.read()
+
+
+def test_4ncl_rounds_as_they_appear():
+    base = "http://www.4nclresults.co.uk/2018-19/4ncl/%d/2b/export/"
+    cache = FakeCache({base % 1: "data/4ncl_round.html"})
+    watcher = watch.Watcher(base % 1, "12", cache=cache)
+    changes = watcher.poll()
+    assert {change["round"] for change in changes} == {1}
+    assert all(change["change"] == "new" for change in changes)
+    assert watcher.poll() == []
+
+    cache.pages[base % 2] = "data/4ncl_round.html"
+    changes = watcher.poll()
+    assert {change["round"] for change in changes} == {2}
+    quinn = watcher.players["Quinn,Mark"]
+    assert sorted(quinn.results) == [1, 2]
+    assert watcher.event == parsechessresults.fourncl_event("12")
+    assert quinn.score == 2 * watcher.round_scores[("Quinn,Mark", 1)]
+    assert "Player,????,Quinn,Mark" in watcher.output()
+
+def test_unchanged_page_is_not_parsed_again(monkeypatch):
+    url = "https://chess-results.com/tnr1.aspx?lan=1&art=4"
+    watcher = watch.Watcher(url, fed="IRL", cache=FakeCache({url: "data/crosstable_sample.html"}))
+    changes = watcher.poll()
+    event, players = parsechessresults.parse("data/crosstable_sample.html", fed="IRL")
+    assert len(changes) == sum(len(player.results) for player in players)
+    assert watcher.output() == parsechessresults.format_output(event, players, url)
+
+    def fail(*args):
+        raise AssertionError("parsed an unchanged page")
+    monkeypatch.setattr(parsechessresults, "parse_chessresults_html", fail)
+    assert watcher.poll() == []
+
+
+class Stop(Exception):
+    pass
+
+def test_icu_codes_and_db(tmp_path, monkeypatch):
+    url = "https://chess-results.com/tnr1.aspx?lan=1&art=4"
+    members = str(tmp_path / "members.csv")
+    shutil.copy("data/icu_members.csv", members)
+    db = results_db.ResultsDb(str(tmp_path / "results.db"))
+    watcher = watch.Watcher(url, fed="IRL", cache=FakeCache({url: "data/crosstable_sample.html"}),
+                            icu_index=icu_codes.load(members), db=db)
+    def stop(seconds):
+        raise Stop()
+    monkeypatch.setattr(watch.time, "sleep", stop)
+    with pytest.raises(Stop):
+        watcher.run(60, out=io.StringIO())
+    assert watcher.players["Quinn,Mark"].icu_code == "1350"
+    event, players = db.load_event(url)
+    assert event == "Bunratty Masters 2024"
+    assert [player.icu_code for player in players if player.name == "Quinn,Mark"] == ["1350"]
+    db.close()
+
+def test_interrupt_stops_cleanly(monkeypatch, capsys):
+    url = "https://chess-results.com/tnr1.aspx?lan=1&art=4"
+    watcher = watch.Watcher(url, fed="IRL", cache=FakeCache({url: "data/crosstable_sample.html"}))
+    def interrupt(seconds):
+        raise KeyboardInterrupt()
+    monkeypatch.setattr(watch.time, "sleep", interrupt)
+    out = io.StringIO()
+    watcher.run(60, out=out)
+    # the first poll's changes were written before the interrupt
+    assert '"change": "new"' in out.getvalue()
+    assert "Stopped watching %s" % url in capsys.readouterr().err
+
+def test_import_does_not_load_bs4():
+    script = "import sys, watch; print('bs4' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", script], check=True, capture_output=True,
+                          text=True).stdout.strip() == "False"
@@ -0,0 +1,141 @@
+import json
+import sys
+import time
+import urllib.error
+
+import http_cache
+import icu_codes
+import parsechessresults
+
+
+"""Watch a live event and report each round as its results appear
+
+Every poll revalidates the event's pages with conditional requests (ETag /
+If-Modified-Since, through http_cache with a TTL of 0), so a page that has not
+changed costs a 304 and is not parsed again. For 4NCL each round is its own
+page, and only rounds whose page changed are parsed; a round not published yet
+just fails until it is. The results parsed are merged into the players kept
+from earlier polls, and only the rounds that are new or different are reported.
+
+Usage:
+    python parsechessresults.py URL --watch 60 [--watch-csv event.csv]
+    python parsechessresults.py 4NCL_URL 123456789 --team Gonzaga --watch 300
+
+Each change is written to stdout as a JSON line
+    {"change": "new" or "changed", "player": ..., "round": ..., "score": ..., "opponent": ...}
+and with --watch-csv the event's ICU-CSV is rewritten after every poll that changed anything.
+--fide-list, --icu-list and --db work as they do for a single parse: 4NCL
+opponents are looked up in the FIDE list, each new player gets an ICU code,
+and the event is saved to the database after every poll that changed anything."""
+
+
+def result_key(result):
+    return (result.score, result.colour, result.opp_name, result.opp_rating, result.opp_title, result.opp_fed)
+
+
+class Watcher:
+    def __init__(self, source, rounds=None, fed=None, teams=None, cache=None, fide_list=None, icu_index=None,
+                 db=None):
+        if not source.startswith("http"):
+            raise ValueError("can only watch pages on the web, not %s" % source)
+        self.source = source
+        self.fed = fed
+        self.teams = teams or [parsechessresults.TEAM_NAME]
+        if cache is None:
+            # always revalidate; a 304 costs no download and no parse
+            cache = http_cache.HttpCache(**dict(http_cache.default_cache.settings, host_ttl={}, default_ttl=0))
+        self.cache = cache
+        self.fide_list = fide_list
+        self.icu_index = icu_index
+        self.db = db
+        if "4nclresults.co.uk" in source:
+            if rounds is None:
+                raise ValueError("Need to specify round numbers for 4NCL results")
+            self.pages = parsechessresults.fourncl_round_urls(source, rounds)
+            self.event = parsechessresults.fourncl_event(rounds)
+        else:
+            self.pages = [(None, source)]
+            self.event = None
+        self.seen = {}
+        self.players = {}
+        # 4NCL scores, per (player name, round), since each page only has one round
+        self.round_scores = {}
+
+    def poll(self):
+        """Fetch the pages that changed and return the changes they made"""
+        changes = []
+        for rd, url in self.pages:
+            try:
+                data = self.cache.fetch(url, insecure=rd is not None)
+            except (urllib.error.URLError, OSError) as e:
+                if rd is None:
+                    print("Error opening URL %s: %s" % (url, e), file=sys.stderr)
+                continue
+            if self.seen.get(url) == data:
+                continue
+            self.seen[url] = data
+            if rd is None:
+                event, players = parsechessresults.parse_chessresults_html(data, self.fed)
+                self.event = event
+                changes += self.merge(players)
+            else:
+                # like parsechessresults, only load bs4 once there is a page to parse
+                import bs4
+                soup = bs4.BeautifulSoup(parsechessresults.preprocess_chessresults_html(data), "html.parser")
+                matches = parsechessresults.parse_4ncl_matches(soup, rd)
+                players = [player for (team, _), team_players in matches.items()
+                           if "all" in self.teams or team in self.teams for player in team_players]
+                if self.fide_list is not None:
+                    parsechessresults.enrich_opponents(players, self.fide_list)
+                changes += self.merge(players, rd)
+        return changes
+
+    def merge(self, players, rd=None):
+        """Merge freshly parsed players into those already known. rd is the round
+        a 4NCL page is for; a chess-results page has every round."""
+        changes = []
+        for parsed in players:
+            player = self.players.get(parsed.name)
+            if player is None:
+                player = self.players[parsed.name] = parsechessresults.Player(parsed.name, parsed.icu_code,
+                                                                              parsed.fed, parsed.rating)
+                if self.icu_index is not None:
+                    icu_codes.assign_codes([player], self.icu_index)
+            for result_rd, result in parsed.results.items():
+                old = player.results.get(result_rd)
+                if old is not None and result_key(old) == result_key(result):
+                    continue
+                player.results[result_rd] = result
+                changes.append({"change": "new" if old is None else "changed", "player": player.name,
+                                "round": result_rd, "score": result.score, "opponent": result.opp_name})
+            if rd is None:
+                player.score = parsed.score
+            else:
+                self.round_scores[(parsed.name, rd)] = parsed.score
+                player.score = sum(score for (name, _), score in self.round_scores.items() if name == parsed.name)
+        return changes
+
+    def played(self):
+        return [player for player in self.players.values() if player.results]
+
+    def output(self):
+        """the ICU-CSV for everything seen so far"""
+        return parsechessresults.format_output(self.event, self.played(), self.source)
+
+    def run(self, interval, csv_path=None, out=sys.stdout):
+        """Poll every interval seconds until interrupted with Ctrl-C"""
+        try:
+            while True:
+                changes = self.poll()
+                for change in changes:
+                    out.write(json.dumps(change) + "\n")
+                out.flush()
+                if changes and self.played():
+                    if csv_path:
+                        with open(csv_path, "w") as f:
+                            f.write(self.output() + "\n")
+                    if self.db is not None:
+                        self.db.add_event(self.event, self.played(), self.source)
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print("Stopped watching %s" % self.source, file=sys.stderr)